@@ -1,7 +1,8 @@
 import sys, os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from src.analysis.build_report import _parse_date, _is_legacy
+from src.analysis.dates import parse_date as _parse_date
+from src.analysis.build_report import _is_legacy
 import csv
 from pathlib import Path
 from datetime import datetime
@@ -2,10 +2,11 @@
 物料流转双向审计报告生成器
 
 输入（data/raw/）：
-  shop_orders_latest.json       — IMES 工单数据
-  bom_details_latest.json       — IMES BOM 明细
+  shop_orders_latest.jsonl.gz   — IMES 工单数据
+  bom_details_latest.jsonl.gz   — IMES BOM 明细
   inventory_latest.csv          — SSRS 线边仓库存
-  nwms_issue_details_latest.json — NWMS 发料行明细（可选，未运行时退化为三表分析）
+  nwms_issue_details_latest.jsonl.gz — NWMS 发料行明细（可选，未运行时退化为三表分析）
+  （*.jsonl.gz 为压缩 JSON Lines，见 src/scrapers/raw_store.py；兼容旧版 *_latest.json）
 
 输出（data/raw/）：
   alert_report.csv              — 退料预警（离场审计）：完工工单仍有线边仓库存
@@ -15,16 +16,25 @@
   python3 src/analysis/build_report.py
 """
 
-import json
 import csv
 import io
+import os
 from pathlib import Path
 from datetime import datetime
 from collections import defaultdict
+from src.analysis import inventory_columnar
+from src.analysis.dates import aging_days, parse_epoch, to_epoch
 from src.config.common_materials import COMMON_MATERIALS
+from src.scrapers.raw_store import latest_path, load_latest, read_records
 
 BASE = Path(__file__).parent.parent.parent / "data" / "raw"
 
+# 库存聚合实现：python（逐行）/ columnar（NumPy 列式，读 CSV 时更快，需安装 numpy；内存行始终逐行）
+INVENTORY_ENGINE = os.environ.get("INVENTORY_ENGINE", "python")
+
+# 增量分析：保留上一轮逐键结果，只重算变化的 (工单, 物料) 组与发料行（见 src/analysis/incremental.py）；0 关闭
+ANALYSIS_INCREMENTAL = os.environ.get("ANALYSIS_INCREMENTAL", "1") != "0"
+
 COMPLETED_STATUSES = {"Completado", "完成", "Completed", "已完成"}
 
 CURRENT_STATUSES  = {"Se ha iniciado la construcción"}
@@ -59,17 +69,14 @@ def _calc_reuse_label(mat: str, current_bom_mats: set, upcoming_bom_mats: set) -
 # 数据加载
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def load_shop_orders():
-    path = BASE / "shop_orders_latest.json"
-    with open(path, encoding="utf-8") as f:
-        orders = json.load(f)
+def load_shop_orders(records=None):
+    """records 为爬虫内存中的工单列表（调度器流水线模式）；None 时读 latest 快照"""
+    orders = load_latest("shop_orders") if records is None else records
     return {o["shopOrder"]: o for o in orders if o.get("shopOrder")}
 
 
-def load_bom():
-    path = BASE / "bom_details_latest.json"
-    with open(path, encoding="utf-8") as f:
-        rows = json.load(f)
+def load_bom(records=None):
+    rows = load_latest("bom_details") if records is None else records
     # 索引：(shopOrder, componentGbo) → bom行
     index = {}
     for r in rows:
@@ -79,23 +86,38 @@ def load_bom():
     return index
 
 
-def load_inventory():
+def _new_inventory_group() -> dict:
+    return {
+        "qty": 0.0, "barcodes": 0,
+        "desc": "", "warehouse": "", "unit": "",
+        "receive_time": "", "issue_time": "",
+        "barcode_list": [],
+    }
+
+
+def load_inventory(rows=None, engine: str = None):
     """
     返回两个结构：
     - grouped: (wo, mat) → 汇总数据，用于退料预警分析
     - raw_rows: 原始条码级行列表，用于生成 alert_report_detail.csv
+    rows 为库存爬虫流式解析出的行（调度器流水线模式）；None 时读 inventory_latest.csv
+    engine 为 None 时取 INVENTORY_ENGINE；columnar 由 inventory_columnar 实现，结果与逐行实现一致，
+    只用于读 CSV：内存行已是逐行 dict，转置成列与逐行聚合耗时相当，传入 rows 时总用逐行实现
     """
     path = BASE / "inventory_latest.csv"
-    with open(path, encoding="utf-8-sig") as f:
-        rows = list(csv.DictReader(f))
+    if rows is None and (engine or INVENTORY_ENGINE) == "columnar":
+        if inventory_columnar.available():
+            return inventory_columnar.aggregate(_new_inventory_group, path)
+        print("  [WARN] 未安装 numpy，库存聚合退回逐行实现")
+
+    if rows is None:
+        with open(path, encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
 
     raw_rows = []
-    grouped = defaultdict(lambda: {
-        "qty": 0.0, "barcodes": 0,
-        "desc": "", "warehouse": "", "unit": "",
-        "receive_time": "", "issue_time": "",
-        "barcode_list": [],
-    })
+    grouped = defaultdict(_new_inventory_group)
+    # 条码去重：每组一个按插入顺序的 dict（O(1) 查重），遍历结束后转回有序列表
+    barcode_sets = defaultdict(dict)
     for r in rows:
         wo = (r.get("指定工单") or "").strip()
         mat = (r.get("物料") or "").strip()
@@ -111,8 +133,8 @@ def load_inventory():
         g["qty"] += qty
         g["barcodes"] += 1
         barcode = r.get("条码", "").strip() or r.get("barcode", "").strip()
-        if barcode and barcode not in g["barcode_list"]:
-            g["barcode_list"].append(barcode)
+        if barcode:
+            barcode_sets[key][barcode] = None
         g["desc"] = g["desc"] or r.get("物料描述", "")
         g["warehouse"] = g["warehouse"] or r.get("线边仓描述", r.get("线边仓", ""))
         g["unit"] = g["unit"] or r.get("单位", "")
@@ -134,18 +156,21 @@ def load_inventory():
             "接收时间": r.get("接收时间", ""),
             "最新发料时间": r.get("最新发料单时间", ""),
         })
+    for key, barcodes in barcode_sets.items():
+        grouped[key]["barcode_list"] = list(barcodes)
 
     return grouped, raw_rows
 
 
-def load_nwms_lines():
-    """加载 NWMS 发料行明细，可选（文件不存在时返回空）"""
-    path = BASE / "nwms_issue_details_latest.json"
-    if not path.exists():
-        return None
-
-    with open(path, encoding="utf-8") as f:
-        rows = json.load(f)
+def load_nwms_lines(records=None):
+    """加载 NWMS 发料行明细，可选（文件不存在时返回空）；records 为爬虫内存中的行明细"""
+    if records is not None:
+        rows = records
+    else:
+        path = latest_path("nwms_issue_details")
+        if not path.exists():
+            return None
+        rows = read_records(path)
 
     # 按 componentCode 索引，同时处理 _workOrderNum 可能含多个工单（逗号分隔）
     # 返回结构：{componentCode: [{instructionDocId, workOrderNums:set, demandQty, actualQty, status, ...}]}
@@ -187,128 +212,148 @@ def load_nwms_lines():
     return by_component
 
 
+def bom_demand_orders(orders, inventory, nwms_by_component=None):
+    """
+    返回审计实际会查询 bom_index 的工单集合（供 BOM 爬虫按需拉取）：
+      - 线边仓库存中出现且在 IMES 工单窗口内的工单（退料预警 / 全量库存状态）
+      - NWMS 发料行关联且在工单窗口内的工单（超发预警 BOM 口径）
+      - 在制 / 待开工工单（reuse_label 复用集合）
+    """
+    needed = {wo for (wo, _mat) in inventory if wo in orders}
+    for lines in (nwms_by_component or {}).values():
+        for ln in lines:
+            needed |= {wo for wo in ln["workOrders"] if wo in orders}
+    needed |= {
+        wo for wo, order in orders.items()
+        if order.get("statusDesc", "") in CURRENT_STATUSES | UPCOMING_STATUSES
+    }
+    return needed
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
-# 分析 1：退料预警（离场审计）
-# 条件：工单已完成 AND 该工单+物料仍有线边仓库存
+# 分析 1：库存审计（单次遍历 (工单, 物料) 组）
+#   - 退料预警（离场审计）：工单已完成 AND 该工单+物料仍有线边仓库存
+#   - 全量库存状态（Phase 8）：所有有工单关联的库存组，附 wo_status_label / reuse_label
+#   - 分层计数：历史遗留 / 工单范围外（供 KPI 与数据质量统计）
+# 工单查找、BOM 理论余料、历史遗留判断、复用标签每组只算一次，接收时间每个取值只解析一次
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def build_return_alert(orders, bom_index, inventory):
-    """生成退料预警报告"""
-    current_bom_mats, upcoming_bom_mats = _build_reuse_sets(orders, bom_index)
-    results = []
+LEGACY_CUTOFF = datetime(2026, 1, 1)
+_LEGACY_EPOCH = to_epoch(LEGACY_CUTOFF)
 
-    for (wo, mat), inv in inventory.items():
-        order = orders.get(wo)
-        if not order:
-            continue
-        if order.get("statusDesc") not in COMPLETED_STATUSES:
-            continue
 
-        bom = bom_index.get((wo, mat))
-        qty_done = float(order.get("qtyDone") or 0)
-        qty_ordered = float(order.get("qtyOrdered") or 0)
+def _inventory_key_rows(wo, mat, inv, order, bom, reuse_sets, now_epoch):
+    """
+    单个 (工单, 物料) 组的审计结果：返回 (status_row, alert_row, received, is_legacy)
+      工单不在 IMES 窗口内时 status_row / alert_row 为 None；非已完工工单 alert_row 为 None
+      received 为接收日期的 epoch 秒（无法解析为 None），供增量分析刷新库龄
+    """
+    received = parse_epoch(inv["receive_time"])
+    is_legacy = received is None or received < _LEGACY_EPOCH
+    if not order:
+        return None, None, received, is_legacy  # 工单不在 IMES 窗口内，跳过
+
+    status_desc = order.get("statusDesc", "")
+    label = _wo_status_label(status_desc)
+    # reuse_label：仅对 completed 行判断
+    reuse = _calc_reuse_label(mat, *reuse_sets) if label == "completed" else ""
+
+    qty_done = float(order.get("qtyDone") or 0)
+    if bom:
+        unit_qty = float(bom.get("qty") or 0)
+        sum_qty = float(bom.get("sumQty") or 0)
+        theory_rem = sum_qty - qty_done * unit_qty
+    else:
+        unit_qty = sum_qty = theory_rem = None
+    actual_inv = inv["qty"]
+
+    status_row = {
+        "工单号":        wo,
+        "物料编号":      mat,
+        "物料描述":      inv["desc"],
+        "线边仓":        inv["warehouse"],
+        "单位":          inv["unit"],
+        "实际库存(合计)": round(actual_inv, 2),
+        "条码数":        inv["barcodes"],
+        "barcode_list":  inv.get("barcode_list", []),
+        "工单状态":      status_desc,
+        "wo_status_label": label,
+        "接收时间":      inv["receive_time"],
+        "is_legacy":     is_legacy,
+        "理论余料":      round(theory_rem, 2) if bom else 0.0,
+        "偏差(实际-理论)": round(actual_inv - theory_rem, 2) if bom and sum_qty > 0 else 0.0,
+        "reuse_label":   reuse,
+    }
 
-        if bom:
-            unit_qty = float(bom.get("qty") or 0)
-            sum_qty = float(bom.get("sumQty") or 0)
-            send_qty = float(bom.get("sendQty") or 0)
-            theoretical_remainder = sum_qty - qty_done * unit_qty
-        else:
-            unit_qty = sum_qty = send_qty = theoretical_remainder = None
+    if label != "completed":
+        return status_row, None, received, is_legacy
+    deviation = (actual_inv - theory_rem) if theory_rem is not None else None
+    alert_row = {
+        "工单号": wo,
+        "物料编号": mat,
+        "物料描述": inv["desc"],
+        "线边仓": inv["warehouse"],
+        "单位": inv["unit"],
+        "实际库存(合计)": round(actual_inv, 2),
+        "条码数": inv["barcodes"],
+        "barcode_list": inv.get("barcode_list", []),
+        "工单状态": order.get("statusDesc", ""),
+        "计划数量": float(order.get("qtyOrdered") or 0),
+        "完工数量": qty_done,
+        "BOM单件用量": unit_qty,
+        "BOM总需求量": sum_qty,
+        "已发料量(sendQty)": float(bom.get("sendQty") or 0) if bom else None,
+        "理论余料": round(theory_rem, 2) if theory_rem is not None else "",
+        "偏差(实际-理论)": round(deviation, 2) if deviation is not None else "",
+        "接收时间": inv["receive_time"],
+        "最新发料时间": inv["issue_time"],
+        "is_legacy": is_legacy,
+        "aging_days": _alert_aging(received, now_epoch),
+        "reuse_label": reuse,
+    }
+    return status_row, alert_row, received, is_legacy
 
-        actual_inv = inv["qty"]
-        deviation = (actual_inv - theoretical_remainder) if theoretical_remainder is not None else None
 
-        results.append({
-            "工单号": wo,
-            "物料编号": mat,
-            "物料描述": inv["desc"],
-            "线边仓": inv["warehouse"],
-            "单位": inv["unit"],
-            "实际库存(合计)": round(actual_inv, 2),
-            "条码数": inv["barcodes"],
-            "barcode_list": inv.get("barcode_list", []),
-            "工单状态": order.get("statusDesc", ""),
-            "计划数量": qty_ordered,
-            "完工数量": qty_done,
-            "BOM单件用量": unit_qty,
-            "BOM总需求量": sum_qty,
-            "已发料量(sendQty)": send_qty,
-            "理论余料": round(theoretical_remainder, 2) if theoretical_remainder is not None else "",
-            "偏差(实际-理论)": round(deviation, 2) if deviation is not None else "",
-            "接收时间": inv["receive_time"],
-            "最新发料时间": inv["issue_time"],
-            "is_legacy": _is_legacy(inv["receive_time"]),
-            "aging_days": round((datetime.now() - _parse_date(inv["receive_time"])).total_seconds() / 86400, 1) if _parse_date(inv["receive_time"]) else -1.0,
-            "reuse_label": _calc_reuse_label(mat, current_bom_mats, upcoming_bom_mats),
-        })
+def _alert_aging(received, now_epoch: float) -> float:
+    return round((now_epoch - received) / 86400, 1) if received is not None else -1.0
+
+
+def _alert_sort_key(x):
+    return -(x["偏差(实际-理论)"] if isinstance(x["偏差(实际-理论)"], float) else 0), x["工单号"]
 
-    results.sort(key=lambda x: (
-        -(x["偏差(实际-理论)"] if isinstance(x["偏差(实际-理论)"], float) else 0),
-        x["工单号"],
-    ))
-    return results
 
+def _status_sort_key(x):
+    return x["wo_status_label"], -x["实际库存(合计)"]
 
-def build_inventory_status(orders, bom_index, inventory):
+
+def build_inventory_audit(orders, bom_index, inventory, now=None):
     """
-    全量线边仓物料状态分析（A 功能）：
-    - 处理所有有工单关联的库存行（不按完工过滤）
-    - 赋予 wo_status_label（current/upcoming/completed/""）
-    - 对 completed 行赋予 reuse_label（是否被在制/待开工工单BOM复用）
+    返回 (alert, inventory_status, counts)
+      alert: 退料预警行（已完工工单），按偏差降序、工单号排序
+      inventory_status: 全量库存状态行（有工单关联的全部库存组），按 wo_status_label、实际库存降序排序
+      counts: {"legacy": 历史遗留组数, "unmatched_current": 当期但工单不在 IMES 窗口内的组数}
     """
-    # 构建在制/待开工工单的 BOM 物料集合（用于 reuse_label 判断）
-    current_bom_mats, upcoming_bom_mats = _build_reuse_sets(orders, bom_index)
+    now_epoch = to_epoch(now or datetime.now())
+    reuse_sets = _build_reuse_sets(orders, bom_index)
+    alert, status_rows = [], []
+    counts = {"legacy": 0, "unmatched_current": 0}
 
-    results = []
     for (wo, mat), inv in inventory.items():
         order = orders.get(wo)
-        if not order:
-            continue  # 工单不在 IMES 窗口内，跳过
-
-        status_desc = order.get("statusDesc", "")
-        label = _wo_status_label(status_desc)
-
-        bom = bom_index.get((wo, mat))
-        qty_done    = float(order.get("qtyDone") or 0)
-        if bom:
-            unit_qty   = float(bom.get("qty") or 0)
-            sum_qty    = float(bom.get("sumQty") or 0)
-            theory_rem = sum_qty - qty_done * unit_qty
-        else:
-            unit_qty = sum_qty = theory_rem = 0.0
-
-        actual_inv = inv["qty"]
-        deviation  = round(actual_inv - theory_rem, 2) if sum_qty > 0 else 0.0
-
-        # reuse_label：仅对 completed 行判断
-        reuse = ""
-        if label == "completed":
-            if mat in current_bom_mats:
-                reuse = "reuse_current"
-            elif mat in upcoming_bom_mats:
-                reuse = "reuse_upcoming"
-
-        results.append({
-            "工单号":        wo,
-            "物料编号":      mat,
-            "物料描述":      inv["desc"],
-            "线边仓":        inv["warehouse"],
-            "单位":          inv["unit"],
-            "实际库存(合计)": round(actual_inv, 2),
-            "条码数":        inv["barcodes"],
-            "barcode_list":  inv.get("barcode_list", []),
-            "工单状态":      status_desc,
-            "wo_status_label": label,
-            "接收时间":      inv["receive_time"],
-            "is_legacy":     _is_legacy(inv["receive_time"]),
-            "理论余料":      round(theory_rem, 2),
-            "偏差(实际-理论)": deviation,
-            "reuse_label":   reuse,
-        })
-
-    results.sort(key=lambda x: (x["wo_status_label"], -x["实际库存(合计)"]))
-    return results
+        status_row, alert_row, _, is_legacy = _inventory_key_rows(
+            wo, mat, inv, order, bom_index.get((wo, mat)), reuse_sets, now_epoch)
+        if is_legacy:
+            counts["legacy"] += 1
+        elif not order:
+            counts["unmatched_current"] += 1
+        if status_row is not None:
+            status_rows.append(status_row)
+        if alert_row is not None:
+            alert.append(alert_row)
+
+    alert.sort(key=_alert_sort_key)
+    status_rows.sort(key=_status_sort_key)
+    return alert, status_rows, counts
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -316,85 +361,91 @@ def build_inventory_status(orders, bom_index, inventory):
 # 数据来源：NWMS woissueLineDetail 的 actualQuantity vs demandQuantity
 # ═══════════════════════════════════════════════════════════════════════════════
 
+def _first_issue_lines(nwms_by_component) -> dict:
+    """(备料单ID, 物料) → 该键的首条发料行（同一备料单同一物料只取第一次出现）"""
+    firsts = {}
+    for comp, lines in nwms_by_component.items():
+        for ln in lines:
+            key = (ln["docId"], comp)
+            if key not in firsts:
+                firsts[key] = ln
+    return firsts
+
+
+def _issue_key_row(doc_id, comp, ln, orders, bom_index):
+    """单个 (备料单ID, 物料) 的超发预警行；关联工单均不在 IMES 工单集合时返回 None"""
+    # 关联 IMES 工单（取第一个匹配的工单）
+    for wo in ln["workOrders"]:
+        if wo in orders:
+            matched_order = orders[wo]
+            matched_bom = bom_index.get((wo, comp))
+            break
+    else:
+        # ── 分析层过滤：关联工单必须存在于 IMES 工单集合 ──
+        return None  # 丢弃，计入未匹配统计
+
+    demand = ln["demandQty"]
+    actual = ln["actualQty"]
+    over_issue = actual - demand
+    over_rate = (over_issue / demand * 100) if demand > 0 else 0
+
+    # BOM 标准需求量及其超发计算
+    bom_sum_qty = float(matched_bom.get("sumQty") or 0) if matched_bom else 0.0
+    over_vs_bom = round(actual - bom_sum_qty, 2) if bom_sum_qty > 0 else ""
+    over_vs_bom_rate = round((actual - bom_sum_qty) / bom_sum_qty * 100, 1) if bom_sum_qty > 0 else ""
+    if over_vs_bom == "":
+        over_vs_bom_label = "(BOM无数据)"
+    elif isinstance(over_vs_bom, float) and over_vs_bom > 0.01:
+        over_vs_bom_label = "⚠️ 超发(BOM)"
+    elif isinstance(over_vs_bom, float) and over_vs_bom >= -0.01:
+        over_vs_bom_label = "✅ 正常(BOM)"
+    else:
+        over_vs_bom_label = "🔽 少发(BOM)"
+
+    return {
+        "备料单ID": doc_id,
+        "备料单号": ln["docNum"],
+        "备料单状态": ln["docStatus"],
+        "关联工单": ",".join(sorted(ln["workOrders"])),
+        "物料编号": comp,
+        # NWMS 口径
+        "计划发料量(demandQty)": round(demand, 2),
+        "实际发料量(actualQty)": round(actual, 2),
+        "超发量": round(over_issue, 2),
+        "超发率(%)": round(over_rate, 1),
+        "是否超发": "⚠️ 超发" if over_issue > 0.01 else ("✅ 正常" if over_issue >= -0.01 else "🔽 少发"),
+        # BOM 口径
+        "BOM标准需求量(sumQty)": bom_sum_qty if bom_sum_qty > 0 else "",
+        "超发量(vs BOM)": over_vs_bom,
+        "超发率%(vs BOM)": over_vs_bom_rate,
+        "是否超发(BOM口径)": over_vs_bom_label,
+        # 其他信息
+        "发料状态": ln["status"],
+        "产线": ln["productionLine"],
+        "仓库": ln["warehouse"],
+        "IMES工单状态": matched_order.get("statusDesc", "") if matched_order else "",
+        "计划发料日期": ln.get("ppStartTime", ""),
+    }
+
+
+def _issue_sort_key(x):
+    # 按超发量降序排列（最严重的排前面）
+    return -(x["超发量"] if isinstance(x["超发量"], float) else 0)
+
+
 def build_issue_audit(nwms_by_component, orders, bom_index):
     """生成超发预警报告（需要 NWMS 数据）"""
     results = []
     nwms_total = sum(len(v) for v in nwms_by_component.values())
-    nwms_matched = 0
-    seen = set()
 
     # 以 NWMS 发料行为主表
-    for comp, lines in nwms_by_component.items():
-        for ln in lines:
-            doc_id = ln["docId"]
-            key = (doc_id, comp)
-            if key in seen:
-                continue
-            seen.add(key)
-
-            # ── 分析层过滤：关联工单必须存在于 IMES 工单集合 ──
-            has_matched_wo = any(wo in orders for wo in ln["workOrders"])
-            if not has_matched_wo:
-                continue  # 丢弃，计入未匹配统计
-            nwms_matched += 1
-
-            demand = ln["demandQty"]
-            actual = ln["actualQty"]
-            over_issue = actual - demand
-            over_rate = (over_issue / demand * 100) if demand > 0 else 0
-
-            # 尝试关联 IMES 工单（取第一个匹配的工单）
-            matched_wo = ""
-            matched_order = None
-            matched_bom = None
-            for wo in ln["workOrders"]:
-                if wo in orders:
-                    matched_wo = wo
-                    matched_order = orders[wo]
-                    matched_bom = bom_index.get((wo, comp))
-                    break
-
-            # BOM 标准需求量及其超发计算
-            bom_sum_qty = float(matched_bom.get("sumQty") or 0) if matched_bom else 0.0
-            over_vs_bom = round(actual - bom_sum_qty, 2) if bom_sum_qty > 0 else ""
-            over_vs_bom_rate = round((actual - bom_sum_qty) / bom_sum_qty * 100, 1) if bom_sum_qty > 0 else ""
-            if over_vs_bom == "":
-                over_vs_bom_label = "(BOM无数据)"
-            elif isinstance(over_vs_bom, float) and over_vs_bom > 0.01:
-                over_vs_bom_label = "⚠️ 超发(BOM)"
-            elif isinstance(over_vs_bom, float) and over_vs_bom >= -0.01:
-                over_vs_bom_label = "✅ 正常(BOM)"
-            else:
-                over_vs_bom_label = "🔽 少发(BOM)"
-
-            results.append({
-                "备料单ID": doc_id,
-                "备料单号": ln["docNum"],
-                "备料单状态": ln["docStatus"],
-                "关联工单": ",".join(sorted(ln["workOrders"])),
-                "物料编号": comp,
-                # NWMS 口径
-                "计划发料量(demandQty)": round(demand, 2),
-                "实际发料量(actualQty)": round(actual, 2),
-                "超发量": round(over_issue, 2),
-                "超发率(%)": round(over_rate, 1),
-                "是否超发": "⚠️ 超发" if over_issue > 0.01 else ("✅ 正常" if over_issue >= -0.01 else "🔽 少发"),
-                # BOM 口径
-                "BOM标准需求量(sumQty)": bom_sum_qty if bom_sum_qty > 0 else "",
-                "超发量(vs BOM)": over_vs_bom,
-                "超发率%(vs BOM)": over_vs_bom_rate,
-                "是否超发(BOM口径)": over_vs_bom_label,
-                # 其他信息
-                "发料状态": ln["status"],
-                "产线": ln["productionLine"],
-                "仓库": ln["warehouse"],
-                "IMES工单状态": matched_order.get("statusDesc", "") if matched_order else "",
-                "计划发料日期": ln.get("ppStartTime", ""),
-            })
+    for (doc_id, comp), ln in _first_issue_lines(nwms_by_component).items():
+        row = _issue_key_row(doc_id, comp, ln, orders, bom_index)
+        if row is not None:
+            results.append(row)
 
-    # 按超发量降序排列（最严重的排前面）
-    results.sort(key=lambda x: -(x["超发量"] if isinstance(x["超发量"], float) else 0))
-    return results, nwms_total, nwms_matched
+    results.sort(key=_issue_sort_key)
+    return results, nwms_total, len(results)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -426,30 +477,9 @@ def safe_str(val):
         return ""
     return str(val)
 
-def _parse_date(date_str: str):
-    """尝试从字符串解析日期，失败返回 None
-    兼容格式：
-      '2026-02-18 14:54:53'  (连字符，标准)
-      '2026/2/18 14:54:53'   (斜杠，SSRS 库存 CSV 实际格式)
-      '2026/2/6 9:57:22'     (斜杠 + 单位数月/日/时)
-    """
-    if not date_str:
-        return None
-    try:
-        s = str(date_str).strip()
-        # 先取空格前的日期部分（避免 [:10] 截入时间）
-        date_part = s.split(" ")[0].replace("/", "-")
-        # 补齐单位数月/日：2026-2-6 → 2026-02-06
-        parts = date_part.split("-")
-        if len(parts) == 3:
-            date_part = f"{parts[0]}-{int(parts[1]):02d}-{int(parts[2]):02d}"
-        return datetime.strptime(date_part, "%Y-%m-%d")
-    except (ValueError, TypeError, IndexError):
-        return None
-
 def _is_legacy(receive_time_str: str) -> bool:
-    d = _parse_date(receive_time_str)
-    return d is None or d < datetime(2026, 1, 1)
+    received = parse_epoch(receive_time_str)
+    return received is None or received < _LEGACY_EPOCH
 
 
 
@@ -459,7 +489,12 @@ def _is_legacy(receive_time_str: str) -> bool:
 # 主流程
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def run():
+def run(inputs: dict = None):
+    """
+    inputs：调度器流水线模式下由爬虫直接交接的内存数据，键为
+      shop_orders / bom_details / inventory / nwms_issue_details；缺失或为 None 的来源读 data/raw 快照
+    """
+    inputs = inputs or {}
     print("=" * 60)
     print("物料流转双向审计报告生成器")
     print(f"运行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
@@ -467,36 +502,46 @@ def run():
 
     # 加载数据
     print("\n[1/4] 加载 IMES 工单数据...")
-    orders = load_shop_orders()
+    orders = load_shop_orders(inputs.get("shop_orders"))
     print(f"  工单: {len(orders)} 条")
 
     print("[2/4] 加载 IMES BOM 数据...")
-    bom_index = load_bom()
+    bom_index = load_bom(inputs.get("bom_details"))
     print(f"  BOM行: {len(bom_index)} 条")
 
     print("[3/4] 加载 SSRS 线边仓库存...")
-    inventory, inventory_raw = load_inventory()
+    inventory, inventory_raw = load_inventory(inputs.get("inventory"))
     print(f"  有效库存组合(工单+物料): {len(inventory)} 组，条码行: {len(inventory_raw)} 条")
 
     print("[4/4] 加载 NWMS 发料行明细（可选）...")
-    nwms_lines = load_nwms_lines()
+    nwms_lines = load_nwms_lines(inputs.get("nwms_issue_details"))
     if nwms_lines is None:
-        print("  [跳过] nwms_issue_details_latest.json 不存在，跳过进场审计")
+        print("  [跳过] nwms_issue_details_latest 快照不存在，跳过进场审计")
         print("  运行 'python3 src/scrapers/nwms_scraper.py' 获取 NWMS 数据")
 
-    # 分析 1：退料预警
+    # 分析 1：库存审计（退料预警 + 全量库存状态 + 分层计数，单次遍历）
+    NOW = datetime.now()
+    if ANALYSIS_INCREMENTAL:
+        from src.analysis import incremental  # 延迟导入：incremental 复用本模块的逐键审计函数
+        audit_inventory, audit_issue = incremental.inventory_audit, incremental.issue_audit
+    else:
+        audit_inventory, audit_issue = build_inventory_audit, build_issue_audit
+    alert, inventory_status, inv_counts = audit_inventory(orders, bom_index, inventory, NOW)
+
     print("\n─── 退料预警（离场审计）────────────────────────────")
-    alert = build_return_alert(orders, bom_index, inventory)
 
     print(f"  完工工单仍有库存的组合: {len(alert)} 组")
     over_positive = [r for r in alert if isinstance(r["偏差(实际-理论)"], float) and r["偏差(实际-理论)"] > 0.01]
     print(f"  其中偏差 > 0（账面超发/多余）: {len(over_positive)} 组")
     save_csv(alert, "alert_report.csv")
 
-    # 退料预警明细（条码级，供 Page 2 操作明细使用）
+    # 退料预警明细（条码级，供 Page 2 操作明细使用）；同一遍统计历史遗留条码行
     alert_wo_mat = {(r["工单号"], r["物料编号"]): r for r in alert}
     detail_rows = []
+    legacy_row_count = 0
     for row in inventory_raw:
+        if _is_legacy(row.get("接收时间", "")):
+            legacy_row_count += 1
         key = (row["指定工单"], row["物料编号"])
         if key not in alert_wo_mat:
             continue
@@ -515,7 +560,7 @@ def run():
     # 分析 2：超发预警（NWMS 数据可用时）
     if nwms_lines:
         print("\n─── 超发预警（进场审计）────────────────────────────")
-        issue_audit, nwms_total, nwms_matched = build_issue_audit(nwms_lines, orders, bom_index)
+        issue_audit, nwms_total, nwms_matched = audit_issue(nwms_lines, orders, bom_index)
         over_issued = [r for r in issue_audit if r["超发量"] > 0.01]
         print(f"  发料行总计: {len(issue_audit)} 条")
         print(f"  其中超发: {len(over_issued)} 条")
@@ -537,39 +582,22 @@ def run():
     print("\n[完成] 报告已保存到 data/raw/")
     
     # ── 库龄与分类统计 (Phase 3) ──
-    NOW = datetime.now()
-    def _aging_days(receive_time_str: str) -> float:
-        d = _parse_date(receive_time_str)
-        if d is None:
-            return -1.0
-        return (NOW - d).total_seconds() / 86400
-
-    confirmed_alerts = [
-        r for r in alert
-        if not r.get("is_legacy")
-        and r.get("工单号") in orders
-    ]
+    now_epoch = to_epoch(NOW)
+
+    # 退料预警行的工单均在 IMES 窗口内：当期 = 非历史遗留
+    confirmed_alerts = [r for r in alert if not r.get("is_legacy")]
     confirmed_alerts_excl = [
         r for r in confirmed_alerts
         if r.get("物料编号", "") not in COMMON_MATERIALS
     ]
-    unmatched_current = [
-        (wo, mat) for (wo, mat), inv in inventory.items()
-        if not _is_legacy(inv["receive_time"])
-        and wo not in orders
-    ]
-    legacy_items = [
-        (wo, mat) for (wo, mat), inv in inventory.items()
-        if _is_legacy(inv["receive_time"])
-    ]
 
     aging_dist = {"le1": 0, "d1_3": 0, "d3_7": 0, "d7_14": 0, "d14_30": 0, "gt30": 0}
     aging_hours_list = []
     aging_hours_list_excl = []
 
     for r in confirmed_alerts:
-        days = _aging_days(r.get("接收时间", ""))
-        if days < 0:
+        days = aging_days(r.get("接收时间", ""), now_epoch)
+        if days is None or days < 0:
             continue
         
         hours = days * 24
@@ -593,23 +621,17 @@ def run():
     avg_aging_current_excl = round(sum(aging_hours_list_excl) / len(aging_hours_list_excl), 1) if aging_hours_list_excl else 0.0
 
     # ── 数据质量统计 ──
-    legacy_rows = [r for r in inventory_raw if _is_legacy(r.get("接收时间", ""))]
-    alert_current = [r for r in alert if not r.get("is_legacy")]
-    alert_matched = len(alert_current)
-    alert_unmatched = len([
-        (wo, mat) for (wo, mat), inv in inventory.items()
-        if not _is_legacy(inv["receive_time"])
-        and (wo, mat) not in {(r["工单号"], r["物料编号"]) for r in alert_current}
-        and wo not in orders  # 有库存但工单不存在
-    ])
+    # 未匹配 = 当期库存组中工单不在 IMES 窗口内的（已匹配的当期组即 confirmed_alerts）
+    alert_matched = len(confirmed_alerts)
+    alert_unmatched = inv_counts["unmatched_current"]
     alert_match_rate = round(
         alert_matched / (alert_matched + alert_unmatched) * 100, 1
     ) if (alert_matched + alert_unmatched) > 0 else 0.0
 
     quality_stats = {
         "inventory_total": len(inventory_raw),
-        "inventory_legacy": len(legacy_rows),
-        "inventory_current": len(inventory_raw) - len(legacy_rows),
+        "inventory_legacy": legacy_row_count,
+        "inventory_current": len(inventory_raw) - legacy_row_count,
         "orders_total": len(orders),
         "alert_matched": alert_matched,
         "alert_unmatched": alert_unmatched,
@@ -619,15 +641,14 @@ def run():
         "nwms_match_rate": round(nwms_matched / nwms_total * 100, 1) if nwms_lines and nwms_total > 0 else 0.0,
         "confirmed_alert_count": len(confirmed_alerts),
         "confirmed_alert_count_excl": len(confirmed_alerts_excl),
-        "unmatched_current_count": len(unmatched_current),
-        "legacy_count": len(legacy_items),
+        "unmatched_current_count": inv_counts["unmatched_current"],
+        "legacy_count": inv_counts["legacy"],
         "avg_aging_hours_current": avg_aging_current,
         "avg_aging_hours_excl": avg_aging_current_excl,
         "aging_distribution": aging_dist,
     }
     
     print("\n─── 全量库存状态分析（Phase 8）────────────────────")
-    inventory_status = build_inventory_status(orders, bom_index, inventory)
     print(f"  全量库存行: {len(inventory_status)} 组")
     current_cnt  = sum(1 for r in inventory_status if r["wo_status_label"] == "current")
     upcoming_cnt = sum(1 for r in inventory_status if r["wo_status_label"] == "upcoming")
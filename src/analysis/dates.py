@@ -0,0 +1,61 @@
+"""
+接收时间 / 发料时间解析 - build_report、sync、API 共用
+  已知格式（只取日期部分，时间忽略）：
+    '2026-02-18 14:54:53'  IMES / NWMS（连字符，标准）
+    '2026/2/18 14:54:53'   SSRS 库存 CSV 实际格式（斜杠）
+    '2026/2/6 9:57:22'     斜杠 + 单位数月/日/时
+    '2026-02-18'           仅日期
+  - 解析为当天 0 点的 epoch 秒（naive 时间，不做时区换算）：手工拆分年月日，不走 strptime
+  - 同一时间戳在大量条码行上重复出现，按原始字符串 LRU 缓存（DATE_CACHE_SIZE 条）
+  - 无法解析（空值 / 格式不符 / 非法日期）返回 None
+"""
+
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+DATE_CACHE_SIZE = int(os.environ.get("DATE_CACHE_SIZE", "65536"))
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_epoch(s: str) -> int | None:
+    parts = s.strip().split(" ")[0].replace("/", "-").split("-")
+    if len(parts) != 3 or len(parts[0]) != 4 or not parts[0].isdigit():
+        return None
+    try:
+        ordinal = datetime(int(parts[0]), int(parts[1]), int(parts[2])).toordinal()
+    except ValueError:
+        return None
+    return (ordinal - _EPOCH_ORDINAL) * 86400
+
+
+def parse_epoch(value) -> int | None:
+    """日期字符串 → 当天 0 点的 epoch 秒，失败返回 None"""
+    if not value:
+        return None
+    return _parse_epoch(value if isinstance(value, str) else str(value))
+
+
+def parse_date(value) -> datetime | None:
+    """日期字符串 → 当天 0 点的 datetime，失败返回 None"""
+    epoch = parse_epoch(value)
+    return None if epoch is None else _EPOCH + timedelta(seconds=epoch)
+
+
+def to_epoch(dt: datetime) -> float:
+    """naive datetime → epoch 秒（与 parse_epoch 同一基准）"""
+    return (dt - _EPOCH).total_seconds()
+
+
+def aging_days(value, now_epoch: float) -> float | None:
+    """距 now_epoch 的库龄（天，未取整，接收日期晚于 now 时为负）；无法解析返回 None"""
+    epoch = parse_epoch(value)
+    return None if epoch is None else (now_epoch - epoch) / 86400
+
+
+def cache_info():
+    """解析缓存命中统计（functools 的 CacheInfo）"""
+    return _parse_epoch.cache_info()
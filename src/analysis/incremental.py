@@ -0,0 +1,220 @@
+"""
+增量分析 - 保留上一轮逐键的输入与输出，只重算变化的 (工单, 物料) 库存组与 (备料单ID, 物料) 发料行
+（build_report 在 ANALYSIS_INCREMENTAL=1 时启用，默认开启）
+  - 状态保存在进程内（调度器随 API 进程常驻）：进程重启后首轮、或 reset() 之后为全量计算
+  - 库存审计：逐键比较库存组汇总、工单（ORDER_FIELDS）、BOM（BOM_FIELDS），受影响的组重算状态行 / 预警行；
+    工单状态变化使在制 / 待开工 BOM 物料集合增减时，按增减的物料重算含这些物料的组（reuse_label）
+  - 超发审计：逐键比较首条发料行、关联工单是否在 IMES 窗口内及其状态、关联工单的 BOM 总需求
+  - 历史遗留 / 工单范围外组数、匹配发料行数随重算增减维护；预警行库龄随时间变化，每轮按缓存的接收日期刷新
+  - 输出与全量计算逐项一致（行内容、排序及并列先后），tools/check_incremental.py 校验
+仍与总量成正比的只有输入加载、逐键相等比较与结果拼接排序；返回的行对象在多轮之间复用，调用方只读不改
+"""
+
+import threading
+from collections import defaultdict
+from datetime import datetime
+from operator import itemgetter
+
+from src.analysis.build_report import (
+    _alert_aging,
+    _alert_sort_key,
+    _build_reuse_sets,
+    _first_issue_lines,
+    _inventory_key_rows,
+    _issue_key_row,
+    _issue_sort_key,
+    _status_sort_key,
+)
+from src.analysis.dates import to_epoch
+
+# 逐键审计读取的字段：增加读取字段时须同步补充，否则该字段的变化不会触发重算
+ORDER_FIELDS = ("statusDesc", "qtyDone", "qtyOrdered")
+BOM_FIELDS = ("qty", "sumQty", "sendQty")
+
+
+def _fingerprints(index: dict, fields: tuple) -> dict:
+    """{键: 指定字段取值}；字段齐全时用 itemgetter 批量取值，个别记录缺字段时逐条 get"""
+    try:
+        return dict(zip(index, map(itemgetter(*fields), index.values())))
+    except KeyError:
+        if len(fields) == 1:
+            return {k: v.get(fields[0]) for k, v in index.items()}
+        return {k: tuple(map(v.get, fields)) for k, v in index.items()}
+
+
+def _changed(prev: dict, cur: dict) -> set:
+    """两份 {键: 可哈希指纹} 之间新增 / 删除 / 取值变化的键"""
+    return {k for k, _ in prev.items() ^ cur.items()}
+
+
+def _unindex(index: defaultdict, name, key) -> None:
+    keys = index[name]
+    keys.discard(key)
+    if not keys:
+        del index[name]  # 工单 / 物料滚动更替，空集合不保留
+
+
+class _InventoryAudit:
+    """build_inventory_audit 的增量版本"""
+
+    def __init__(self):
+        self.orders = {}            # 工单 → ORDER_FIELDS 取值
+        self.bom = {}               # (工单, 物料) → BOM_FIELDS 取值
+        self.reuse_sets = (set(), set())
+        # (工单, 物料) → (库存组, status_row, alert_row, 接收日期 epoch, is_legacy, 是否工单范围外,
+        #                 status_row 排序键, alert_row 排序键)
+        self.entries = {}
+        self.keys_by_wo = defaultdict(set)
+        self.keys_by_mat = defaultdict(set)
+        self.counts = {"legacy": 0, "unmatched_current": 0}
+
+    def _add(self, key, entry):
+        self.entries[key] = entry
+        self.keys_by_wo[key[0]].add(key)
+        self.keys_by_mat[key[1]].add(key)
+        self.counts["legacy"] += entry[4]
+        self.counts["unmatched_current"] += entry[5]
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        _unindex(self.keys_by_wo, key[0], key)
+        _unindex(self.keys_by_mat, key[1], key)
+        self.counts["legacy"] -= entry[4]
+        self.counts["unmatched_current"] -= entry[5]
+
+    def run(self, orders, bom_index, inventory, now_epoch: float):
+        order_fp = _fingerprints(orders, ORDER_FIELDS)
+        bom_fp = _fingerprints(bom_index, BOM_FIELDS)
+        reuse_sets = _build_reuse_sets(orders, bom_index)
+        entries = self.entries
+
+        dirty = _changed(self.bom, bom_fp)
+        for wo in _changed(self.orders, order_fp):
+            dirty |= self.keys_by_wo.get(wo, set())
+        # 在制 / 待开工 BOM 物料集合的增减（工单状态变化、BOM 增删）影响含该物料的全部组的 reuse_label
+        for mat in (reuse_sets[0] ^ self.reuse_sets[0]) | (reuse_sets[1] ^ self.reuse_sets[1]):
+            dirty |= self.keys_by_mat.get(mat, set())
+        dirty.update(key for key, inv in inventory.items() if (e := entries.get(key)) is None or e[0] != inv)
+        for key in entries.keys() - inventory.keys():
+            self._drop(key)
+
+        recomputed = 0
+        for key in dirty:
+            inv = inventory.get(key)
+            if inv is None:
+                continue  # BOM 变化但无库存的键
+            if key in entries:
+                self._drop(key)
+            wo, mat = key
+            order = orders.get(wo)
+            status_row, alert_row, received, is_legacy = _inventory_key_rows(
+                wo, mat, inv, order, bom_index.get(key), reuse_sets, now_epoch)
+            self._add(key, (inv, status_row, alert_row, received, is_legacy, not order and not is_legacy,
+                            status_row and _status_sort_key(status_row), alert_row and _alert_sort_key(alert_row)))
+            recomputed += 1
+        self.orders, self.bom, self.reuse_sets = order_fp, bom_fp, reuse_sets
+
+        # 按本轮库存组顺序拼接后按缓存的排序键稳定排序，并列时的先后与全量计算一致
+        current = list(map(entries.__getitem__, inventory))
+        status = [e for e in current if e[1] is not None]
+        completed = [e for e in current if e[2] is not None]
+        status.sort(key=itemgetter(6))
+        completed.sort(key=itemgetter(7))
+        alert = [{**e[2], "aging_days": _alert_aging(e[3], now_epoch)} for e in completed]
+        status_rows = [e[1] for e in status]
+        print(f"  [增量] 库存组重算 {recomputed} / {len(inventory)}")
+        return alert, status_rows, dict(self.counts)
+
+
+class _IssueAudit:
+    """build_issue_audit 的增量版本"""
+
+    def __init__(self):
+        self.orders = {}            # 工单 → statusDesc（键集合即 IMES 窗口）
+        self.bom = {}               # (工单, 物料) → sumQty
+        self.entries = {}           # (备料单ID, 物料) → (首条发料行, 超发预警行 | None, 排序键)
+        self.keys_by_wo = defaultdict(set)
+        self.matched = 0
+
+    def _add(self, key, entry):
+        self.entries[key] = entry
+        for wo in entry[0]["workOrders"]:
+            self.keys_by_wo[wo].add(key)
+        self.matched += entry[1] is not None
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        for wo in entry[0]["workOrders"]:
+            _unindex(self.keys_by_wo, wo, key)
+        self.matched -= entry[1] is not None
+
+    def run(self, nwms_by_component, orders, bom_index):
+        order_fp = _fingerprints(orders, ("statusDesc",))
+        bom_fp = _fingerprints(bom_index, ("sumQty",))
+        firsts = _first_issue_lines(nwms_by_component)
+        entries = self.entries
+
+        dirty = set()
+        for wo in _changed(self.orders, order_fp):
+            dirty |= self.keys_by_wo.get(wo, set())
+        for wo, comp in _changed(self.bom, bom_fp):
+            dirty.update(key for key in self.keys_by_wo.get(wo, ()) if key[1] == comp)
+        # 关联多个工单时取第一个在 IMES 窗口内的工单：集合相等但遍历顺序不同也按变化处理
+        dirty.update(key for key, ln in firsts.items()
+                     if (e := entries.get(key)) is None or e[0] != ln
+                     or (len(ln["workOrders"]) > 1 and list(e[0]["workOrders"]) != list(ln["workOrders"])))
+        for key in entries.keys() - firsts.keys():
+            self._drop(key)
+
+        recomputed = 0
+        for key in dirty:
+            ln = firsts.get(key)
+            if ln is None:
+                continue
+            if key in entries:
+                self._drop(key)
+            row = _issue_key_row(*key, ln, orders, bom_index)
+            self._add(key, (ln, row, row and _issue_sort_key(row)))
+            recomputed += 1
+        self.orders, self.bom = order_fp, bom_fp
+
+        matched = [e for e in map(entries.__getitem__, firsts) if e[1] is not None]
+        matched.sort(key=itemgetter(2))
+        results = [e[1] for e in matched]
+        print(f"  [增量] 发料行重算 {recomputed} / {len(firsts)}")
+        return results, sum(len(v) for v in nwms_by_component.values()), self.matched
+
+
+_lock = threading.Lock()
+_inventory = _InventoryAudit()
+_issue = _IssueAudit()
+
+
+def inventory_audit(orders, bom_index, inventory, now=None):
+    """同 build_report.build_inventory_audit，只重算与上一轮相比受影响的 (工单, 物料) 组"""
+    global _inventory
+    now_epoch = to_epoch(now or datetime.now())
+    with _lock:
+        try:
+            return _inventory.run(orders, bom_index, inventory, now_epoch)
+        except Exception:
+            _inventory = _InventoryAudit()  # 中途失败的状态不可信，下一轮全量计算
+            raise
+
+
+def issue_audit(nwms_by_component, orders, bom_index):
+    """同 build_report.build_issue_audit，只重算与上一轮相比受影响的 (备料单ID, 物料) 发料行"""
+    global _issue
+    with _lock:
+        try:
+            return _issue.run(nwms_by_component, orders, bom_index)
+        except Exception:
+            _issue = _IssueAudit()
+            raise
+
+
+def reset() -> None:
+    """丢弃缓存状态，下一轮全量计算"""
+    global _inventory, _issue
+    with _lock:
+        _inventory, _issue = _InventoryAudit(), _IssueAudit()
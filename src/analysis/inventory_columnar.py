@@ -0,0 +1,203 @@
+"""
+线边仓库存列式聚合 - build_report.load_inventory 的 NumPy 实现（INVENTORY_ENGINE=columnar 且读 CSV 时启用）
+  - 只处理 CSV 输入：节省的是 csv.DictReader 逐行构造 dict 与逐行聚合的开销；调度器流水线传入的内存行
+    已是 dict，转置成列的开销与逐行聚合相当（tools/check_inventory_engine.py 实测持平），由逐行实现处理
+  - 库存 CSV 按列读入（csv.reader 后整体转置，不逐行构造 dict），现存量整列转 float64
+  - (指定工单, 物料) 与各字符串列用哈希索引编码为整数，现存量求和、条码计数、最早接收时间、最晚发料时间、
+    组内首个非空字段按组号向量化计算；条码按 (组, 条码) 哈希去重
+  - 聚合期间暂停循环 GC（输出是几十万个无环 dict / list，GC 反复扫描是逐行实现的主要开销之一）
+  - 输出与 Python 实现逐项一致：grouped 的组顺序 / 字段取值 / 条码顺序、raw_rows 的行顺序与字段
+    （现存量按行顺序累加，浮点结果相同；描述类字段取组内第一个非空值，全为空时取最后一行的值）
+NumPy 为可选依赖：未安装时 available() 返回 False，由 build_report 退回 Python 实现
+"""
+
+import contextlib
+import csv
+import gc
+from collections import defaultdict
+from itertools import compress
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖
+    np = None
+
+
+# 列名 → 行内取值的缺省值（与 Python 实现的 r.get(key, default) 一致）
+_FIELDS = {
+    "指定工单": None,
+    "物料": None,
+    "现存量": None,
+    "条码": "",
+    "barcode": "",
+    "物料描述": "",
+    "单位": "",
+    "接收时间": "",
+    "最新发料单时间": "",
+}
+
+
+def available() -> bool:
+    return np is not None
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """批量构造几十万个无环容器（行 / 列 / 汇总 dict）期间暂停循环 GC，避免反复全量扫描；结束后恢复原状态"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _columns_from_csv(path) -> dict:
+    """按列读取 CSV；取值规则同 csv.DictReader（跳过空行、同名列后者生效、短行缺失字段为 None）"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        rows = [row for row in reader if row]
+    width = len(header)
+    if any(len(row) < width for row in rows):
+        rows = [row + [None] * (width - len(row)) if len(row) < width else row for row in rows]
+    columns = list(zip(*rows)) if rows else [()] * width
+    n = len(rows)
+    del rows
+    index = {name: i for i, name in enumerate(header)}
+
+    def column(name, default):
+        i = index.get(name)
+        return columns[i] if i is not None else (default,) * n
+
+    cols = {name: column(name, default) for name, default in _FIELDS.items()}
+    cols["线边仓"] = column("线边仓描述", "") if "线边仓描述" in index else column("线边仓", "")
+    return cols
+
+
+def _parse_qty(values: list) -> "np.ndarray":
+    cleaned = [(v or "0").replace(",", "") for v in values]
+    try:
+        return np.array(cleaned, dtype=np.float64)
+    except ValueError:
+        # 个别非数字取值：逐个解析，失败记 0（同 Python 实现）
+        out = np.empty(len(cleaned), dtype=np.float64)
+        for i, s in enumerate(cleaned):
+            try:
+                out[i] = float(s)
+            except ValueError:
+                out[i] = 0.0
+        return out
+
+
+def _truthy(values) -> "np.ndarray":
+    return np.fromiter(map(bool, values), dtype=bool, count=len(values))
+
+
+def _factorize(values, sort: bool = False) -> tuple["np.ndarray", list]:
+    """
+    取值 → (整数编码, 去重后的取值列表)；哈希索引，编码按首次出现顺序编排
+    sort=True 时按取值排序编排：编码大小顺序即取值（字符串）大小顺序
+    """
+    uniques = list(dict.fromkeys(values))
+    if sort:
+        uniques.sort()
+    position = dict(zip(uniques, range(len(uniques))))
+    return np.fromiter(map(position.__getitem__, values), dtype=np.int64, count=len(values)), uniques
+
+
+def _first_truthy_or_last(values, group, last_row) -> list:
+    """每组第一个非空值；组内全为空时取最后一行的值（同 `g[k] = g[k] or v` 的累积结果）"""
+    idx = np.flatnonzero(_truthy(values))[::-1]
+    pick = last_row.copy()
+    pick[group[idx]] = idx  # 逆序赋值：同组多次写入时最后一次（即行号最小的非空行）生效
+    return [values[i] for i in pick.tolist()]
+
+
+def _extreme_per_group(values, group, n_groups: int, largest: bool) -> list:
+    """每组非空字符串的最小 / 最大值（按字符串比较）；无非空值为 ''"""
+    idx = np.flatnonzero(_truthy(values))
+    if not len(idx):
+        return [""] * n_groups
+    codes, uniques = _factorize([values[i] for i in idx.tolist()], sort=True)
+    best = np.full(n_groups, -1, dtype=np.int64)
+    if largest:
+        np.maximum.at(best, group[idx], codes)
+    else:
+        best[group[idx]] = np.iinfo(np.int64).max
+        np.minimum.at(best, group[idx], codes)
+    return [uniques[c] if c >= 0 else "" for c in best.tolist()]
+
+
+def _barcode_lists(barcodes: list, group, n_groups: int) -> list[list[str]]:
+    """每组去重后的条码列表，保持组内首次出现顺序"""
+    out = [[] for _ in range(n_groups)]
+    idx = np.flatnonzero(_truthy(barcodes)).tolist()
+    for g, barcode in dict.fromkeys(zip(group[idx].tolist(), [barcodes[i] for i in idx])):
+        out[g].append(barcode)
+    return out
+
+
+def aggregate(new_group, path) -> tuple[dict, list[dict]]:
+    """
+    按列读取库存 CSV（path），返回 (grouped, raw_rows)，结构同 build_report.load_inventory
+    new_group 为 grouped（defaultdict）的组初始化函数，与 Python 实现共用
+    """
+    with _gc_paused():
+        return _aggregate(new_group, _columns_from_csv(path))
+
+
+def _aggregate(new_group, cols: dict) -> tuple[dict, list[dict]]:
+    wo = [(v or "").strip() for v in cols["指定工单"]]
+    mat = [(v or "").strip() for v in cols["物料"]]
+    qty = _parse_qty(cols["现存量"])
+    keep = _truthy(wo) & _truthy(mat) & ~(qty <= 0.01)
+    if not keep.all():
+        mask = keep.tolist()
+        wo, mat = list(compress(wo, mask)), list(compress(mat, mask))
+        cols = {k: list(compress(v, mask)) for k, v in cols.items()}
+        qty = qty[keep]
+
+    # (工单, 物料) → 组号：按首次出现顺序编号（与 dict 插入顺序一致），之后的聚合全部按组号向量化
+    group, keys = _factorize(list(zip(wo, mat)))
+    n_groups = len(keys)
+    last_row = np.zeros(n_groups, dtype=np.int64)
+    last_row[group] = np.arange(len(group))  # 同组多次写入时最后一次生效：每组最后一行
+
+    sums = np.bincount(group, weights=qty, minlength=n_groups).tolist()
+    counts = np.bincount(group, minlength=n_groups).tolist()
+    barcodes = [(a or "").strip() or (b or "").strip() for a, b in zip(cols["条码"], cols["barcode"])]
+
+    grouped = defaultdict(new_group)
+    grouped.update(zip(
+        keys,
+        [{"qty": q, "barcodes": n, "desc": d, "warehouse": wh, "unit": u,
+          "receive_time": rt, "issue_time": it, "barcode_list": bl}
+         for q, n, d, wh, u, rt, it, bl in zip(
+            sums, counts,
+            _first_truthy_or_last(cols["物料描述"], group, last_row),
+            _first_truthy_or_last(cols["线边仓"], group, last_row),
+            _first_truthy_or_last(cols["单位"], group, last_row),
+            _extreme_per_group(cols["接收时间"], group, n_groups, largest=False),
+            _extreme_per_group(cols["最新发料单时间"], group, n_groups, largest=True),
+            _barcode_lists(barcodes, group, n_groups))],
+    ))
+
+    raw_rows = [
+        {
+            "指定工单": w,
+            "物料编号": m,
+            "物料描述": d,
+            "条码": b,
+            "现存量": q,
+            "单位": u,
+            "线边仓": wh,
+            "接收时间": rt,
+            "最新发料时间": it,
+        }
+        for w, m, d, b, q, u, wh, rt, it in zip(
+            wo, mat, cols["物料描述"], cols["条码"], qty.tolist(), cols["单位"], cols["线边仓"],
+            cols["接收时间"], cols["最新发料单时间"])
+    ]
+    return grouped, raw_rows
@@ -3,26 +3,36 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy import select, desc
 from typing import List, Optional
-from datetime import datetime
 import json
+import time
 
+from src.analysis.dates import aging_days
 from src.config.common_materials import COMMON_MATERIALS
 from src.db.database import get_db, SessionLocal
-from src.db.models import KPIHistory, AlertReportSnapshot, IssueAuditSnapshot, DataQualitySnapshot, InventoryStatusSnapshot
+from src.db.models import (KPIHistory, AlertReportSnapshot, IssueAuditSnapshot, DataQualitySnapshot,
+                           InventoryStatusSnapshot, UpstreamMetricSnapshot)
 from src.api.scheduler import start_scheduler
+from src.scrapers.raw_retention import disk_usage
+from src.scrapers.http_metrics import LATENCY_BUCKETS
 from contextlib import asynccontextmanager
 
 def calculate_aging_days(receive_time_str) -> float:
-    if not receive_time_str:
-        return -1.0
-    try:
-        s = str(receive_time_str).strip().split(" ")[0].replace("/", "-")
-        parts = s.split("-")
-        if len(parts) == 3:
-            s = f"{parts[0]}-{int(parts[1]):02d}-{int(parts[2]):02d}"
-        return round((datetime.utcnow() - datetime.strptime(s, "%Y-%m-%d")).total_seconds() / 86400, 1)
-    except Exception:
-        return -1.0
+    """库龄（天，1 位小数），以当前 UTC 时间计；无法解析返回 -1.0"""
+    days = aging_days(receive_time_str, time.time())
+    return -1.0 if days is None else round(days, 1)
+
+
+def snapshot_batch_id(kpi) -> str:
+    """KPI 批次对应的快照批次：unchanged 标记批次指向上一次完整批次"""
+    return kpi.data_batch_id or kpi.batch_id
+
+
+def resolve_batch_id(db, batch_id: str) -> str:
+    """把前端传入的批次号解析为快照所在批次（标记批次本身没有快照行）"""
+    kpi = db.execute(
+        select(KPIHistory).where(KPIHistory.batch_id == batch_id)
+    ).scalar_one_or_none()
+    return snapshot_batch_id(kpi) if kpi else batch_id
 
 
 @asynccontextmanager
@@ -61,6 +71,9 @@ def get_kpi_summary(exclude_common: bool = False):
         return {
             "batch_id": latest_kpi.batch_id,
             "timestamp": latest_kpi.timestamp.isoformat(),
+            "unchanged": bool(latest_kpi.unchanged),
+            "degraded": bool(latest_kpi.degraded),
+            "stale_sources": [s for s in (latest_kpi.stale_sources or "").split(",") if s],
             "alert_group_count": latest_kpi.alert_group_count,
             "high_risk_count": latest_kpi.high_risk_count,
             "over_issue_lines": latest_kpi.over_issue_lines,
@@ -110,7 +123,7 @@ def get_aging_distribution(exclude_common: bool = False):
             return {"le1": 0, "d1_3": 0, "d3_7": 0, "d7_14": 0, "d14_30": 0, "gt30": 0}
 
         stmt = select(AlertReportSnapshot) \
-            .where(AlertReportSnapshot.batch_id == latest.batch_id) \
+            .where(AlertReportSnapshot.batch_id == snapshot_batch_id(latest)) \
             .where(AlertReportSnapshot.is_legacy == 0)
 
         if exclude_common:
@@ -147,7 +160,7 @@ def get_alerts_top10(exclude_common: bool = False):
             return []
 
         stmt = select(AlertReportSnapshot) \
-            .where(AlertReportSnapshot.batch_id == latest_kpi.batch_id) \
+            .where(AlertReportSnapshot.batch_id == snapshot_batch_id(latest_kpi)) \
             .where(AlertReportSnapshot.is_legacy == 0) \
             .where(AlertReportSnapshot.order_status.in_(COMPLETED_STATUSES))
         if exclude_common:
@@ -186,7 +199,7 @@ def get_issues_top5():
 
         rows = db.execute(
             select(IssueAuditSnapshot)
-            .where(IssueAuditSnapshot.batch_id == latest_kpi.batch_id)
+            .where(IssueAuditSnapshot.batch_id == snapshot_batch_id(latest_kpi))
             .where(IssueAuditSnapshot.over_issue_qty > 0.01)
             .order_by(desc(IssueAuditSnapshot.over_issue_qty))
         ).scalars().all()
@@ -215,10 +228,15 @@ def get_batches():
     db = SessionLocal()
     try:
         rows = db.execute(
-            select(KPIHistory.batch_id, KPIHistory.timestamp)
+            select(KPIHistory.batch_id, KPIHistory.timestamp, KPIHistory.unchanged,
+                   KPIHistory.degraded, KPIHistory.stale_sources)
             .order_by(desc(KPIHistory.timestamp))
         ).all()
-        return [{"batch_id": r.batch_id, "timestamp": r.timestamp.isoformat()} for r in rows]
+        return [
+            {"batch_id": r.batch_id, "timestamp": r.timestamp.isoformat(), "unchanged": bool(r.unchanged),
+             "degraded": bool(r.degraded), "stale_sources": [s for s in (r.stale_sources or "").split(",") if s]}
+            for r in rows
+        ]
     finally:
         db.close()
 
@@ -234,7 +252,9 @@ def get_alerts_list(batch_id: str = "", q: str = "", exclude_common: bool = Fals
             ).scalar_one_or_none()
             if not latest:
                 return []
-            batch_id = latest.batch_id
+            batch_id = snapshot_batch_id(latest)
+        else:
+            batch_id = resolve_batch_id(db, batch_id)
 
         stmt = select(AlertReportSnapshot).where(AlertReportSnapshot.batch_id == batch_id)
         if q:
@@ -279,7 +299,9 @@ def get_issues_list(batch_id: str = "", q: str = ""):
             ).scalar_one_or_none()
             if not latest:
                 return []
-            batch_id = latest.batch_id
+            batch_id = snapshot_batch_id(latest)
+        else:
+            batch_id = resolve_batch_id(db, batch_id)
 
         stmt = select(IssueAuditSnapshot).where(IssueAuditSnapshot.batch_id == batch_id)
         if q:
@@ -323,7 +345,9 @@ def get_inventory_status(batch_id: str = "", q: str = "", label: str = "", exclu
             ).scalar_one_or_none()
             if not latest:
                 return []
-            batch_id = latest.batch_id
+            batch_id = snapshot_batch_id(latest)
+        else:
+            batch_id = resolve_batch_id(db, batch_id)
 
         stmt = select(InventoryStatusSnapshot).where(
             InventoryStatusSnapshot.batch_id == batch_id
@@ -371,3 +395,55 @@ def get_inventory_status(batch_id: str = "", q: str = "", label: str = "", exclu
     finally:
         db.close()
 
+@app.get("/api/storage/raw")
+def get_raw_storage():
+    """data/raw 各来源磁盘占用（时间戳快照 + 归档包）"""
+    return disk_usage()
+
+@app.get("/api/metrics/upstream")
+def get_upstream_metrics(batch_id: str = "", endpoint: str = "", limit: int = 1):
+    """
+    各同步批次的上游接口请求指标（耗时分位 / 状态码 / 重试 / 字节数），用于定位慢同步与上游退化
+    batch_id 为空时返回最近 limit 个有指标的批次（时间倒序）；endpoint 可只看单个接口（如 nwms.line）
+    """
+    db = SessionLocal()
+    try:
+        if batch_id:
+            batch_ids = [batch_id]
+        else:
+            batch_ids = db.execute(
+                select(UpstreamMetricSnapshot.batch_id)
+                .group_by(UpstreamMetricSnapshot.batch_id)
+                .order_by(desc(UpstreamMetricSnapshot.batch_id))
+                .limit(limit)
+            ).scalars().all()
+        if not batch_ids:
+            return []
+
+        stmt = select(UpstreamMetricSnapshot).where(UpstreamMetricSnapshot.batch_id.in_(batch_ids))
+        if endpoint:
+            stmt = stmt.where(UpstreamMetricSnapshot.endpoint == endpoint)
+        rows = db.execute(stmt.order_by(UpstreamMetricSnapshot.endpoint)).scalars().all()
+
+        by_batch = {b: {"batch_id": b, "timestamp": None, "latency_buckets": list(LATENCY_BUCKETS), "endpoints": []}
+                    for b in batch_ids}
+        for r in rows:
+            entry = by_batch[r.batch_id]
+            entry["timestamp"] = r.timestamp.isoformat()
+            entry["endpoints"].append({
+                "endpoint": r.endpoint,
+                "requests": r.requests,
+                "errors": r.errors,
+                "rejected": r.rejected,
+                "retries": r.retries,
+                "bytes": r.bytes,
+                "latency_avg": r.latency_avg,
+                "latency_p50": r.latency_p50,
+                "latency_p95": r.latency_p95,
+                "latency_max": r.latency_max,
+                "status_counts": json.loads(r.status_counts or "{}"),
+                "latency_histogram": json.loads(r.latency_histogram or "[]"),
+            })
+        return [by_batch[b] for b in batch_ids if by_batch[b]["endpoints"]]
+    finally:
+        db.close()
@@ -1,42 +1,119 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime, timedelta
+import os
 import threading
 
+from src.analysis import incremental
 from src.db.sync import run_and_sync
 from src.scrapers.inventory_scraper import run as run_inventory
 from src.scrapers.shop_order_scraper import run as run_shop_order
 from src.scrapers.nwms_scraper import run as run_nwms
 from src.scrapers.bom_scraper import run as run_bom
+from src.scrapers.raw_retention import run as run_raw_retention
+from src.scrapers.raw_store import wait_for_persist
+from src.scrapers.crawl_checkpoint import pending_checkpoints
+from src.scrapers.circuit_breaker import breaker_tripped, reset_breakers
+from src.scrapers.http_metrics import log_http_metrics, reset_metrics, snapshot_metrics
+
+# BOM 并发拉取数（晨间全量同步使用，1=串行）
+BOM_WORKERS = int(os.environ.get("SCHED_BOM_WORKERS", "4"))
+# NWMS 行明细/扫码记录异步并发数（每个主机，1=串行）
+NWMS_CONCURRENCY = int(os.environ.get("SCHED_NWMS_CONCURRENCY", "8"))
 
 # 日志打印
 def log(msg: str):
     print(f"[Scheduler] {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {msg}")
 
+def _run_source(stale: list, source: str, upstream: str, fn, **kwargs):
+    """
+    运行单个爬虫；失败（抛异常 / 上游熔断 / 无结果）时把来源记入 stale 并返回 None，
+    分析对该来源沿用上一份 latest 快照，后续步骤照常进行
+    """
+    try:
+        result = fn(**kwargs)
+    except Exception as e:
+        log(f"{source} 爬取失败，沿用上一份快照: {e}")
+        result = None
+    else:
+        if breaker_tripped(upstream):
+            log(f"{source}: 上游 {upstream} 已熔断，沿用上一份快照")
+            result = None
+    if result is None:
+        stale.append(source)
+    return result
+
+def _http_metrics() -> dict:
+    """本轮爬虫的上游请求指标（写日志后随批次入库）"""
+    metrics = snapshot_metrics()
+    log_http_metrics(metrics)
+    return metrics
+
 def run_inventory_and_orders():
-    """4小时同步：库存 + 工单 + NWMS 发料明细 + 分析"""
-    log("开始执行定时同步 (库存+工单+NWMS+分析)...")
+    """
+    4小时同步：库存 + 工单 + NWMS 发料明细 + 按需 BOM + 分析
+    流水线模式：各爬虫结果直接在内存中交给下一步与分析，data/raw 快照在后台落盘
+    某个上游不可用时熔断快速失败，该来源沿用上一份快照，批次记为降级
+    """
+    log("开始执行定时同步 (库存+工单+NWMS+按需BOM+分析)...")
+    reset_breakers()
+    reset_metrics()
+    stale = []
     try:
-        run_inventory()
-        run_shop_order(start_date="2026-01-01 00:00:00")
-        run_nwms(start_date="2026-01-01")
-        run_and_sync()
+        inventory = _run_source(stale, "inventory", "ssrs", run_inventory, collect_rows=True)
+        orders = _run_source(stale, "shop_orders", "imes", run_shop_order,
+                             start_date="2026-01-01 00:00:00", incremental=True, background=True)
+        details = _run_source(stale, "nwms_details", "nwms", run_nwms,
+                              start_date="2026-01-01", concurrency=NWMS_CONCURRENCY, background=True)
+        # 只拉审计会读取的工单 BOM
+        bom = _run_source(stale, "bom", "imes", run_bom, workers=BOM_WORKERS, demand=True, orders=orders,
+                          inventory_rows=inventory, nwms_details=details, background=True)
+        run_and_sync(inputs={
+            "inventory": inventory,
+            "shop_orders": orders,
+            "nwms_issue_details": details,
+            "bom_details": bom,
+        }, stale_sources=stale, http_metrics=_http_metrics())
         log("定时同步完毕！")
     except Exception as e:
         log(f"定时同步执行失败: {e}")
+    finally:
+        wait_for_persist()
 
 def run_morning_full_sync():
     """06:00 晨间全量同步：BOM + 库存 + 工单 + NWMS + 分析"""
     log("开始执行晨间全量同步 (BOM+库存+工单+NWMS+分析)...")
+    reset_breakers()
+    reset_metrics()
+    incremental.reset()  # 晨间分析全量重算，作为增量分析缓存的每日兜底
+    stale = []
     try:
-        run_bom()
-        run_inventory()
-        run_shop_order(start_date="2026-01-01 00:00:00")
-        run_nwms(start_date="2026-01-01")
-        run_and_sync()
+        bom = _run_source(stale, "bom", "imes", run_bom, workers=BOM_WORKERS, background=True)
+        inventory = _run_source(stale, "inventory", "ssrs", run_inventory, collect_rows=True)
+        orders = _run_source(stale, "shop_orders", "imes", run_shop_order,
+                             start_date="2026-01-01 00:00:00", incremental=True, background=True)
+        details = _run_source(stale, "nwms_details", "nwms", run_nwms,
+                              start_date="2026-01-01", concurrency=NWMS_CONCURRENCY, background=True)
+        run_and_sync(inputs={
+            "inventory": inventory,
+            "shop_orders": orders,
+            "nwms_issue_details": details,
+            "bom_details": bom,
+        }, stale_sources=stale, http_metrics=_http_metrics())
         log("晨间全量同步完毕！")
     except Exception as e:
         log(f"晨间全量同步执行失败: {e}")
+    finally:
+        wait_for_persist()
+
+def run_raw_housekeeping():
+    """03:00 原始快照整理：按分层保留策略删除/归档 data/raw 时间戳文件"""
+    log("开始整理 data/raw 原始快照...")
+    try:
+        run_raw_retention()
+        log("原始快照整理完毕！")
+    except Exception as e:
+        log(f"原始快照整理失败: {e}")
 
 def _last_scheduled_time(now: datetime) -> datetime:
     """返回当前时间之前最近一个应触发的调度时刻（06/10/14/18/22 CST）"""
@@ -49,7 +126,10 @@ def _last_scheduled_time(now: datetime) -> datetime:
 
 
 def check_and_catchup():
-    """启动时检测是否跳过同步，若跳过则异步补跑一次"""
+    """
+    启动时检测是否跳过同步，若跳过则异步补跑一次
+    上次运行中途退出留下的 NWMS/BOM 检查点由补跑（或下一次定时任务）自动续传
+    """
     from src.db.database import SessionLocal
     from src.db.models import KPIHistory
     from sqlalchemy import select, desc
@@ -70,6 +150,10 @@ def check_and_catchup():
     last_sync = latest.timestamp
     last_scheduled = _last_scheduled_time(now)
 
+    pending = pending_checkpoints()
+    if pending:
+        log(f"[补跑] 发现未完成的爬取检查点: {', '.join(pending)}，下次运行将从断点继续")
+
     if last_sync < last_scheduled:
         log(f"[补跑] 检测到跳过同步：上次={last_sync.strftime('%m-%d %H:%M')}，"
             f"应在 {last_scheduled.strftime('%m-%d %H:%M')} 同步，立即补跑...")
@@ -102,6 +186,16 @@ def start_scheduler():
         misfire_grace_time=3600,
     )
 
+    # 03:00 原始快照分层保留/归档（避开同步时段）
+    scheduler.add_job(
+        run_raw_housekeeping,
+        trigger=CronTrigger(hour=3, minute=0),
+        id="raw_retention",
+        name="原始快照保留与归档",
+        replace_existing=True,
+        misfire_grace_time=3600,
+    )
+
     scheduler.start()
     log("定时调度器已启动（06/10/14/18/22 CST，晨间含BOM全量）")
     check_and_catchup()
@@ -1,13 +1,17 @@
 """
 HZERO 平台 Token 自动刷新
 支持 IMES（client: IMES-MXC）和 NWMS（client: hzero-nwms-prd）
-检测到 401 时自动登录获取新 Token 并更新 .env
+TokenProvider：进程内缓存 Token 及其过期时间，临近过期主动刷新；
+并发刷新合并为一次登录（单飞），新 Token 同步写回 .env 与环境变量；
+登录失败后 TOKEN_LOGIN_BACKOFF 秒内的刷新直接抛出同一错误，不再逐个重新登录
 """
 
 import os
 import re
+import time
 import base64
 import logging
+import threading
 from pathlib import Path
 from urllib.parse import quote
 
@@ -18,7 +22,7 @@ from cryptography.hazmat.primitives import serialization
 logger = logging.getLogger(__name__)
 
 # ── 常量 ──────────────────────────────────────────────────────────────────────
-OAUTH_BASE      = "http://10.80.35.11:8080/oauth"
+OAUTH_BASE      = os.environ.get("HZERO_OAUTH_URL", "http://10.80.35.11:8080/oauth")
 PUBLIC_KEY_B64  = (
     "MFwwDQYJKoZIhvcNAQEBBQADSwAwSAJBAJL0JkqsUoK6kt3JyogsgqNp9VDGDp+t3ZAGMbVo"
     "MPdHNT2nfiIVh9ZMNHF7g2XiAa8O8AQWyh2PjMR0NiUSVQMCAwEAAQ=="
@@ -32,6 +36,12 @@ NWMS_REDIRECT   = "http://10.80.35.11:91/"
 
 ENV_FILE        = Path(__file__).parent.parent.parent / ".env"
 
+TOKEN_CONFIG = {
+    "default_ttl": int(os.environ.get("TOKEN_DEFAULT_TTL", "43200")),   # 登录响应未带 expires_in 时假定的有效期（秒）
+    "refresh_margin": int(os.environ.get("TOKEN_REFRESH_MARGIN", "300")),  # 距过期不足该秒数即主动刷新
+    "login_backoff": float(os.environ.get("TOKEN_LOGIN_BACKOFF", "60")),  # 登录失败后该秒数内不再重试登录
+}
+
 # ── 核心函数 ──────────────────────────────────────────────────────────────────
 def _encrypt_password(password: str) -> str:
     key_der = base64.b64decode(PUBLIC_KEY_B64)
@@ -40,8 +50,8 @@ def _encrypt_password(password: str) -> str:
     return base64.b64encode(encrypted).decode()
 
 
-def _fetch_token(username: str, password: str, client_id: str, redirect_uri: str) -> str | None:
-    """登录 HZERO 并通过 OAuth2 Implicit Flow 获取 access_token"""
+def _fetch_token(username: str, password: str, client_id: str, redirect_uri: str) -> tuple[str | None, int]:
+    """登录 HZERO 并通过 OAuth2 Implicit Flow 获取 (access_token, 有效秒数)"""
     s = requests.Session()
     s.get(f"{OAUTH_BASE}/login", timeout=10)
     enc_pwd = _encrypt_password(password)
@@ -57,11 +67,22 @@ def _fetch_token(username: str, password: str, client_id: str, redirect_uri: str
     )
     location = resp.headers.get("Location", "")
     m = re.search(r"access_token=([^&#]+)", location)
-    return m.group(1) if m else None
+    if not m:
+        return None, 0
+    exp = re.search(r"expires_in=(\d+)", location)
+    return m.group(1), int(exp.group(1)) if exp else TOKEN_CONFIG["default_ttl"]
+
+
+_env_lock = threading.Lock()
 
 
 def _update_env(key: str, value: str) -> None:
     """原地更新 .env 文件中的指定 key，不影响其他内容"""
+    with _env_lock:
+        _update_env_locked(key, value)
+
+
+def _update_env_locked(key: str, value: str) -> None:
     if not ENV_FILE.exists():
         ENV_FILE.write_text(f"{key}={value}\n")
         return
@@ -78,50 +99,108 @@ def _update_env(key: str, value: str) -> None:
     ENV_FILE.write_text("".join(lines))
 
 
+# ── Token 提供者 ──────────────────────────────────────────────────────────────
+class TokenProvider:
+    """
+    单个 HZERO 客户端的 Token 缓存
+    get()：返回缓存 Token，临近过期（或尚无 Token）时先刷新
+    refresh(stale)：stale 为调用方手中已失效的 Token；若缓存已被其他线程换新则直接返回新 Token，
+                    否则登录一次。整个刷新在锁内完成，并发 401 只触发一次登录
+                    登录失败（账号错误 / OAuth 服务不可用）后 login_backoff 秒内，在锁上排队的线程与后续调用
+                    直接抛出同一错误，避免多个 worker 依次各登录一次
+    过期时间写入 .env 的 {env_key}_EXPIRES_AT（epoch 秒），供下次启动的进程沿用
+    """
+
+    def __init__(self, name: str, env_key: str, client_id: str, redirect_uri: str):
+        self.name = name
+        self.env_key = env_key
+        self.client_id = client_id
+        self.redirect_uri = redirect_uri
+        self._token = ""
+        self._expires_at = 0.0   # 0 = 未知（来自 .env 且无过期记录），仅在 401 时刷新
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.refresh_count = 0
+        self._failure: Exception | None = None   # 最近一次登录失败的异常及时间（monotonic）
+        self._failed_at = 0.0
+
+    def _load_from_env(self) -> None:
+        self._token = os.environ.get(self.env_key, "")
+        try:
+            self._expires_at = float(os.environ.get(f"{self.env_key}_EXPIRES_AT", "0") or 0)
+        except ValueError:
+            self._expires_at = 0.0
+        self._loaded = True
+
+    def _expiring(self) -> bool:
+        return bool(self._expires_at) and time.time() >= self._expires_at - TOKEN_CONFIG["refresh_margin"]
+
+    def get(self) -> str:
+        with self._lock:
+            if not self._loaded:
+                self._load_from_env()
+            if self._token and not self._expiring():
+                return self._token
+            stale = self._token
+        return self.refresh(stale=stale)
+
+    def refresh(self, stale: str | None = None) -> str:
+        with self._lock:
+            if not self._loaded:
+                self._load_from_env()
+            if stale is not None and self._token and self._token != stale and not self._expiring():
+                return self._token  # 其他线程已完成刷新
+            if self._failure is not None and time.monotonic() - self._failed_at < TOKEN_CONFIG["login_backoff"]:
+                raise self._failure  # 其他线程刚登录失败，不再重复登录
+            try:
+                token = self._login()
+            except Exception as e:
+                self._failure, self._failed_at = e, time.monotonic()
+                raise
+            self._failure = None
+            return token
+
+    def _login(self) -> str:
+        username = os.environ.get("HZERO_USERNAME", "20252471")
+        password = os.environ.get("HZERO_PASSWORD", "asd123")
+
+        logger.info(f"[TokenManager] 正在刷新 {self.name} Token...")
+        token, ttl = _fetch_token(username, password, self.client_id, self.redirect_uri)
+        if not token:
+            raise RuntimeError(f"{self.name} Token 刷新失败，请检查账号密码或网络连接")
+
+        self._token = token
+        self._expires_at = time.time() + ttl
+        self.refresh_count += 1
+        expires_at = str(int(self._expires_at))
+        _update_env(self.env_key, token)
+        _update_env(f"{self.env_key}_EXPIRES_AT", expires_at)
+        os.environ[self.env_key] = token
+        os.environ[f"{self.env_key}_EXPIRES_AT"] = expires_at
+        logger.info(f"[TokenManager] {self.name} Token 已更新（有效期 {ttl}s）")
+        return token
+
+
+IMES_TOKENS = TokenProvider("IMES", "IMES_TOKEN", IMES_CLIENT, IMES_REDIRECT)
+NWMS_TOKENS = TokenProvider("NWMS", "NWMS_TOKEN", NWMS_CLIENT, NWMS_REDIRECT)
+
+
 # ── 对外接口 ──────────────────────────────────────────────────────────────────
 def refresh_imes_token() -> str:
     """重新登录获取 IMES Token 并写入 .env 与环境变量"""
-    username = os.environ.get("HZERO_USERNAME", "20252471")
-    password = os.environ.get("HZERO_PASSWORD", "asd123")
-
-    logger.info("[TokenManager] 正在刷新 IMES Token...")
-    token = _fetch_token(username, password, IMES_CLIENT, IMES_REDIRECT)
-    if not token:
-        raise RuntimeError("IMES Token 刷新失败，请检查账号密码或网络连接")
-
-    _update_env("IMES_TOKEN", token)
-    os.environ["IMES_TOKEN"] = token
-    logger.info("[TokenManager] IMES Token 已更新")
-    return token
+    return IMES_TOKENS.refresh()
 
 
 def refresh_nwms_token() -> str:
     """重新登录获取 NWMS Token 并写入 .env 与环境变量"""
-    username = os.environ.get("HZERO_USERNAME", "20252471")
-    password = os.environ.get("HZERO_PASSWORD", "asd123")
-
-    logger.info("[TokenManager] 正在刷新 NWMS Token...")
-    token = _fetch_token(username, password, NWMS_CLIENT, NWMS_REDIRECT)
-    if not token:
-        raise RuntimeError("NWMS Token 刷新失败，请检查账号密码或网络连接")
-
-    _update_env("NWMS_TOKEN", token)
-    os.environ["NWMS_TOKEN"] = token
-    logger.info("[TokenManager] NWMS Token 已更新")
-    return token
+    return NWMS_TOKENS.refresh()
 
 
 def ensure_imes_token() -> str:
-    """返回当前有效的 IMES Token，失效自动刷新"""
-    token = os.environ.get("IMES_TOKEN", "")
-    if not token:
-        return refresh_imes_token()
-    return token
+    """返回当前有效的 IMES Token，缺失或临近过期自动刷新"""
+    return IMES_TOKENS.get()
 
 
 def ensure_nwms_token() -> str:
-    """返回当前有效的 NWMS Token，失效自动刷新"""
-    token = os.environ.get("NWMS_TOKEN", "")
-    if not token:
-        return refresh_nwms_token()
-    return token
+    """返回当前有效的 NWMS Token，缺失或临近过期自动刷新"""
+    return NWMS_TOKENS.get()
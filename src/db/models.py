@@ -22,6 +22,15 @@ class KPIHistory(Base):
     confirmed_alert_count_excl = Column(Integer, default=0)  # 剔除通用物料后的退料预警数
     avg_aging_hours_excl = Column(Float, default=0.0)     # 剔除通用物料后的平均库龄
 
+    # 输入变化检测：输入摘要与上一批次一致时只写一条 unchanged 标记，不重复写快照
+    input_digest  = Column(String(64), default="")       # 分析输入（库存/工单/BOM/NWMS）合并摘要
+    unchanged     = Column(Integer, default=0)           # 1 = 输入未变化的标记批次（无快照行）
+    data_batch_id = Column(String(50), default="")       # 快照数据实际所在批次（标记批次指向上一次完整批次）
+
+    # 上游熔断降级：部分来源本轮未能更新，分析沿用其上一份 latest 快照
+    degraded      = Column(Integer, default=0)           # 1 = 降级批次（存在过期来源）
+    stale_sources = Column(String(200), default="")      # 过期来源，逗号分隔（inventory / shop_orders / bom / nwms_details）
+
 class AlertReportSnapshot(Base):
     __tablename__ = "alert_report_snapshots"
 
@@ -132,3 +141,27 @@ class DataQualitySnapshot(Base):
     nwms_lines_matched = Column(Integer, default=0) # 关联工单在 IMES 中存在的行数
     nwms_match_rate = Column(Float, default=0.0)    # 匹配率(%)
 
+class UpstreamMetricSnapshot(Base):
+    """每个同步批次的上游接口请求指标（爬虫 http_get 统计，见 src/scrapers/http_metrics.py）"""
+    __tablename__ = "upstream_metric_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(String(50), index=True, nullable=False)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+
+    endpoint = Column(String(50), index=True)          # 接口，如 imes.shop_order / nwms.line / ssrs.export
+    requests = Column(Integer, default=0)              # 请求次数（拿到响应 + 异常）
+    errors = Column(Integer, default=0)                # 未拿到响应（超时 / 连接失败）
+    rejected = Column(Integer, default=0)              # 熔断期间未发出的请求
+    retries = Column(Integer, default=0)               # urllib3 自动重试次数
+    bytes = Column(Integer, default=0)                 # 响应字节数
+    latency_avg = Column(Float, default=0.0)           # 平均耗时(秒)
+    latency_p50 = Column(Float, default=0.0)
+    latency_p95 = Column(Float, default=0.0)
+    latency_max = Column(Float, default=0.0)
+    status_counts = Column(Text, default="{}")         # JSON：{"200": N, "401": N, "ReadTimeout": N}
+    latency_histogram = Column(Text, default="[]")     # JSON：各耗时区间计数（区间上界见 http_metrics.LATENCY_BUCKETS）
+
+    __table_args__ = (
+        Index('idx_upstream_metric_batch_endpoint', 'batch_id', 'endpoint'),
+    )
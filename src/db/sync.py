@@ -1,8 +1,10 @@
 import json
 from datetime import datetime, timedelta
 from src.db.database import SessionLocal
-from src.db.models import KPIHistory, AlertReportSnapshot, IssueAuditSnapshot, DataQualitySnapshot, InventoryStatusSnapshot
+from src.db.models import (KPIHistory, AlertReportSnapshot, IssueAuditSnapshot, DataQualitySnapshot,
+                           InventoryStatusSnapshot, UpstreamMetricSnapshot)
 from src.analysis.build_report import run as build_report_run
+from src.scrapers.source_digest import input_source_digests, combined_digest
 
 def safe_float(val):
     try:
@@ -17,26 +19,12 @@ def safe_str(val):
         return ""
     return str(val)
 
-def save_to_db(alert_rows, issue_rows, quality_stats, inventory_status_rows, session, batch_id):
+def save_to_db(alert_rows, issue_rows, quality_stats, inventory_status_rows, session, batch_id, input_digest="",
+               stale_sources=()):
     print("\n[DB] 开始将数据写入数据库快照表...")
     ts = datetime.now()
-    
-    # 计算平均库龄（此段逻辑已经不相关）
-    active_hours = []
-    now = datetime.now()
-    for r in alert_rows:
-        rt = safe_str(r.get("接收时间"))
-        if rt:
-            try:
-                fmt_rt = rt.replace("/", "-")
-                if len(fmt_rt) > 19: fmt_rt = fmt_rt[:19]
-                dt = datetime.strptime(fmt_rt, "%Y-%m-%d %H:%M:%S")
-                active_hours.append((now - dt).total_seconds() / 3600.0)
-            except Exception:
-                pass
-    avg_aging = round(sum(active_hours) / len(active_hours), 1) if active_hours else 0.0
-
-    # 1. 写入 KPI
+
+    # 1. 写入 KPI（平均库龄取自 build_report 的 quality_stats，不再重复解析接收时间）
     kpi = KPIHistory(
         batch_id=batch_id,
         timestamp=ts,
@@ -53,6 +41,11 @@ def save_to_db(alert_rows, issue_rows, quality_stats, inventory_status_rows, ses
         unmatched_current_count=quality_stats.get("unmatched_current_count", 0),
         legacy_count=quality_stats.get("legacy_count", 0),
         confirmed_alert_count_excl=quality_stats.get("confirmed_alert_count_excl", 0),
+        input_digest=input_digest,
+        unchanged=0,
+        data_batch_id=batch_id,
+        degraded=1 if stale_sources else 0,
+        stale_sources=",".join(sorted(stale_sources)),
     )
     session.add(kpi)
 
@@ -158,26 +151,118 @@ def save_to_db(alert_rows, issue_rows, quality_stats, inventory_status_rows, ses
     print(f"  [DB] 快照写入完成，Batch ID: {batch_id}")
     print(f"  [DB] 数据质量快照写入完成")
 
+def save_unchanged_marker(prev, session, batch_id, input_digest, stale_sources=()):
+    """
+    输入与上一批次一致：只写一条 KPI 标记，指标沿用上一批次，快照查询经 data_batch_id 指回原批次
+    当期库龄只随时间推移，按间隔小时数顺延（有库龄数据时）
+    """
+    ts = datetime.now()
+    elapsed_hours = (ts - prev.timestamp).total_seconds() / 3600.0
+    def _shift(hours):
+        return round(hours + elapsed_hours, 1) if hours else 0.0
+    kpi = KPIHistory(
+        batch_id=batch_id,
+        timestamp=ts,
+        alert_group_count=prev.alert_group_count,
+        high_risk_count=prev.high_risk_count,
+        over_issue_lines=prev.over_issue_lines,
+        avg_aging_hours=_shift(prev.avg_aging_hours),
+        avg_aging_hours_excl=_shift(prev.avg_aging_hours_excl),
+        confirmed_alert_count=prev.confirmed_alert_count,
+        unmatched_current_count=prev.unmatched_current_count,
+        legacy_count=prev.legacy_count,
+        confirmed_alert_count_excl=prev.confirmed_alert_count_excl,
+        input_digest=input_digest,
+        unchanged=1,
+        data_batch_id=prev.data_batch_id or prev.batch_id,
+        degraded=1 if stale_sources else 0,
+        stale_sources=",".join(sorted(stale_sources)),
+    )
+    session.add(kpi)
+    session.commit()
+    print(f"  [DB] 输入未变化，写入标记批次 {batch_id} → 快照沿用 {kpi.data_batch_id}")
+
+def save_upstream_metrics(session, batch_id, http_metrics: dict):
+    """写入本批次各上游接口的请求指标（{endpoint: http_metrics.EndpointMetrics.summary()}）"""
+    ts = datetime.now()
+    for endpoint, m in http_metrics.items():
+        session.add(UpstreamMetricSnapshot(
+            batch_id=batch_id,
+            timestamp=ts,
+            endpoint=endpoint,
+            requests=m["requests"],
+            errors=m["errors"],
+            rejected=m["rejected"],
+            retries=m["retries"],
+            bytes=m["bytes"],
+            latency_avg=m["latency_avg"],
+            latency_p50=m["latency_p50"],
+            latency_p95=m["latency_p95"],
+            latency_max=m["latency_max"],
+            status_counts=json.dumps(m["statuses"]),
+            latency_histogram=json.dumps(m["histogram"]),
+        ))
+    session.commit()
+    print(f"  [DB] 上游请求指标写入完成：{len(http_metrics)} 个接口")
+
+def latest_kpi(session):
+    return session.query(KPIHistory).order_by(KPIHistory.timestamp.desc()).first()
+
 def purge_old_batches(session, days: int = 30):
-    """删除 N 天前的快照数据，控制 DB 体积"""
+    """删除 N 天前的快照数据，控制 DB 体积（最新批次指向的快照批次始终保留）"""
     cutoff = datetime.utcnow() - timedelta(days=days)
-    for Model in [AlertReportSnapshot, IssueAuditSnapshot, DataQualitySnapshot, KPIHistory, InventoryStatusSnapshot]:
-        deleted = session.query(Model).filter(Model.timestamp < cutoff).delete()
+    latest = latest_kpi(session)
+    keep = (latest.data_batch_id or latest.batch_id) if latest else ""
+    for Model in [AlertReportSnapshot, IssueAuditSnapshot, DataQualitySnapshot, KPIHistory, InventoryStatusSnapshot,
+                  UpstreamMetricSnapshot]:
+        deleted = session.query(Model).filter(Model.timestamp < cutoff, Model.batch_id != keep).delete()
         if deleted:
             print(f"  [PURGE] {Model.__tablename__}: 删除 {deleted} 条过期记录")
     session.commit()
 
-def run_and_sync():
-    """执行生成报告并同步至数据库，同步后清理 30 天前数据"""
+def run_and_sync(force: bool = False, inputs: dict = None, stale_sources=(), http_metrics: dict = None):
+    """
+    执行生成报告并同步至数据库，同步后清理 30 天前数据
+    分析输入（库存/工单/BOM/NWMS）摘要与上一批次一致时跳过分析，只写 unchanged 标记；force=True 强制重算
+    inputs：爬虫本轮内存数据（键同 build_report.run），提供的来源不再回读 data/raw 快照
+    stale_sources：本轮未能更新的来源（上游熔断/爬取失败，沿用上一份快照），批次记为降级
+    http_metrics：本轮爬虫的上游请求指标（http_metrics.snapshot_metrics()），按 batch_id 一并入库
+    """
+    if stale_sources:
+        print(f"[SYNC] 降级批次：{', '.join(sorted(stale_sources))} 沿用上一份快照")
+    source_digests = input_source_digests(inputs)
+    input_digest = combined_digest(source_digests)
+    db = SessionLocal()
+    try:
+        prev = latest_kpi(db)
+        if not force and prev and prev.input_digest == input_digest and source_digests["inventory"]:
+            print(f"[SYNC] 分析输入未变化（摘要 {input_digest[:12]}），跳过分析")
+            batch_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+            save_unchanged_marker(prev, db, batch_id, input_digest, stale_sources)
+            if http_metrics:
+                save_upstream_metrics(db, batch_id, http_metrics)
+            purge_old_batches(db)
+            return
+    finally:
+        db.close()
+
     print("[SYNC] 执行原分析逻辑并获取数据...")
-    alert_rows, issue_rows, quality_stats, inventory_status_rows = build_report_run()
+    alert_rows, issue_rows, quality_stats, inventory_status_rows = build_report_run(inputs)
     batch_id = datetime.now().strftime("%Y%m%d_%H%M%S")
     db = SessionLocal()
     try:
-        save_to_db(alert_rows, issue_rows, quality_stats, inventory_status_rows, db, batch_id)
+        save_to_db(alert_rows, issue_rows, quality_stats, inventory_status_rows, db, batch_id, input_digest,
+                   stale_sources)
+        if http_metrics:
+            save_upstream_metrics(db, batch_id, http_metrics)
         purge_old_batches(db)
     finally:
         db.close()
 
 if __name__ == "__main__":
-    run_and_sync()
+    import argparse
+    parser = argparse.ArgumentParser(description="生成报告并同步至数据库")
+    parser.add_argument("--force", action="store_true", help="忽略输入摘要，强制重新分析并写入完整快照")
+    args = parser.parse_args()
+
+    run_and_sync(force=args.force)
@@ -3,98 +3,297 @@ BOM 数据爬虫 - 按工单逐个拉取标准 BOM
 接口：http://10.80.35.11:8080/imes-service/v1/0/shopOrder/bom
 """
 
+import os
 import requests
 import json
-import csv
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from src.scrapers.shop_order_scraper import CONFIG, HEADERS  # 复用配置
+from src.scrapers.shop_order_scraper import CONFIG, imes_get  # 复用配置与 Token
+from src.scrapers.circuit_breaker import UpstreamUnavailable, breaker_tripped
+from src.scrapers.crawl_checkpoint import CrawlCheckpoint
+from src.scrapers.raw_store import load_latest, persist_in_background, read_records, save_snapshot
+from src.scrapers.source_digest import digest_records, record_digest
+from src.scrapers.throttle import log_limiter_stats
 
-BOM_URL = "http://10.80.35.11:8080/imes-service/v1/0/shopOrder/bom"
+BOM_URL = f"{CONFIG['base_url']}/bom"
 OUTPUT_DIR = Path(__file__).parent.parent.parent / "data" / "raw"
 
+# ─── 并发配置（优先读环境变量）────────────────────────────────────────────────
+BOM_CONFIG = {
+    "workers": int(os.environ.get("BOM_WORKERS", "1")),      # 同时在途的 fetch_bom 数
+    "cache_ttl_hours": float(os.environ.get("BOM_CACHE_TTL_HOURS", "72")),  # 缓存过期时间
+}
+
+BOM_CACHE_PATH = OUTPUT_DIR.parent / "cache" / "bom_cache.json"
+
 
 def fetch_bom(shop_order: str) -> list[dict]:
-    """拉取单个工单的 BOM 明细"""
+    """拉取单个工单的 BOM 明细，401 时自动刷新 Token 并重试"""
     params = {
         "signTime": int(time.time() * 1000),
         "shopOrder": shop_order,
         "site": CONFIG["site"],
     }
-    resp = requests.get(BOM_URL, headers=HEADERS, params=params, timeout=30)
+    resp = imes_get("imes.bom", BOM_URL, params=params)
     resp.raise_for_status()
     data = resp.json()
     return data.get("rows", [])
 
 
-def fetch_all_boms(shop_orders: list[str]) -> list[dict]:
+def fetch_boms_by_order(shop_orders: list[str], workers: int = None, checkpoint: CrawlCheckpoint = None,
+                        tags: dict[str, str] = None) -> dict[str, list[dict]]:
+    """
+    批量拉取多个工单的 BOM，返回 {shopOrder: BOM行列表}（请求失败的工单不在结果中）
+    workers: 并发数（默认 BOM_CONFIG["workers"]，1 = 串行）
+    请求速率由 IMES 自适应令牌桶统一控制（见 src/scrapers/throttle.py），所有 worker 共享
+    结果按 shop_orders 原顺序插入，与串行模式一致
+    checkpoint: 跳过上次中途退出前已完成的工单并逐个登记本次完成的工单；tags 为各工单的检查点标记（工单指纹）
+    """
+    tags = tags or {}
+    all_orders = shop_orders
+    resumed = {}
+    if checkpoint is not None:
+        resumed, shop_orders = checkpoint.split(shop_orders, lambda so: so, lambda so: tags.get(so, ""))
+
+    workers = max(1, workers or BOM_CONFIG["workers"])
+    total = len(shop_orders)
+    results: list[list[dict] | None] = [None] * total
+    failed: list[str] = []
+    done = 0
+    fetched = 0
+
+    if workers > 1:
+        print(f"[INFO] 并发拉取 BOM | workers={workers}")
+
+    def _fetch(idx: int) -> tuple[int, list[dict]]:
+        return idx, fetch_bom(shop_orders[idx])
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_fetch, i): i for i in range(total)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            so = shop_orders[i]
+            done += 1
+            try:
+                _, rows = fut.result()
+            except requests.RequestException as e:
+                failed.append(so)
+                if not isinstance(e, UpstreamUnavailable):  # 熔断后的快速失败不逐条打印
+                    print(f"  [ERROR] {so} 请求失败: {e}")
+                continue
+            except Exception as e:
+                # 非请求错误（Token 刷新失败、响应结构异常等）中止本次拉取：先取消排队中的工单，
+                # 否则退出 with 时仍会等全部排队请求跑完；已完成的工单留在检查点中，下次续爬
+                print(f"  [ERROR] {so} 拉取中止: {e!r}，取消其余 {total - done} 个工单")
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            results[i] = rows
+            fetched += len(rows)
+            if checkpoint is not None:
+                checkpoint.record(so, rows, tags.get(so, ""))
+            if done % 10 == 0 or done == total:
+                print(f"  [{done}/{total}] {so}: {len(rows)} 条BOM行，累计 {fetched} 条")
+
+    by_order = {}
+    for so, rows in zip(shop_orders, results):
+        if rows is not None:
+            by_order[so] = rows
+
+    print(f"[INFO] BOM 拉取完成，共 {fetched} 条明细"
+          + (f"（{len(failed)} 个工单请求失败）" if failed else ""))
+    if checkpoint is not None:
+        checkpoint.mark_failed(failed)
+    if not resumed:
+        return by_order
+    by_order.update(resumed)
+    return {so: by_order[so] for so in all_orders if so in by_order}
+
+
+def fetch_all_boms(shop_orders: list[str], workers: int = None, checkpoint: CrawlCheckpoint = None) -> list[dict]:
     """
     批量拉取所有工单的 BOM，返回扁平化明细表
     每行 = 一个工单下的一条 BOM 物料
     """
+    by_order = fetch_boms_by_order(shop_orders, workers=workers, checkpoint=checkpoint)
     all_rows = []
-    total = len(shop_orders)
-
-    for i, so in enumerate(shop_orders, 1):
-        try:
-            rows = fetch_bom(so)
-            all_rows.extend(rows)
-            if i % 10 == 0 or i == total:
-                print(f"  [{i}/{total}] {so}: {len(rows)} 条BOM行，累计 {len(all_rows)} 条")
-        except requests.RequestException as e:
-            print(f"  [ERROR] {so} 请求失败: {e}")
-        time.sleep(0.2)  # 礼貌性延迟
-
-    print(f"[INFO] BOM 拉取完成，共 {len(all_rows)} 条明细")
+    for rows in by_order.values():
+        all_rows.extend(rows)
     return all_rows
 
 
+def load_orders_from_file(path: Path = None) -> list[dict]:
+    """读取已拉取的工单快照（完整工单记录）；默认读最新快照，也可指定 .jsonl.gz / .json 文件"""
+    return read_records(path) if path else load_latest("shop_orders")
+
+
 def load_shop_orders_from_file(path: Path = None) -> list[str]:
     """从已拉取的工单 JSON 文件中读取工单号列表"""
-    path = path or (OUTPUT_DIR / "shop_orders_latest.json")
-    with open(path, encoding="utf-8") as f:
-        orders = json.load(f)
-    return [o["shopOrder"] for o in orders]
+    return [o["shopOrder"] for o in load_orders_from_file(path)]
 
 
-def save_bom(rows: list[dict], filename: str):
-    if not rows:
-        print("[WARN] 无 BOM 数据")
-        return
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-
-    # JSON
-    json_path = OUTPUT_DIR / filename.replace(".csv", ".json")
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(rows, f, ensure_ascii=False, indent=2)
-    print(f"[SAVE] JSON → {json_path}")
-
-    # CSV
-    csv_path = OUTPUT_DIR / filename
-    keys = list(rows[0].keys())
-    with open(csv_path, "w", newline="", encoding="utf-8-sig") as f:
-        writer = csv.DictWriter(f, fieldnames=keys, extrasaction="ignore")
-        writer.writeheader()
-        writer.writerows(rows)
-    print(f"[SAVE] CSV  → {csv_path}")
-
-
-def run(shop_order_file: Path = None):
+# ═══════════════════════════════════════════════════════════════════════════════
+# 增量缓存：按工单缓存 BOM，只对新增/状态变化/过期工单重新请求
+# 缓存结构：{shopOrder: {"fetched_at": ISO时间, "fingerprint": "statusDesc|qtyOrdered", "rows": [...]}}
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _order_fingerprint(order: dict) -> str:
+    return f"{order.get('statusDesc', '')}|{order.get('qtyOrdered', '')}"
+
+
+def load_bom_cache() -> dict:
+    if not BOM_CACHE_PATH.exists():
+        return {}
+    try:
+        with open(BOM_CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] BOM 缓存读取失败，按全量处理: {e}")
+        return {}
+
+
+def save_bom_cache(cache: dict) -> None:
+    BOM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = BOM_CACHE_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp, BOM_CACHE_PATH)
+    print(f"[SAVE] BOM 缓存 → {BOM_CACHE_PATH}（{len(cache)} 个工单）")
+
+
+def plan_bom_refresh(orders: list[dict], cache: dict, ttl_hours: float = None) -> list[str]:
+    """返回需要重新请求 IMES 的工单号：缓存中不存在 / 状态或数量变化 / 超过 TTL"""
+    from datetime import datetime, timedelta
+    ttl = timedelta(hours=ttl_hours if ttl_hours is not None else BOM_CONFIG["cache_ttl_hours"])
+    now = datetime.now()
+    stale = []
+    for o in orders:
+        so = o.get("shopOrder")
+        if not so:
+            continue
+        entry = cache.get(so)
+        if entry is None or entry.get("fingerprint") != _order_fingerprint(o):
+            stale.append(so)
+            continue
+        try:
+            fetched_at = datetime.fromisoformat(entry.get("fetched_at", ""))
+        except ValueError:
+            stale.append(so)
+            continue
+        if now - fetched_at > ttl:
+            stale.append(so)
+    return stale
+
+
+def plan_demand_orders(orders: list[dict], inventory_rows: list[dict] = None,
+                       nwms_details: list[dict] = None) -> set[str] | None:
+    """
+    需求驱动：根据最新库存 / NWMS / 工单快照计算审计会读取 BOM 的工单集合
+    inventory_rows / nwms_details 为本轮已在内存中的数据（None 时读 latest 快照）
+    库存快照缺失时返回 None（调用方退化为全部工单）
+    """
+    from src.analysis.build_report import bom_demand_orders, load_inventory, load_nwms_lines
+    try:
+        inventory, _ = load_inventory(inventory_rows)
+    except FileNotFoundError:
+        print("[WARN] 库存快照不存在，无法按需规划，退化为全部工单")
+        return None
+    nwms_lines = load_nwms_lines(nwms_details)
+    order_map = {o["shopOrder"]: o for o in orders if o.get("shopOrder")}
+    return bom_demand_orders(order_map, inventory, nwms_lines)
+
+
+def run(shop_order_file: Path = None, workers: int = None, full: bool = False, demand: bool = False,
+        export_csv: bool = None, orders: list[dict] = None, inventory_rows: list[dict] = None,
+        nwms_details: list[dict] = None, background: bool = False) -> list[dict] | None:
+    """
+    主入口，返回合并后的 BOM 明细（无数据时 None）
+    full=False（默认）：增量模式，只对新增/变化/过期工单请求 IMES，其余复用缓存
+    full=True：忽略缓存，全部工单重新拉取
+    demand=True：只为审计实际会读取的工单（库存/NWMS/在制待开工）请求 BOM
+    export_csv=True：额外导出 bom_details_latest.csv（None = 读 RAW_EXPORT_CSV）
+    orders / inventory_rows / nwms_details：调度器流水线模式下直接传入本轮内存数据，不再回读快照
+    background=True：快照在后台落盘
+    """
     from datetime import datetime
     ts = datetime.now().strftime("%Y%m%d_%H%M")
 
     print("[INFO] 读取工单列表...")
-    shop_orders = load_shop_orders_from_file(shop_order_file)
-    print(f"[INFO] 共 {len(shop_orders)} 个工单，开始拉取 BOM...")
+    if orders is None:
+        orders = load_orders_from_file(shop_order_file)
+    orders = [o for o in orders if o.get("shopOrder")]
+    shop_orders = [o["shopOrder"] for o in orders]
 
-    rows = fetch_all_boms(shop_orders)
-    save_bom(rows, f"bom_details_{ts}.csv")
-    save_bom(rows, "bom_details_latest.csv")  # 固定文件名供后续引用
+    # 中途退出时下次运行从检查点继续；运行完成（结果已并入缓存）即删除检查点，请求失败的工单下次强制重拉
+    checkpoint = CrawlCheckpoint("bom")
+    cache = {} if full else load_bom_cache()
+    to_fetch = shop_orders if full else plan_bom_refresh(orders, cache)
+    if checkpoint.retry_keys and not full:
+        planned = set(to_fetch) | checkpoint.retry_keys
+        to_fetch = [so for so in shop_orders if so in planned]
+    print(f"[INFO] 共 {len(shop_orders)} 个工单，需拉取 BOM {len(to_fetch)} 个，"
+          f"缓存命中 {len(shop_orders) - len(to_fetch)} 个")
+
+    if demand:
+        needed = plan_demand_orders(orders, inventory_rows, nwms_details)
+        if needed is not None:
+            before = len(to_fetch)
+            to_fetch = [so for so in to_fetch if so in needed]
+            print(f"[INFO] 按需规划：审计需要 {len(needed)} 个工单的 BOM，"
+                  f"实际拉取 {len(to_fetch)} 个，跳过 {before - len(to_fetch)} 次调用")
+
+    order_map = {o["shopOrder"]: o for o in orders}
+    try:
+        fetched = fetch_boms_by_order(to_fetch, workers=workers, checkpoint=checkpoint,
+                                      tags={so: _order_fingerprint(order_map[so]) for so in to_fetch})
+    finally:
+        checkpoint.close()
+    fetched_at = datetime.now().isoformat(timespec="seconds")
+    for so, rows in fetched.items():
+        cache[so] = {
+            "fetched_at": fetched_at,
+            "fingerprint": _order_fingerprint(order_map[so]),
+            "rows": rows,
+        }
+
+    # 仅保留当前工单窗口内的缓存，按工单列表顺序合并输出（请求失败的工单沿用旧缓存）
+    cache = {so: cache[so] for so in shop_orders if so in cache}
+    save_bom_cache(cache)
+    checkpoint.finish()
+    if breaker_tripped("imes"):
+        print("[WARN] IMES 已熔断，本次 BOM 数据不完整，保留上一份 latest 快照")
+        log_limiter_stats("imes")
+        return None
+
+    rows = []
+    for entry in cache.values():
+        rows.extend(entry["rows"])
+    print(f"[INFO] 合并后 BOM 明细共 {len(rows)} 条")
+    if rows:
+        def _persist():
+            latest = save_snapshot(rows, "bom_details", ts, export=export_csv)
+            record_digest("bom", digest_records(rows), latest.name)
+        if background:
+            persist_in_background(_persist)
+        else:
+            _persist()
+    else:
+        print("[WARN] 无 BOM 数据")
+    log_limiter_stats("imes")
+    return rows or None
 
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="IMES BOM 数据爬虫")
-    parser.add_argument("--orders", default=None, help="工单JSON文件路径（默认用最新的）")
+    parser.add_argument("--orders", default=None, help="工单快照文件路径（.jsonl.gz / .json，默认用最新的）")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="并发拉取数（默认读 BOM_WORKERS，1=串行）")
+    parser.add_argument("--full", action="store_true",
+                        help="忽略本地 BOM 缓存，全部工单重新拉取")
+    parser.add_argument("--demand", action="store_true",
+                        help="按需拉取：只拉审计会用到的工单（需先跑库存/工单/NWMS）")
+    parser.add_argument("--csv", action="store_true", help="额外导出 bom_details_latest.csv")
     args = parser.parse_args()
-    run(Path(args.orders) if args.orders else None)
+    run(Path(args.orders) if args.orders else None, workers=args.workers,
+        full=args.full, demand=args.demand, export_csv=args.csv or None)
@@ -0,0 +1,117 @@
+"""
+上游熔断器 - 每个上游系统（imes / nwms / ssrs）一个
+  - 连续 BREAKER_FAILURES 次尝试失败（超时 / 连接失败 / 5xx）后熔断；urllib3 的每次自动重试都单独计数
+    （见 http_client._UpstreamRetry），熔断后不再继续重试
+  - 每轮请求很少的上游单独设阈值（BREAKER_FAILURES_SSRS：库存报表每轮只有一次导出请求）
+  - 熔断期间该上游的请求立即抛 UpstreamUnavailable，不再逐个等满超时
+    （UpstreamUnavailable 是 requests.RequestException 子类，各爬虫已有的异常处理照常生效）
+  - 熔断 BREAKER_COOLDOWN 秒后放行一个试探请求（半开）：成功则恢复，失败继续熔断
+  - 熔断状态与连续失败次数跨运行保留：上一轮已熔断且冷却已到时，本轮再失败一次即重新熔断
+  - tripped 记录本轮运行中是否熔断过或有请求因熔断未发出（该上游本轮数据不完整）；
+    调度器每个任务开始时 reset_breakers() 只清除 tripped 与拒绝计数
+由 http_client.http_get 统一调用
+"""
+
+import os
+import threading
+import time
+
+import requests
+
+BREAKER_CONFIG = {
+    "failures": int(os.environ.get("BREAKER_FAILURES", "5")),        # 连续失败多少次后熔断
+    "cooldown": float(os.environ.get("BREAKER_COOLDOWN", "600")),    # 熔断多少秒后放行试探请求
+    # 单独设阈值的上游：ssrs 每轮一次导出请求，2 = 首次失败仍按 HTTP_RETRIES 重试，重试再失败即熔断
+    "upstream_failures": {
+        "ssrs": int(os.environ.get("BREAKER_FAILURES_SSRS", "2")),
+    },
+}
+
+
+class UpstreamUnavailable(requests.ConnectionError):
+    """上游已熔断，请求未发出"""
+
+
+class CircuitBreaker:
+    """单个上游的熔断器：before_request() 放行或快速失败，record() 回报请求结果"""
+
+    def __init__(self, name: str, failures: int, cooldown: float):
+        self.name = name
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self.state = "closed"  # closed / open / half_open
+        self.tripped = False
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        # 统计
+        self.rejected = 0
+
+    def before_request(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"  # 放行本次作为试探，其余请求在结果出来前继续快速失败
+                print(f"[Breaker] {self.name}: 熔断 {self.cooldown:.0f}s 已到，放行试探请求")
+                return
+            self.rejected += 1
+            self.tripped = True  # 有请求未发出，本轮数据同样不完整
+        raise UpstreamUnavailable(f"{self.name} 已熔断（连续 {self.failures} 次失败），请求未发出")
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                if self.state != "closed":
+                    print(f"[Breaker] {self.name}: 试探成功，恢复请求")
+                self.state = "closed"
+                self._consecutive = 0
+                return
+            self._consecutive += 1
+            if self.state == "half_open" or (self.state == "closed" and self._consecutive >= self.failures):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self.tripped = True
+                print(f"[Breaker] {self.name}: 连续 {self._consecutive} 次失败，熔断 {self.cooldown:.0f}s，"
+                      f"期间请求直接失败")
+
+    def reset(self) -> None:
+        """
+        新一轮运行开始：清除 tripped 标记与拒绝计数，熔断状态与连续失败次数保留
+        上一轮已熔断且冷却已到时恢复放行（并发请求不必等单个试探），但只差一次失败即重新熔断
+        """
+        with self._lock:
+            self.tripped = False
+            self.rejected = 0
+            if self.state != "closed" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "closed"
+                self._consecutive = self.failures - 1
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    """获取上游的共享熔断器（首次调用时创建）"""
+    with _registry_lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            failures = BREAKER_CONFIG["upstream_failures"].get(upstream, BREAKER_CONFIG["failures"])
+            breaker = CircuitBreaker(upstream, failures, BREAKER_CONFIG["cooldown"])
+            _breakers[upstream] = breaker
+        return breaker
+
+
+def breaker_tripped(upstream: str) -> bool:
+    """本轮运行中该上游是否熔断过（爬虫据此判断结果不完整，不覆盖 latest 快照）"""
+    breaker = _breakers.get(upstream)
+    return breaker is not None and breaker.tripped
+
+
+def reset_breakers() -> None:
+    """新一轮运行开始（见 CircuitBreaker.reset）"""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    for b in breakers:
+        b.reset()
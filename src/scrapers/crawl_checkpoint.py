@@ -0,0 +1,164 @@
+"""
+长时间爬取的断点续传 - NWMS 行明细 / BOM 按单据记录本轮已完成的结果
+  - 运行开始即写 data/cache/checkpoints/{名称}.jsonl 首行（进行中标记），之后每完成一个备料单（instructionDocId）
+    或工单（shopOrder）追加一行；finish() 时删除，文件仍在即说明上次运行中途退出
+  - 容器重启、进程被杀等导致中途退出后，下一次运行（含 scheduler.check_and_catchup 补跑）
+    跳过检查点内已完成且标记（头表状态 / 工单指纹）未变的单据，只拉剩余部分
+  - 运行完成（结果已并入本地缓存）后总是删除检查点，成功的结果不跨两次完成的运行复用；
+    拉取失败的单据键另存 {名称}.failed.json，下次运行通过 retry_keys 强制重拉
+  - 超过 CHECKPOINT_MAX_AGE_HOURS 或运行参数不同的中断检查点视为过期，直接丢弃
+文件格式：首行 {"params", "created_at"}，之后每行 {"key", "tag", "data"}；进程被杀时写了一半的末行读取时忽略
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+CHECKPOINT_DIR = Path(__file__).parent.parent.parent / "data" / "cache" / "checkpoints"
+
+CHECKPOINT_CONFIG = {
+    "max_age_hours": float(os.environ.get("CHECKPOINT_MAX_AGE_HOURS", "12")),
+}
+
+
+class CrawlCheckpoint:
+    """
+    单个爬取任务的检查点：get() / split() 取上次中断运行已完成的结果，record() 登记本次完成，
+    mark_failed() 登记本次失败，finish() 运行结束时删除检查点并保存失败的单据键
+    retry_keys 为上次完成的运行中拉取失败的单据键，调用方应无条件重拉
+    """
+
+    def __init__(self, name: str, params: dict = None):
+        self.name = name
+        self.params = params or {}
+        self.path = CHECKPOINT_DIR / f"{name}.jsonl"
+        self.failed_path = CHECKPOINT_DIR / f"{name}.failed.json"
+        self._done: dict[str, dict] = {}
+        self._failed: set[str] = set()
+        self._file = None
+        self._lock = threading.Lock()
+        self.retry_keys = self._load_failed()
+        self._load()
+        self._start()
+
+    def _load_failed(self) -> set[str]:
+        if not self.failed_path.exists():
+            return set()
+        try:
+            with open(self.failed_path, encoding="utf-8") as f:
+                keys = set(json.load(f).get("keys", []))
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"[WARN] 失败单据记录读取失败，忽略: {self.failed_path} ({e})")
+            return set()
+        if keys:
+            print(f"[Checkpoint] {self.name}: 上次运行有 {len(keys)} 个拉取失败，本次强制重拉")
+        return keys
+
+    def _start(self) -> None:
+        """写进行中标记：沿用有效的中断检查点继续追加，否则新建（首行 header）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        new = not self.path.exists()
+        self._file = open(self.path, "a", encoding="utf-8")
+        if new:
+            header = {"params": self.params, "created_at": datetime.now().isoformat(timespec="seconds")}
+            self._file.write(json.dumps(header, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                header = json.loads(f.readline() or "{}")
+                created = datetime.fromisoformat(header.get("created_at", ""))
+                max_age = timedelta(hours=CHECKPOINT_CONFIG["max_age_hours"])
+                if header.get("params") != self.params or datetime.now() - created > max_age:
+                    print(f"[Checkpoint] {self.name}: 检查点已过期或参数不同，丢弃")
+                    self.path.unlink(missing_ok=True)
+                    return
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # 中途退出时写了一半的末行
+                    self._done[entry["key"]] = entry
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] 检查点读取失败，忽略: {self.path} ({e})")
+            self._done = {}
+            self.path.unlink(missing_ok=True)
+            return
+        print(f"[Checkpoint] {self.name}: 发现未完成的上次运行（{header['created_at']}），"
+              f"已完成 {len(self._done)} 个，本次从断点继续")
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def get(self, key: str, tag: str = ""):
+        """返回上次已完成的结果；不存在或标记已变化时返回 None"""
+        entry = self._done.get(key)
+        if entry is None or entry.get("tag") != tag:
+            return None
+        return entry["data"]
+
+    def split(self, items: list, key_fn, tag_fn=None) -> tuple[dict, list]:
+        """把待爬取列表分成 (已完成 {key: 结果}, 仍需拉取的 items)，保持原顺序"""
+        resumed, remaining = {}, []
+        for item in items:
+            key = key_fn(item)
+            data = self.get(key, tag_fn(item) if tag_fn else "")
+            if data is None:
+                remaining.append(item)
+            else:
+                resumed[key] = data
+        if resumed:
+            print(f"[Checkpoint] {self.name}: 跳过上次已完成的 {len(resumed)} 个，剩余 {len(remaining)} 个")
+        return resumed, remaining
+
+    def record(self, key: str, data, tag: str = "") -> None:
+        """登记一个已完成的单据（立即追加写入并 flush，进程随时退出也不丢）"""
+        line = json.dumps({"key": key, "tag": tag, "data": data}, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._file is None:
+                return  # 已 finish()
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._done[key] = {"key": key, "tag": tag, "data": data}
+
+    def mark_failed(self, keys) -> None:
+        """登记本次拉取失败的单据键（finish() 时保存，下次运行强制重拉）"""
+        with self._lock:
+            self._failed.update(keys)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def discard(self) -> None:
+        """删除检查点"""
+        self.close()
+        self._done = {}
+        self.path.unlink(missing_ok=True)
+
+    def finish(self) -> None:
+        """本轮运行结束：删除检查点（进行中标记），只保存失败的单据键供下次重拉"""
+        self.discard()
+        if not self._failed:
+            self.failed_path.unlink(missing_ok=True)
+            return
+        tmp = self.failed_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"finished_at": datetime.now().isoformat(timespec="seconds"),
+                       "keys": sorted(self._failed)}, f, ensure_ascii=False)
+        os.replace(tmp, self.failed_path)
+        print(f"[Checkpoint] {self.name}: {len(self._failed)} 个拉取失败，下次运行强制重拉")
+
+
+def pending_checkpoints() -> list[str]:
+    """列出中途退出（进行中标记未被删除）的检查点名称"""
+    if not CHECKPOINT_DIR.exists():
+        return []
+    return sorted(p.stem for p in CHECKPOINT_DIR.glob("*.jsonl"))
@@ -0,0 +1,181 @@
+"""
+共享 HTTP 客户端 - 每个上游系统一个长连接 Session
+  - imes：工单 / BOM（10.80.35.11:8080/imes-service）
+  - nwms：备料单头表 / 行明细 / 扫码记录（10.80.35.11:8080/nwms）
+  - ssrs：线边仓库存报表导出（10.70.35.26，NTLM，Session 级认证复用连接）
+连接池大小、重试退避（仅连接失败与 429/5xx，读取超时不重试）、各接口超时集中配置；爬虫统一通过 http_get 发请求
+每次请求先向上游的自适应令牌桶取令牌，响应后回报延迟与状态码（见 throttle.py）
+上游连续失败时熔断，熔断期间请求直接抛 UpstreamUnavailable（见 circuit_breaker.py）；
+urllib3 自动重试的每次失败尝试都回报令牌桶与熔断器，熔断后停止重试（见 _UpstreamRetry）
+每次请求的耗时 / 状态码 / 重试次数 / 字节数按接口累计（见 http_metrics.py）
+"""
+
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+from src.scrapers import http_metrics
+from src.scrapers.circuit_breaker import UpstreamUnavailable, get_breaker
+from src.scrapers.throttle import get_limiter
+
+# ─── 连接池与重试（优先读环境变量）────────────────────────────────────────────
+POOL_CONFIG = {
+    "imes": {"pool_maxsize": int(os.environ.get("IMES_POOL_SIZE", "16"))},
+    "nwms": {"pool_maxsize": int(os.environ.get("NWMS_POOL_SIZE", "32"))},
+    "ssrs": {"pool_maxsize": 2},
+}
+
+RETRY_CONFIG = {
+    "total": int(os.environ.get("HTTP_RETRIES", "3")),
+    "backoff_factor": float(os.environ.get("HTTP_BACKOFF", "0.5")),  # 0.5s → 1s → 2s
+    "status_forcelist": (429, 500, 502, 503, 504),
+}
+
+# ─── 各接口超时：(连接超时, 读取超时) 秒 ───────────────────────────────────────
+TIMEOUTS = {
+    "imes.shop_order": (5, 30),
+    "imes.bom": (5, 30),
+    "nwms.head": (5, 30),
+    "nwms.line": (5, 30),
+    "nwms.scan": (5, 30),
+    "ssrs.export": (10, 120),  # 报表导出可能较慢，给足时间
+}
+DEFAULT_TIMEOUT = (5, 30)
+
+_sessions: dict[str, requests.Session] = {}
+_lock = threading.Lock()
+_attempts = threading.local()  # 本线程当前请求中已由 _UpstreamRetry 回报的失败尝试数
+
+
+def _is_failure(status: int | None) -> bool:
+    return status is None or status == 429 or status >= 500
+
+
+class _UpstreamRetry(Retry):
+    """
+    每次失败的底层尝试（连接失败 / 超时 / 429 / 5xx，含最后一次）都回报上游的令牌桶与熔断器，
+    而不是只在重试耗尽后由 http_get 回报一次；熔断器因此打开时不再继续重试
+    429 只降速，不计入熔断（上游在限流而不是不可用）
+    """
+
+    upstream = ""
+
+    def new(self, **kw):
+        retry = super().new(**kw)  # urllib3 每次重试都重建 Retry 对象，上游名需随之传递
+        retry.upstream = self.upstream
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        status = response.status if response is not None else None
+        if self.upstream and _is_failure(status):
+            _attempts.failed = getattr(_attempts, "failed", 0) + 1
+            get_limiter(self.upstream).observe(0.0, status)
+            breaker = get_breaker(self.upstream)
+            if status != 429:
+                breaker.record(False)
+        else:
+            breaker = None
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if breaker is not None and breaker.state == "open":
+            reason = error or ResponseError(ResponseError.SPECIFIC_ERROR.format(status_code=status))
+            raise MaxRetryError(_pool, url, reason) from reason
+        return retry
+
+
+def _build_session(upstream: str) -> requests.Session:
+    retry = _UpstreamRetry(
+        total=RETRY_CONFIG["total"],
+        connect=RETRY_CONFIG["total"],
+        read=False,  # 读取超时不重试：上游已收到请求仍无响应，重发只会再等满一次读取超时（ssrs 导出 120s）
+        status=RETRY_CONFIG["total"],
+        backoff_factor=RETRY_CONFIG["backoff_factor"],
+        status_forcelist=RETRY_CONFIG["status_forcelist"],
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False,  # 重试耗尽后返回最后一次响应，由调用方 raise_for_status
+    )
+    retry.upstream = upstream
+    pool_size = POOL_CONFIG.get(upstream, {}).get("pool_maxsize", 10)
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def get_session(upstream: str, auth=None) -> requests.Session:
+    """获取上游系统的共享 Session（首次调用时创建）；auth 仅在首次创建时生效"""
+    with _lock:
+        s = _sessions.get(upstream)
+        if s is None:
+            s = _build_session(upstream)
+            if auth is not None:
+                s.auth = auth
+            _sessions[upstream] = s
+        return s
+
+
+def http_get(endpoint: str, url: str, **kwargs) -> requests.Response:
+    """
+    通过共享 Session 发 GET 请求
+    endpoint: "上游.接口" 形式（如 "imes.bom"），决定使用哪个 Session 与超时
+    上游已熔断时不发请求，直接抛 UpstreamUnavailable（requests.RequestException 子类）
+    """
+    upstream = endpoint.split(".", 1)[0]
+    kwargs.setdefault("timeout", TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT))
+    breaker = get_breaker(upstream)
+    try:
+        breaker.before_request()
+    except UpstreamUnavailable:
+        http_metrics.record_rejected(endpoint)
+        raise
+    limiter = get_limiter(upstream)
+    limiter.acquire()
+    _attempts.failed = 0
+    started = time.monotonic()
+    try:
+        resp = get_session(upstream).get(url, **kwargs)
+    except requests.RequestException as e:
+        elapsed = time.monotonic() - started
+        if not _attempts.failed:  # 未经 urllib3 重试回报的异常（如读取响应体时超时）
+            limiter.observe(elapsed, None)
+            breaker.record(False)
+        http_metrics.record_error(endpoint, elapsed, e)
+        raise
+    elapsed = time.monotonic() - started
+    # 重试列表内的失败状态码（含最后一次）已逐次回报；429 未计入熔断，仍需在此结束半开试探
+    counted = _attempts.failed and resp.status_code in RETRY_CONFIG["status_forcelist"]
+    if not counted:
+        limiter.observe(elapsed, resp.status_code)
+    if not counted or resp.status_code == 429:
+        breaker.record(resp.status_code < 500)
+    http_metrics.record_response(endpoint, elapsed, resp, stream=kwargs.get("stream", False))
+    return resp
+
+
+def http_get_with_token(endpoint: str, url: str, tokens, make_headers, **kwargs) -> requests.Response:
+    """
+    带 Token 的 GET：请求头由 make_headers(tokens.get()) 生成
+    401 时通过 tokens.refresh(stale=本次使用的 Token) 刷新后重试一次（并发 401 只登录一次）
+    tokens: src.auth.token_manager.TokenProvider
+    """
+    token = tokens.get()
+    resp = http_get(endpoint, url, headers=make_headers(token), **kwargs)
+    if resp.status_code == 401:
+        print(f"[TokenManager] {tokens.name} Token 已失效，自动刷新...")
+        resp.close()
+        token = tokens.refresh(stale=token)
+        resp = http_get(endpoint, url, headers=make_headers(token), **kwargs)
+    return resp
+
+
+def close_sessions() -> None:
+    """关闭全部 Session（释放连接池）"""
+    with _lock:
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
@@ -0,0 +1,115 @@
+"""
+上游请求指标 - 按接口（imes.shop_order / nwms.line / ssrs.export ...）统计每次 http_get
+  - 耗时（含 urllib3 自动重试与退避，不含令牌桶等待）：直方图 + p50 / p95 / 最大值
+  - 状态码计数（请求异常按异常类名计，如 ReadTimeout）、urllib3 重试次数、响应字节数、熔断拒绝次数
+  - 流式响应（SSRS 报表）的字节数由读取方下载完成后用 record_bytes() 补记
+调度器每个任务开始时 reset_metrics()，分析入库时 snapshot_metrics() 按 batch_id 写入 upstream_metric_snapshots
+"""
+
+import threading
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # 直方图上界（秒），最后一档为 >60s
+
+
+class EndpointMetrics:
+    """单个接口本轮运行的累计指标"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0       # 未拿到响应（超时 / 连接失败）
+        self.rejected = 0     # 熔断期间未发出的请求
+        self.retries = 0
+        self.bytes = 0
+        self.statuses: dict[str, int] = {}
+        self.latencies: list[float] = []
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, elapsed: float, status: str, nbytes: int, retries: int, error: bool) -> None:
+        self.requests += 1
+        self.errors += error
+        self.retries += retries
+        self.bytes += nbytes
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latencies.append(elapsed)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def summary(self) -> dict:
+        lat = sorted(self.latencies)
+
+        def _pct(q: float) -> float:
+            return round(lat[min(len(lat) - 1, int(q * len(lat)))], 3) if lat else 0.0
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "statuses": dict(sorted(self.statuses.items())),
+            "latency_avg": round(sum(lat) / len(lat), 3) if lat else 0.0,
+            "latency_p50": _pct(0.50),
+            "latency_p95": _pct(0.95),
+            "latency_max": round(lat[-1], 3) if lat else 0.0,
+            "histogram": list(self.histogram),
+        }
+
+
+_metrics: dict[str, EndpointMetrics] = {}
+_lock = threading.Lock()
+
+
+def _get(endpoint: str) -> EndpointMetrics:
+    m = _metrics.get(endpoint)
+    if m is None:
+        m = _metrics[endpoint] = EndpointMetrics()
+    return m
+
+
+def record_response(endpoint: str, elapsed: float, resp, stream: bool = False) -> None:
+    """记录一次拿到响应的请求；非流式响应按已读取的正文计字节，流式响应的字节数由读取方 record_bytes() 补记"""
+    nbytes = 0 if stream else len(resp.content or b"")
+    retries = getattr(getattr(resp.raw, "retries", None), "history", ()) or ()
+    with _lock:
+        _get(endpoint).add(elapsed, str(resp.status_code), nbytes, len(retries), error=False)
+
+
+def record_error(endpoint: str, elapsed: float, error: Exception) -> None:
+    """记录一次未拿到响应的请求（状态记为异常类名）"""
+    with _lock:
+        _get(endpoint).add(elapsed, type(error).__name__, 0, 0, error=True)
+
+
+def record_rejected(endpoint: str) -> None:
+    with _lock:
+        _get(endpoint).rejected += 1
+
+
+def record_bytes(endpoint: str, nbytes: int) -> None:
+    """流式响应读取完成后补记实际字节数"""
+    with _lock:
+        _get(endpoint).bytes += nbytes
+
+
+def snapshot_metrics() -> dict[str, dict]:
+    """本轮各接口指标 {endpoint: summary}，按接口名排序"""
+    with _lock:
+        return {name: m.summary() for name, m in sorted(_metrics.items()) if m.requests or m.rejected}
+
+
+def reset_metrics() -> None:
+    with _lock:
+        _metrics.clear()
+
+
+def log_http_metrics(metrics: dict[str, dict]) -> None:
+    """把各接口指标写入运行日志"""
+    for endpoint, s in metrics.items():
+        statuses = " ".join(f"{k}×{v}" for k, v in s["statuses"].items())
+        print(f"[HTTP] {endpoint}: {s['requests']} 次 | p50 {s['latency_p50']}s p95 {s['latency_p95']}s"
+              f" max {s['latency_max']}s | 重试 {s['retries']} | 熔断拒绝 {s['rejected']}"
+              f" | {s['bytes'] / 1024 / 1024:.2f} MB | {statuses}")
@@ -8,22 +8,27 @@
 import os
 import requests
 from requests_ntlm import HttpNtlmAuth
+from src.scrapers.http_client import get_session, http_get
+from src.scrapers.http_metrics import record_bytes
+from src.scrapers.raw_store import link_latest
+from src.scrapers.source_digest import record_digest
+from src.scrapers.throttle import log_limiter_stats
+import codecs
 import csv
-import time
-import io
+import hashlib
 from pathlib import Path
 from datetime import datetime
 
 # ─── 配置区（优先读环境变量，回退到硬编码值）────────────────────────────────
 CONFIG = {
-    "report_server": "http://10.70.35.26/ReportServer",
+    "report_server": os.environ.get("SSRS_REPORT_SERVER", "http://10.70.35.26/ReportServer"),
     "report_path": "/imesreport/线边仓库存报表",  # SSRS 报表路径
     "username": os.environ.get("SSRS_USERNAME", "chenweijie"),
     "password": os.environ.get("SSRS_PASSWORD", "abcd,1234"),
-    "timeout": 120,    # 报表导出可能较慢，给足时间
 }
 
 OUTPUT_DIR = Path(__file__).parent.parent.parent / "data" / "raw"
+CHUNK_SIZE = 256 * 1024  # 流式下载分块大小
 
 # ─── SSRS 直接导出 URL ────────────────────────────────────────────────────────
 # 格式：/ReportServer?/报表路径&rs:Format=CSV&rs:ClearSession=true
@@ -38,8 +43,8 @@ def build_export_url() -> str:
     )
 
 
-def fetch_inventory_csv() -> str:
-    """通过 NTLM 认证下载线边仓库存报表 CSV"""
+def fetch_inventory_stream() -> requests.Response:
+    """通过 NTLM 认证请求线边仓库存报表 CSV，返回流式响应（正文尚未读取）"""
     if not CONFIG["username"] or not CONFIG["password"]:
         raise ValueError(
             "请在 CONFIG 中填入 Windows 域账号和密码！\n"
@@ -47,15 +52,16 @@ def fetch_inventory_csv() -> str:
         )
 
     url = build_export_url()
-    auth = HttpNtlmAuth(CONFIG["username"], CONFIG["password"])
+    # NTLM 认证挂在共享 Session 上，连接保持期间无需每次重新握手
+    get_session("ssrs", auth=HttpNtlmAuth(CONFIG["username"], CONFIG["password"]))
 
     print(f"[INFO] 正在请求 SSRS 报表导出...")
     print(f"[INFO] URL: {url}")
 
-    resp = requests.get(
+    resp = http_get(
+        "ssrs.export",
         url,
-        auth=auth,
-        timeout=CONFIG["timeout"],
+        stream=True,
         headers={
             "User-Agent": (
                 "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -66,55 +72,130 @@ def fetch_inventory_csv() -> str:
     )
 
     if resp.status_code == 401:
+        resp.close()
         raise PermissionError("认证失败（401）：请检查用户名和密码是否正确")
     if resp.status_code == 404:
+        resp.close()
         raise FileNotFoundError(f"报表路径不存在（404）：{CONFIG['report_path']}")
     resp.raise_for_status()
 
     content_type = resp.headers.get("content-type", "")
-    print(f"[INFO] 响应状态: {resp.status_code}  Content-Type: {content_type}  大小: {len(resp.content)} bytes")
-
-    return resp.text
-
-
-def parse_and_save(csv_text: str, output_filename: str = None) -> Path:
-    """解析 CSV 内容并保存到文件"""
+    print(f"[INFO] 响应状态: {resp.status_code}  Content-Type: {content_type}")
+    return resp
+
+
+def _iter_text_lines(resp: requests.Response, out, stats: dict):
+    """
+    边下载边落盘：按块解码写入 out，同时逐行产出文本供 csv.reader 解析
+    产出的行把 \r\n / \r 统一为 \n（与按文本模式读文件一致），文件内容保持原样
+    引号内的换行由 csv.reader 自行拼接
+    """
+    encoding = resp.encoding or "utf-8"
+    if codecs.lookup(encoding).name == "utf-8":
+        encoding = "utf-8-sig"  # SSRS 导出的 CSV 可能有 BOM 头，解码时去掉，写出时统一加回
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+        stats["bytes"] += len(chunk)
+        stats["sha"].update(chunk)
+        text = decoder.decode(chunk)
+        out.write(text)
+        buf = pending + text
+        carry = ""
+        if buf.endswith("\r"):  # \r\n 可能跨块，留到下一块再归一
+            buf, carry = buf[:-1], "\r"
+        lines = buf.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        pending = lines.pop() + carry
+        for line in lines:
+            yield line + "\n"
+    tail = decoder.decode(b"", final=True)
+    out.write(tail)
+    lines = (pending + tail).replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    last = lines.pop()
+    for line in lines:
+        yield line + "\n"
+    if last:
+        yield last
+
+
+def _row_dict(fieldnames: list[str], row: list[str]) -> dict:
+    """与 csv.DictReader 相同的行 → 字典规则：多出的值放在 None 键下，缺失的字段为 None"""
+    d = dict(zip(fieldnames, row))
+    n, m = len(fieldnames), len(row)
+    if m > n:
+        d[None] = row[n:]
+    elif m < n:
+        for key in fieldnames[m:]:
+            d[key] = None
+    return d
+
+
+def stream_and_save(resp: requests.Response, output_filename: str = None, sink: list = None) -> Path:
+    """
+    流式保存报表：分块写入带时间戳的文件并同步统计行数（单次遍历，内存占用与报表大小无关）
+    inventory_latest.csv 通过硬链接 + 原子替换指向时间戳文件，不再重复写一遍
+    sink 不为 None 时，同一遍解析把每行（与 csv.DictReader 结果一致）追加进 sink，供分析直接使用
+    """
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
     ts = datetime.now().strftime("%Y%m%d_%H%M")
     filename = output_filename or f"线边仓库存报表_{ts}.csv"
     out_path = OUTPUT_DIR / filename
+    part_path = out_path.with_name(out_path.name + ".part")
 
-    # SSRS 导出的 CSV 可能有 BOM 头，统一用 utf-8-sig 处理
-    with open(out_path, "w", encoding="utf-8-sig", newline="") as f:
-        f.write(csv_text)
-
-    # 统计行数做健康检查
-    reader = csv.DictReader(io.StringIO(csv_text))
-    rows = list(reader)
-    print(f"[INFO] 解析完成：{len(rows)} 条记录，字段：{list(reader.fieldnames or [])[:5]}...")
+    stats = {"bytes": 0, "sha": hashlib.sha256()}
+    try:
+        with open(part_path, "w", encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(_iter_text_lines(resp, f, stats))
+            fieldnames = next(reader, [])
+            if sink is None:
+                row_count = sum(1 for row in reader if row)  # 与 DictReader 一致：跳过空行
+            else:
+                row_count = 0
+                for row in reader:
+                    if row:
+                        sink.append(_row_dict(fieldnames, row))
+                        row_count += 1
+    except BaseException:
+        part_path.unlink(missing_ok=True)  # 下载 / 解析中断：不留半个文件（否则会被当作时间戳快照长期保留）
+        raise
+    finally:
+        resp.close()
+    os.replace(part_path, out_path)
+
+    print(f"[INFO] 下载完成：{stats['bytes']} bytes")
+    record_bytes("ssrs.export", stats["bytes"])
+    print(f"[INFO] 解析完成：{row_count} 条记录，字段：{fieldnames[:5]}...")
     print(f"[SAVE] CSV → {out_path}")
 
-    # 同时保存固定文件名供后续脚本引用
+    # 固定文件名供后续脚本引用：硬链接到时间戳文件（不支持硬链接的文件系统退化为复制）
     latest_path = OUTPUT_DIR / "inventory_latest.csv"
-    with open(latest_path, "w", encoding="utf-8-sig", newline="") as f:
-        f.write(csv_text)
+    link_latest(out_path, latest_path)
     print(f"[SAVE] CSV → {latest_path}")
+    record_digest("inventory", stats["sha"].hexdigest(), latest_path.name)
 
     return out_path
 
 
-def run():
+def run(collect_rows: bool = False) -> list[dict] | None:
+    """
+    主入口
+    collect_rows=True：返回解析出的库存行（调度器流水线模式直接交给分析）；失败或未收集时返回 None
+    """
+    rows = [] if collect_rows else None
     try:
-        csv_text = fetch_inventory_csv()
-        parse_and_save(csv_text)
+        resp = fetch_inventory_stream()
+        stream_and_save(resp, sink=rows)
         print("[OK] 线边仓库存报表更新完成")
+        log_limiter_stats("ssrs")
+        return rows
     except ValueError as e:
         print(f"[CONFIG ERROR] {e}")
     except PermissionError as e:
         print(f"[AUTH ERROR] {e}")
     except requests.RequestException as e:
         print(f"[NETWORK ERROR] {e}")
+    return None
 
 
 if __name__ == "__main__":
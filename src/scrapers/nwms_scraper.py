@@ -10,7 +10,7 @@ NWMS 发料明细爬虫 - 内网 NWMS 仓储系统
 使用前：
   1. 浏览器打开 http://10.80.35.11:91，登录
   2. F12 → Network → 复制 Authorization 头中 bearer 后面的 Token
-  3. 粘贴到下方 NWMS_CONFIG["token"]
+  3. 写入 .env 的 NWMS_TOKEN（之后由 token_manager 自动刷新）
 
 运行：
   cd /home/chenweijie/projects/matetial_monitor
@@ -23,24 +23,37 @@ NWMS 发料明细爬虫 - 内网 NWMS 仓储系统
 
   # 模式3: 只拉取 COMPLETED 状态的备料单
   python3 src/scrapers/nwms_scraper.py --status COMPLETED
+
+  # 异步并发拉取行明细 + 扫码记录（每主机 8 个在途请求）
+  python3 src/scrapers/nwms_scraper.py --scan-records --concurrency 8
 """
 
 import os
-from src.auth.token_manager import refresh_nwms_token
+from src.auth.token_manager import NWMS_TOKENS
 import requests
+import asyncio
 import json
-import csv
 import time
 from datetime import datetime
 from pathlib import Path
+from urllib.parse import urlparse
+from src.scrapers.circuit_breaker import UpstreamUnavailable, breaker_tripped
+from src.scrapers.crawl_checkpoint import CrawlCheckpoint
+from src.scrapers.http_client import http_get_with_token
+from src.scrapers.page_size import fetch_first_page, get_sizer, log_page_stats
+from src.scrapers.pagination import iter_pages, page_count
+from src.scrapers.raw_store import persist_in_background, raw_path, save_snapshot, write_records
+from src.scrapers.source_digest import digest_records, record_digest
+from src.scrapers.throttle import log_limiter_stats
 
 # ─── 配置区（优先读环境变量，回退到硬编码值）────────────────────────────────
 NWMS_CONFIG = {
-    "base_url": "http://10.80.35.11:8080/nwms/v1/9",
-    "token": os.environ.get("NWMS_TOKEN", ""),
+    "base_url": os.environ.get("NWMS_SERVICE_URL", "http://10.80.35.11:8080/nwms") + "/v1/9",
     "site_id": "2.1",
     "frontend_url": "http://10.80.35.11:91",
-    "page_size": 200,
+    "page_size": 200,                                              # 默认页大小（各接口实际值见 page_size.py 自适应）
+    "concurrency": int(os.environ.get("NWMS_CONCURRENCY", "1")),  # 行明细/扫码并发数（每个主机），1=串行
+    "page_workers": int(os.environ.get("NWMS_PAGE_WORKERS", "4")), # 头表翻页并发预取数（1=逐页）
 }
 
 def _make_nwms_headers(token: str) -> dict:
@@ -56,44 +69,59 @@ def _make_nwms_headers(token: str) -> dict:
         ),
     }
 
-NWMS_HEADERS = _make_nwms_headers(NWMS_CONFIG["token"])
+
+def nwms_get(endpoint: str, url: str, **kwargs):
+    """NWMS 请求统一入口：Token 由 NWMS_TOKENS 提供（临近过期主动刷新，401 单飞刷新后重试）"""
+    return http_get_with_token(endpoint, url, NWMS_TOKENS, _make_nwms_headers, **kwargs)
 
 OUTPUT_DIR = Path(__file__).parent.parent.parent / "data" / "raw"
 
 
+def _extract_rows(data: dict) -> tuple[list, int]:
+    """兼容 NWMS 两种响应结构，返回 (content, totalElements)"""
+    rows = data.get("data", data).get("rows", data.get("rows", {}))
+    if isinstance(rows, dict):
+        return rows.get("content", []), rows.get("totalElements", 0)
+    if isinstance(rows, list):
+        return rows, len(rows)
+    return [], 0
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # 备料单头表拉取
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def fetch_issue_head_page(page: int, **extra_params) -> dict:
-    """拉取备料单头表单页，401 时自动刷新 Token 并重试"""
-    global NWMS_HEADERS
+def _sizer(endpoint: str):
+    return get_sizer(endpoint, NWMS_CONFIG["page_size"])
+
+
+def fetch_issue_head_page(page: int, size: int = None, **extra_params) -> dict:
+    """拉取备料单头表单页，401 时自动刷新 Token 并重试；size 默认取当前自适应页大小"""
     url = f"{NWMS_CONFIG['base_url']}/mt-work-orders/ins_woissue_head"
     params = {
         "page": page,
-        "size": NWMS_CONFIG["page_size"],
+        "size": size or _sizer("nwms.head").size,
         "siteId": NWMS_CONFIG["site_id"],
         **extra_params,
     }
-    resp = requests.get(url, headers=NWMS_HEADERS, params=params, timeout=30)
-    if resp.status_code == 401:
-        print("[TokenManager] NWMS Token 已过期，自动刷新...")
-        new_token = refresh_nwms_token()
-        NWMS_HEADERS = _make_nwms_headers(new_token)
-        resp = requests.get(url, headers=NWMS_HEADERS, params=params, timeout=30)
+    resp = nwms_get("nwms.head", url, params=params)
     resp.raise_for_status()
     return resp.json()
 
 
-def fetch_all_issue_heads(status: str = None, work_order: str = None, start_date: str = "2026-01-01") -> list[dict]:
+def fetch_all_issue_heads(status: str = None, work_order: str = None, start_date: str = "2026-01-01",
+                          stats: dict = None) -> list[dict]:
     """
     分页拉取全部备料单头表
     status: 可选，筛选状态（如 COMPLETED / RELEASED）
     work_order: 可选，按工单号筛选
     start_date: 筛选 ppStartTime >= 该日期的备料单
+    stats: 可选，传入 dict 时在 stats["complete"] 记录是否完整拉取（同 shop_order_scraper.fetch_all_orders）：
+           翻过的原始条数达到第 0 页的 totalElements，或整页早于 start_date 提前退出才算完整；
+           中途请求失败、空页或不足一页提前结束时返回已拉到的部分，complete=False
     """
     all_heads = []
-    page = 0
+    seen = {"raw": 0, "early_exit": False}  # 已翻过的原始条数（过滤前）/ 是否按 start_date 提前退出
     extra = {}
     if status:
         extra["instructionDocStatus"] = status
@@ -105,28 +133,21 @@ def fetch_all_issue_heads(status: str = None, work_order: str = None, start_date
         filter_desc += f" | 工单={work_order}"
     print(f"[INFO] 开始拉取备料单头表 | 筛选: {filter_desc}")
 
-    while True:
-        try:
-            data = fetch_issue_head_page(page, **extra)
-        except requests.RequestException as e:
-            print(f"[ERROR] 第 {page} 页请求失败: {e}")
-            break
+    sizer = _sizer("nwms.head")
+    size = sizer.size
 
-        rows = data.get("data", data).get("rows", data.get("rows", {}))
-        if isinstance(rows, dict):
-            content = rows.get("content", [])
-            total = rows.get("totalElements", 0)
-        elif isinstance(rows, list):
-            content = rows
-            total = len(rows)
-        else:
-            content = []
-            total = 0
+    def _fetch(page: int, page_size: int = None) -> dict:
+        sizer.count()
+        return fetch_issue_head_page(page, page_size or size, **extra)
+
+    def _take(page: int, data: dict) -> bool:
+        """处理单页响应，返回是否继续翻页"""
+        content, total = _extract_rows(data)
 
         if not content:
             if page == 0:
                 print(f"[WARN] 第 0 页无数据，请检查 Token 或筛选条件")
-            break
+            return False
 
         # 按 start_date 过滤
         valid_content = []
@@ -136,25 +157,46 @@ def fetch_all_issue_heads(status: str = None, work_order: str = None, start_date
                 continue
             valid_content.append(row)
 
+        seen["raw"] += len(content)
         all_heads.extend(valid_content)
         if page == 0:
             print(f"  总记录数: {total}")
         print(f"  → 第 {page + 1} 页: 获取 {len(valid_content)} 条(原始 {len(content)} 条)，累计 {len(all_heads)}")
 
-        # 整页数据均早于 start_date，后续页只会更旧，提前退出
+        # 整页数据均早于 start_date，后续页只会更旧，提前退出（已在途的同批页直接丢弃）
         if len(valid_content) == 0 and len(all_heads) > 0:
             print(f"  [早退] 整页数据均早于 {start_date}，停止翻页")
-            break
+            seen["early_exit"] = True
+            return False
 
         if len(all_heads) >= total:
-            break
-        if len(content) < NWMS_CONFIG["page_size"]:
-            break
-
-        page += 1
-        time.sleep(0.3)
-
-    print(f"[INFO] 备料单拉取完成，共 {len(all_heads)} 条")
+            return False
+        if len(content) < size:
+            return False
+        return True
+
+    # 第 0 页拿到 totalElements 后，其余页按批并发预取、按页序处理；出错页 = 最后一个成功页 + 1
+    # 第 0 页需要多页时顺带试探更大的页大小（头表通常是翻页最多的列表）
+    last = -1
+    total = None
+    try:
+        size, data = fetch_first_page(sizer, lambda s: _fetch(0, s), _extract_rows)
+        last = 0
+        total = _extract_rows(data)[1]
+        if _take(0, data):
+            n_pages = page_count(total, size)
+            for last, data in iter_pages(_fetch, 1, n_pages, workers=NWMS_CONFIG["page_workers"]):
+                if not _take(last, data):
+                    break
+    except requests.RequestException as e:
+        print(f"[ERROR] 第 {last + 1} 页请求失败: {e}")
+
+    complete = total is not None and (seen["early_exit"] or seen["raw"] >= total)
+    if total is not None and not complete:
+        print(f"[WARN] 翻页提前结束：翻过 {seen['raw']} / {total} 条，按不完整处理")
+    if stats is not None:
+        stats["complete"] = complete
+    print(f"[INFO] 备料单拉取完成，共 {len(all_heads)} 条" + ("" if complete else "（不完整）"))
     return all_heads
 
 
@@ -163,105 +205,278 @@ def fetch_all_issue_heads(status: str = None, work_order: str = None, start_date
 # 返回字段：instructionId（行级ID）、componentCode、demandQuantity、actualQuantity 等
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def fetch_issue_lines_for_doc(instruction_doc_id: str) -> list[dict]:
-    """拉取单个备料单的全部发料行项目（自动翻页）"""
+def fetch_issue_lines_for_doc(instruction_doc_id: str, raise_errors: bool = False) -> list[dict]:
+    """
+    拉取单个备料单的全部发料行项目（自动翻页）
+    raise_errors=True 时请求失败直接抛出（供增量缓存区分"空单"与"拉取失败"）
+    """
     url = f"{NWMS_CONFIG['base_url']}/mt-work-orders/woissueLineDetail/{instruction_doc_id}/"
-    all_lines = []
+    return _fetch_pages_serial("nwms.line", url, {}, f"woissueLineDetail/{instruction_doc_id}/", raise_errors)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# 扫码实发记录拉取（步骤2：woissueLineActualDetail?instructionId={行级ID}）
+# 返回字段：barcode、executeQuantity、executeTime、fromWarehouse、toWarehouse 等
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def fetch_scan_records_for_line(instruction_id: str, raise_errors: bool = False) -> list[dict]:
+    """拉取单条发料行的全部扫码实发记录（自动翻页）"""
+    url = f"{NWMS_CONFIG['base_url']}/mt-work-orders/woissueLineActualDetail"
+    return _fetch_pages_serial("nwms.scan", url, {"instructionId": instruction_id},
+                               f"woissueLineActualDetail/{instruction_id}", raise_errors)
+
+
+def _fetch_pages_serial(endpoint: str, url: str, params: dict, label: str, raise_errors: bool) -> list[dict]:
+    """逐页拉取分页接口全部记录；第 0 页需要多页时顺带试探更大的页大小"""
+    sizer = _sizer(endpoint)
+
+    def _fetch(page: int, size: int) -> dict:
+        sizer.count()
+        resp = nwms_get(endpoint, url, params={**params, "page": page, "size": size})
+        resp.raise_for_status()
+        return resp.json()
+
+    records = []
     page = 0
+    try:
+        size, data = fetch_first_page(sizer, lambda s: _fetch(0, s), _extract_rows)
+    except requests.RequestException as e:
+        if raise_errors:
+            raise
+        print(f"    [ERROR] {label} 第{page}页: {e}")
+        return records
 
     while True:
-        params = {"page": page, "size": NWMS_CONFIG["page_size"]}
-        try:
-            resp = requests.get(url, headers=NWMS_HEADERS, params=params, timeout=30)
-            resp.raise_for_status()
-            data = resp.json()
-        except requests.RequestException as e:
-            print(f"    [ERROR] woissueLineDetail/{instruction_doc_id}/ 第{page}页: {e}")
-            break
-
-        rows = data.get("data", data).get("rows", data.get("rows", {}))
-        if isinstance(rows, dict):
-            content = rows.get("content", [])
-            total = rows.get("totalElements", 0)
-        elif isinstance(rows, list):
-            content = rows
-            total = len(rows)
-        else:
-            content = []
-            total = 0
+        content, total = _extract_rows(data)
 
         if not content:
             break
 
-        all_lines.extend(content)
+        records.extend(content)
 
-        if len(all_lines) >= total:
+        if len(records) >= total:
             break
-        if len(content) < NWMS_CONFIG["page_size"]:
+        if len(content) < size:
             break
 
         page += 1
-        time.sleep(0.15)
+        try:
+            data = _fetch(page, size)
+        except requests.RequestException as e:
+            if raise_errors:
+                raise
+            print(f"    [ERROR] {label} 第{page}页: {e}")
+            break
+
+    return records
+
 
-    return all_lines
+def _enrich_line(ln: dict, head: dict) -> None:
+    """为行明细附加头表关键字段（工单号、产线等）"""
+    ln["_instructionDocId"] = str(head.get("instructionDocId", ""))
+    ln["_demandListNumber"] = head.get("demandListNumber", "")
+    ln["_workOrderNum"] = head.get("workOrderNum", "")
+    ln["_productionLine"] = head.get("productionLine", "")
+    ln["_wareHouse"] = head.get("wareHouse", "")
+    ln["_docStatus"] = head.get("instructionDocStatus", "")
+    ln["_ppStartTime"] = head.get("ppStartTime", "")
+
+
+def _apply_scan_summary(ln: dict, scans: list[dict]) -> None:
+    ln["_scanCount"] = len(scans)
+    ln["_scanExecuteQty"] = sum(float(s.get("executeQuantity") or 0) for s in scans)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-# 扫码实发记录拉取（步骤2：woissueLineActualDetail?instructionId={行级ID}）
-# 返回字段：barcode、executeQuantity、executeTime、fromWarehouse、toWarehouse 等
+# 异步并发抓取引擎（woissueLineDetail + woissueLineActualDetail）
+# 每个主机一个 Semaphore 限制在途请求数；单据内分页在拿到 totalElements 后并发拉取
+# HTTP 仍走 requests（在线程池中执行），不引入额外依赖
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def fetch_scan_records_for_line(instruction_id: str) -> list[dict]:
-    """拉取单条发料行的全部扫码实发记录（自动翻页）"""
-    url = f"{NWMS_CONFIG['base_url']}/mt-work-orders/woissueLineActualDetail"
-    all_records = []
-    page = 0
-
-    while True:
-        params = {"instructionId": instruction_id, "page": page, "size": NWMS_CONFIG["page_size"]}
+class _AsyncCrawler:
+    def __init__(self, concurrency: int, raise_errors: bool = False):
+        self.concurrency = max(1, concurrency)
+        self.raise_errors = raise_errors
+        self._host_sems: dict[str, asyncio.Semaphore] = {}
+
+    def _sem(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        if host not in self._host_sems:
+            self._host_sems[host] = asyncio.Semaphore(self.concurrency)
+        return self._host_sems[host]
+
+    async def get_json(self, endpoint: str, url: str, params: dict) -> dict:
+        async with self._sem(url):
+            resp = await asyncio.to_thread(nwms_get, endpoint, url, params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def _get_page(self, endpoint: str, url: str, params: dict, page: int, size: int,
+                        label: str) -> dict | None:
+        _sizer(endpoint).count()
         try:
-            resp = requests.get(url, headers=NWMS_HEADERS, params=params, timeout=30)
-            resp.raise_for_status()
-            data = resp.json()
+            return await self.get_json(endpoint, url, {**params, "page": page, "size": size})
         except requests.RequestException as e:
-            print(f"    [ERROR] woissueLineActualDetail/{instruction_id} 第{page}页: {e}")
-            break
+            if self.raise_errors:
+                raise
+            print(f"    [ERROR] {label} 第{page}页: {e}")
+            return None
+
+    async def _first_page(self, endpoint: str, url: str, params: dict, label: str) -> tuple[int, dict | None]:
+        """取第 0 页（需要多页时顺带试探更大的页大小，见 page_size.fetch_first_page），返回 (size, 响应)"""
+        sizer = _sizer(endpoint)
+
+        def _fetch(size: int) -> dict:
+            sizer.count()
+            resp = nwms_get(endpoint, url, params={**params, "page": 0, "size": size})
+            resp.raise_for_status()
+            return resp.json()
 
-        rows = data.get("data", data).get("rows", data.get("rows", {}))
-        if isinstance(rows, dict):
-            content = rows.get("content", [])
-            total = rows.get("totalElements", 0)
-        elif isinstance(rows, list):
-            content = rows
-            total = len(rows)
-        else:
-            content = []
-            total = 0
+        try:
+            async with self._sem(url):
+                return await asyncio.to_thread(fetch_first_page, sizer, _fetch, _extract_rows)
+        except requests.RequestException as e:
+            if self.raise_errors:
+                raise
+            print(f"    [ERROR] {label} 第0页: {e}")
+            return sizer.size, None
+
+    async def fetch_pages(self, endpoint: str, url: str, params: dict, label: str) -> list[dict]:
+        """拉取分页接口全部记录：先取第 0 页得到 totalElements，其余页并发拉取后按页序拼接"""
+        size, data = await self._first_page(endpoint, url, params, label)
+        if data is None:
+            return []
+        content, total = _extract_rows(data)
+        if not content or len(content) >= total or len(content) < size:
+            return list(content)
+
+        n_pages = -(-total // size)
+        records = list(content)
+        pages = await asyncio.gather(*(self._get_page(endpoint, url, params, p, size, label)
+                                       for p in range(1, n_pages)))
+        for d in pages:
+            if d is not None:
+                records.extend(_extract_rows(d)[0])
+        return records
+
+    async def fetch_doc(self, head: dict, fetch_scans: bool) -> list[dict]:
+        doc_id = str(head.get("instructionDocId", ""))
+        lines = await self.fetch_pages(
+            "nwms.line", f"{NWMS_CONFIG['base_url']}/mt-work-orders/woissueLineDetail/{doc_id}/",
+            {}, f"woissueLineDetail/{doc_id}/",
+        )
+        for ln in lines:
+            _enrich_line(ln, head)
+        if fetch_scans:
+            scan_url = f"{NWMS_CONFIG['base_url']}/mt-work-orders/woissueLineActualDetail"
+            targets = [ln for ln in lines if str(ln.get("instructionId", ""))]
+            scan_results = await asyncio.gather(*(
+                self.fetch_pages("nwms.scan", scan_url, {"instructionId": str(ln["instructionId"])},
+                                 f"woissueLineActualDetail/{ln['instructionId']}")
+                for ln in targets
+            ))
+            for ln, scans in zip(targets, scan_results):
+                _apply_scan_summary(ln, scans)
+        return lines
+
+
+async def fetch_issue_details_by_doc_async(heads: list[dict], fetch_scans: bool = False,
+                                           concurrency: int = None, raise_errors: bool = False,
+                                           checkpoint: CrawlCheckpoint = None) -> dict[str, list[dict]]:
+    """
+    异步并发版：返回 {instructionDocId: 行明细列表}，按 heads 顺序插入，拉取失败的备料单不在结果中
+    concurrency: 每个主机的最大在途请求数（默认 NWMS_CONFIG["concurrency"]）
+    checkpoint: 每完成一个备料单即登记（断点续传，见 crawl_checkpoint.py）
+    """
+    crawler = _AsyncCrawler(concurrency or NWMS_CONFIG["concurrency"], raise_errors=raise_errors)
+    docs = [h for h in heads if str(h.get("instructionDocId", ""))]
+    total = len(docs)
+    done = 0
+    empty_count = 0
+    error_count = 0
+    detail_count = 0
 
-        if not content:
-            break
+    print(f"[INFO] 异步并发拉取发料行明细，共 {total} 个备料单 | 每主机并发={crawler.concurrency}"
+          + (" + 扫码记录汇总" if fetch_scans else ""))
 
-        all_records.extend(content)
+    async def _run(head: dict) -> list[dict] | None:
+        nonlocal done, empty_count, error_count, detail_count
+        try:
+            lines = await crawler.fetch_doc(head, fetch_scans)
+        except Exception as e:
+            error_count += 1
+            if not isinstance(e, UpstreamUnavailable):  # 熔断后的快速失败不逐条打印
+                print(f"  (ERROR) {head.get('demandListNumber', '')}: {e}")
+            lines = None
+        done += 1
+        if lines is not None:
+            if not lines:
+                empty_count += 1
+            detail_count += len(lines)
+            if checkpoint is not None:
+                checkpoint.record(str(head["instructionDocId"]), lines, _doc_tag(head))
+        if done % 20 == 0 or done == total:
+            print(f"  [{done}/{total}] 累计 {detail_count} 条行明细"
+                  f" | 空={empty_count} | 错误={error_count}")
+        return lines
+
+    results = await asyncio.gather(*(_run(h) for h in docs))
+    by_doc = {}
+    for head, lines in zip(docs, results):
+        if lines is not None:
+            by_doc[str(head["instructionDocId"])] = lines
 
-        if len(all_records) >= total:
-            break
-        if len(content) < NWMS_CONFIG["page_size"]:
-            break
+    print(f"[INFO] 发料行明细拉取完成")
+    print(f"  总计: {detail_count} 条行明细")
+    print(f"  空备料单: {empty_count} 个")
+    print(f"  请求错误: {error_count} 个")
+    return by_doc
 
-        page += 1
-        time.sleep(0.15)
 
-    return all_records
+def _doc_tag(head: dict) -> str:
+    """检查点标记：备料单头表状态变化后，上次已完成的行明细不再复用"""
+    return head.get("instructionDocStatus", "") or ""
 
 
-def fetch_all_issue_details(heads: list[dict], fetch_scans: bool = False) -> list[dict]:
+def fetch_issue_details_by_doc(heads: list[dict], fetch_scans: bool = False, concurrency: int = None,
+                               raise_errors: bool = False,
+                               checkpoint: CrawlCheckpoint = None) -> dict[str, list[dict]]:
     """
-    批量拉取所有备料单的发料行明细（两步法）
+    批量拉取备料单的发料行明细（两步法），返回 {instructionDocId: 行明细列表}
       步骤1: woissueLineDetail/{instructionDocId}/ → 行级 demandQuantity/actualQuantity
       步骤2(可选): woissueLineActualDetail?instructionId={line.instructionId} → 扫码记录汇总
-    每条行明细附加头表关键字段（工单号、产线等）
+    每条行明细附加头表关键字段（工单号、产线等）；拉取失败的备料单不在结果中
+    concurrency > 1 时切换为异步并发引擎（fetch_issue_details_by_doc_async）
+    raise_errors=True 时任一分页失败即视为该备料单拉取失败（不返回残缺明细）
+    checkpoint 不为 None 时跳过其中已完成且状态未变的备料单，并逐个登记本次完成的备料单
     """
-    all_details = []
+    all_heads = heads
+    resumed = {}
+    if checkpoint is not None:
+        resumed, heads = checkpoint.split(heads, lambda h: str(h.get("instructionDocId", "")), _doc_tag)
+
+    concurrency = concurrency or NWMS_CONFIG["concurrency"]
+    if concurrency > 1:
+        by_doc = asyncio.run(fetch_issue_details_by_doc_async(heads, fetch_scans, concurrency, raise_errors,
+                                                              checkpoint))
+    else:
+        by_doc = _fetch_issue_details_serial(heads, fetch_scans, raise_errors, checkpoint)
+
+    if checkpoint is not None:
+        checkpoint.mark_failed(d for d in (str(h.get("instructionDocId", "")) for h in heads)
+                               if d and d not in by_doc)
+    if not resumed:
+        return by_doc
+    by_doc.update(resumed)
+    order = (str(h.get("instructionDocId", "")) for h in all_heads)
+    return {d: by_doc[d] for d in order if d in by_doc}
+
+
+def _fetch_issue_details_serial(heads: list[dict], fetch_scans: bool, raise_errors: bool,
+                                checkpoint: CrawlCheckpoint = None) -> dict[str, list[dict]]:
+    """串行版（concurrency=1）：逐个备料单拉取"""
+    by_doc = {}
+    detail_count = 0
     total = len(heads)
     empty_count = 0
     error_count = 0
@@ -271,17 +486,20 @@ def fetch_all_issue_details(heads: list[dict], fetch_scans: bool = False) -> lis
     for i, head in enumerate(heads, 1):
         doc_id = str(head.get("instructionDocId", ""))
         doc_num = head.get("demandListNumber", "")
-        wo_num = head.get("workOrderNum", "")
-        line = head.get("productionLine", "")
-        warehouse = head.get("wareHouse", "")
-        doc_status = head.get("instructionDocStatus", "")
-        pp_start_time = head.get("ppStartTime", "")
 
         if not doc_id:
             continue
 
         try:
-            lines = fetch_issue_lines_for_doc(doc_id)
+            lines = fetch_issue_lines_for_doc(doc_id, raise_errors=raise_errors)
+            for ln in lines:
+                _enrich_line(ln, head)
+
+                # 可选：拉取扫码实发记录，汇总 scanCount / scanExecuteQty
+                if fetch_scans:
+                    line_id = str(ln.get("instructionId", ""))
+                    if line_id:
+                        _apply_scan_summary(ln, fetch_scan_records_for_line(line_id, raise_errors=raise_errors))
         except Exception as e:
             error_count += 1
             if i % 50 == 0 or i == total:
@@ -290,99 +508,191 @@ def fetch_all_issue_details(heads: list[dict], fetch_scans: bool = False) -> lis
 
         if not lines:
             empty_count += 1
-        else:
-            for ln in lines:
-                ln["_instructionDocId"] = doc_id
-                ln["_demandListNumber"] = doc_num
-                ln["_workOrderNum"] = wo_num
-                ln["_productionLine"] = line
-                ln["_wareHouse"] = warehouse
-                ln["_docStatus"] = doc_status
-                ln["_ppStartTime"] = pp_start_time
-
-                # 可选：拉取扫码实发记录，汇总 scanCount / scanExecuteQty
-                if fetch_scans:
-                    line_id = str(ln.get("instructionId", ""))
-                    if line_id:
-                        scans = fetch_scan_records_for_line(line_id)
-                        ln["_scanCount"] = len(scans)
-                        ln["_scanExecuteQty"] = sum(
-                            float(s.get("executeQuantity") or 0) for s in scans
-                        )
-                        time.sleep(0.1)
-
-            all_details.extend(lines)
+        by_doc[doc_id] = lines
+        detail_count += len(lines)
+        if checkpoint is not None:
+            checkpoint.record(doc_id, lines, _doc_tag(head))
 
         if i % 20 == 0 or i == total:
-            print(f"  [{i}/{total}] 累计 {len(all_details)} 条行明细"
+            print(f"  [{i}/{total}] 累计 {detail_count} 条行明细"
                   f" | 空={empty_count} | 错误={error_count}"
                   f" | 当前: {doc_num} → {len(lines) if lines else 0} 条")
 
-        time.sleep(0.2)
-
     print(f"[INFO] 发料行明细拉取完成")
-    print(f"  总计: {len(all_details)} 条行明细")
+    print(f"  总计: {detail_count} 条行明细")
     print(f"  空备料单: {empty_count} 个")
     print(f"  请求错误: {error_count} 个")
 
+    return by_doc
+
+
+def fetch_all_issue_details(heads: list[dict], fetch_scans: bool = False, concurrency: int = None,
+                            checkpoint: CrawlCheckpoint = None) -> list[dict]:
+    """批量拉取所有备料单的发料行明细，返回按备料单顺序拼接的扁平列表"""
+    all_details = []
+    for lines in fetch_issue_details_by_doc(heads, fetch_scans=fetch_scans, concurrency=concurrency,
+                                            checkpoint=checkpoint).values():
+        all_details.extend(lines)
     return all_details
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-# 保存
+# 增量同步：按 instructionDocId 缓存行明细
+# 终态（COMPLETED / CANCEL）且头表状态未变的备料单直接复用缓存，不再请求 NWMS
+# 缓存结构：{instructionDocId: {"status": 拉取时头表状态, "scans": 是否含扫码汇总, "lines": [...]}}
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def save_json(data: list[dict], filename: str) -> Path:
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    path = OUTPUT_DIR / filename
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    print(f"[SAVE] JSON → {path}")
-    return path
+NWMS_TERMINAL_STATUSES = {"COMPLETED", "CANCEL"}
+NWMS_CACHE_PATH = OUTPUT_DIR.parent / "cache" / "nwms_lines_cache.json"
+_SCAN_FIELDS = ("_scanCount", "_scanExecuteQty")
 
 
-def save_csv(data: list[dict], filename: str) -> Path:
-    if not data:
-        print("[WARN] 无数据可保存")
-        return None
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    path = OUTPUT_DIR / filename
-    keys = list(data[0].keys())
-    with open(path, "w", newline="", encoding="utf-8-sig") as f:
-        writer = csv.DictWriter(f, fieldnames=keys, extrasaction="ignore")
-        writer.writeheader()
-        writer.writerows(data)
-    print(f"[SAVE] CSV  → {path}")
-    return path
+def load_nwms_cache() -> dict:
+    if not NWMS_CACHE_PATH.exists():
+        return {}
+    try:
+        with open(NWMS_CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] NWMS 行明细缓存读取失败，按全量处理: {e}")
+        return {}
+
+
+def save_nwms_cache(cache: dict) -> None:
+    NWMS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = NWMS_CACHE_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp, NWMS_CACHE_PATH)
+    print(f"[SAVE] NWMS 缓存 → {NWMS_CACHE_PATH}（{len(cache)} 个备料单）")
+
+
+def plan_nwms_refresh(heads: list[dict], cache: dict, fetch_scans: bool = False,
+                      retry: set[str] = None) -> list[dict]:
+    """
+    返回需要重新拉取行明细的头表：新单 / 非终态 / 头表状态变化 / 需要扫码汇总但缓存没有 /
+    上次运行拉取失败（retry，见 CrawlCheckpoint.retry_keys）
+    """
+    retry = retry or set()
+    stale = []
+    for head in heads:
+        doc_id = str(head.get("instructionDocId", ""))
+        if not doc_id:
+            continue
+        status = head.get("instructionDocStatus", "")
+        entry = cache.get(doc_id)
+        if (entry is None
+                or doc_id in retry
+                or status not in NWMS_TERMINAL_STATUSES
+                or entry.get("status") != status
+                or (fetch_scans and not entry.get("scans"))):
+            stale.append(head)
+    return stale
+
+
+def fetch_issue_details_incremental(heads: list[dict], fetch_scans: bool = False,
+                                    concurrency: int = None, checkpoint: CrawlCheckpoint = None) -> list[dict]:
+    """
+    增量拉取行明细：只请求 plan_nwms_refresh 选出的备料单，其余从缓存合并
+    输出与全量 fetch_all_issue_details 一致（按头表顺序、附加字段按当前头表重新填充）
+    """
+    cache = load_nwms_cache()
+    to_fetch = plan_nwms_refresh(heads, cache, fetch_scans, checkpoint.retry_keys if checkpoint else None)
+    print(f"[INFO] 增量同步：{len(heads)} 个备料单，需拉取 {len(to_fetch)} 个，"
+          f"终态缓存命中 {len(heads) - len(to_fetch)} 个")
+
+    fetched = fetch_issue_details_by_doc(to_fetch, fetch_scans=fetch_scans,
+                                         concurrency=concurrency, raise_errors=True, checkpoint=checkpoint)
+    for head in to_fetch:
+        doc_id = str(head["instructionDocId"])
+        if doc_id in fetched:
+            cache[doc_id] = {
+                "status": head.get("instructionDocStatus", ""),
+                "scans": fetch_scans,
+                "lines": fetched[doc_id],
+            }
+
+    # 只保留本次头表范围内的备料单；拉取失败的沿用旧缓存
+    doc_ids = [str(h.get("instructionDocId", "")) for h in heads]
+    cache = {d: cache[d] for d in doc_ids if d in cache}
+    save_nwms_cache(cache)
+
+    all_details = []
+    for head in heads:
+        entry = cache.get(str(head.get("instructionDocId", "")))
+        if not entry:
+            continue
+        for cached in entry["lines"]:
+            ln = dict(cached)
+            if not fetch_scans:
+                for k in _SCAN_FIELDS:
+                    ln.pop(k, None)
+            _enrich_line(ln, head)
+            all_details.append(ln)
+    return all_details
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # 主流程
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def run(status: str = None, work_order: str = None, fetch_scans: bool = False, start_date: str = "2026-01-01"):
-    """主入口"""
+def run(status: str = None, work_order: str = None, fetch_scans: bool = False, start_date: str = "2026-01-01",
+        concurrency: int = None, full: bool = False, export_csv: bool = None,
+        background: bool = False) -> list[dict] | None:
+    """
+    主入口，返回本次发料行明细（无数据时 None）
+    full=False（默认）：增量模式，终态且状态未变的备料单复用本地缓存
+    full=True：全部备料单重新拉取行明细
+    export_csv=True：额外导出头表/明细的 latest CSV（None = 读 RAW_EXPORT_CSV）
+    background=True：快照在后台落盘（调度器流水线模式，返回值直接交给分析）
+    """
     ts = datetime.now().strftime("%Y%m%d_%H%M")
 
     # 1. 拉取备料单头表
-    heads = fetch_all_issue_heads(status=status, work_order=work_order, start_date=start_date)
+    head_stats = {}
+    heads = fetch_all_issue_heads(status=status, work_order=work_order, start_date=start_date, stats=head_stats)
     if not heads:
         print("[ERROR] 未获取到备料单数据，请检查 Token 或网络")
-        return
+        return None
+    # 头表不完整时不拉行明细：增量缓存按头表范围裁剪，会丢掉失败页之后全部终态备料单的缓存
+    if breaker_tripped("nwms") or not head_stats["complete"]:
+        print("[WARN] NWMS 已熔断或头表翻页中途失败，本次备料单头表不完整，保留上一份 latest 快照与行明细缓存")
+        log_page_stats("nwms")
+        log_limiter_stats("nwms")
+        return None
 
     # 保存头表
-    save_json(heads, f"nwms_issue_heads_{ts}.json")
-    save_csv(heads, f"nwms_issue_heads_{ts}.csv")
-    save_json(heads, "nwms_issue_heads_latest.json")
-    save_csv(heads, "nwms_issue_heads_latest.csv")
+    if background:
+        persist_in_background(save_snapshot, heads, "nwms_issue_heads", ts, export=export_csv)
+    else:
+        save_snapshot(heads, "nwms_issue_heads", ts, export=export_csv)
 
     # 2. 拉取发料行明细（步骤1: woissueLineDetail + 可选步骤2: woissueLineActualDetail）
-    details = fetch_all_issue_details(heads, fetch_scans=fetch_scans)
+    #    中途退出时下次运行从检查点继续；运行完成（结果已并入缓存）即删除检查点，拉取失败的备料单下次强制重拉
+    checkpoint = CrawlCheckpoint("nwms_lines", {"scans": fetch_scans})
+    try:
+        if full:
+            details = fetch_all_issue_details(heads, fetch_scans=fetch_scans, concurrency=concurrency,
+                                              checkpoint=checkpoint)
+        else:
+            details = fetch_issue_details_incremental(heads, fetch_scans=fetch_scans, concurrency=concurrency,
+                                                      checkpoint=checkpoint)
+    finally:
+        checkpoint.close()
+    checkpoint.finish()
+    if breaker_tripped("nwms"):
+        print("[WARN] NWMS 已熔断，本次发料明细不完整，保留上一份 latest 快照（下次运行从检查点续传）")
+        log_page_stats("nwms")
+        log_limiter_stats("nwms")
+        return None
     if details:
-        save_json(details, f"nwms_issue_details_{ts}.json")
-        save_csv(details, f"nwms_issue_details_{ts}.csv")
-        save_json(details, "nwms_issue_details_latest.json")
-        save_csv(details, "nwms_issue_details_latest.csv")
+        def _persist():
+            latest = save_snapshot(details, "nwms_issue_details", ts, export=export_csv)
+            record_digest("nwms_details", digest_records(details), latest.name)
+        if background:
+            persist_in_background(_persist)
+        else:
+            _persist()
 
         # 打印字段结构（首次运行时很有用）
         print(f"\n[INFO] 发料明细字段列表:")
@@ -402,6 +712,9 @@ def run(status: str = None, work_order: str = None, fetch_scans: bool = False, s
     for d in details:
         docs_with_detail.add(d.get("_instructionDocId", ""))
     print(f"  有明细的备料单: {len(docs_with_detail)} / {len(heads)} 个")
+    log_page_stats("nwms")
+    log_limiter_stats("nwms")
+    return details or None
 
 
 if __name__ == "__main__":
@@ -418,6 +731,11 @@ if __name__ == "__main__":
                         help="测试模式：只拉取前5个备料单的明细")
     parser.add_argument("--start", default="2026-01-01",
                         help="只拉取 ppStartTime >= 此日期的备料单（默认 2026-01-01）")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="行明细/扫码记录异步并发数（默认读 NWMS_CONCURRENCY，1=串行）")
+    parser.add_argument("--full", action="store_true",
+                        help="忽略本地行明细缓存，全部备料单重新拉取")
+    parser.add_argument("--csv", action="store_true", help="额外导出头表/明细的 latest CSV")
     args = parser.parse_args()
 
     if args.test:
@@ -427,9 +745,11 @@ if __name__ == "__main__":
         if heads:
             test_heads = heads[:5]
             print(f"[TEST] 取前 {len(test_heads)} 个备料单测试...")
-            details = fetch_all_issue_details(test_heads, fetch_scans=args.scan_records)
+            details = fetch_all_issue_details(test_heads, fetch_scans=args.scan_records,
+                                              concurrency=args.concurrency)
             if details:
-                save_json(details, "nwms_issue_details_test.json")
+                path = write_records(details, raw_path("nwms_issue_details", "test"))
+                print(f"[SAVE] JSONL → {path}")
                 print(f"\n[TEST] 发料行明细字段列表:")
                 for key in details[0].keys():
                     sample_val = details[0].get(key)
@@ -437,4 +757,5 @@ if __name__ == "__main__":
             else:
                 print("[TEST] 前5个备料单均无行明细")
     else:
-        run(status=args.status, work_order=args.work_order, fetch_scans=args.scan_records, start_date=args.start)
+        run(status=args.status, work_order=args.work_order, fetch_scans=args.scan_records, start_date=args.start,
+            concurrency=args.concurrency, full=args.full, export_csv=args.csv or None)
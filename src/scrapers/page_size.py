@@ -0,0 +1,237 @@
+"""
+分页大小自适应 - 每个分页接口（imes.shop_order / nwms.head / nwms.line / nwms.scan）一个
+  - 起始为各爬虫配置的 page_size；某次列表需要多页时，用更大的 size 重取第 0 页试探
+    （按 PAGE_SIZE_STEPS 逐级放大，上限 PAGE_SIZE_MAX），探测请求本身就是有效数据，不额外浪费
+  - 逐级放大直到：请求报错 / 耗时超过 PAGE_LATENCY_BUDGET 秒 / 服务端静默截断（返回条数 < size 且未取完）
+    / 到达上限，此时确定该接口的页大小；截断时直接采用服务端实际上限
+  - 结果写入 data/cache/page_sizes.json，下次运行直接沿用；超过 PAGE_SIZE_REPROBE_HOURS 小时后从缓存值继续试探
+  - 沿用缓存值的请求出错（4xx / 超时）时退回默认页大小重试一次并清除该接口缓存
+  - 每个接口统计本次运行的请求页数，运行结束由 log_page_stats() 写入日志
+PAGE_SIZE_ADAPTIVE=0 关闭试探，全部使用默认页大小
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+
+PAGE_SIZE_CACHE_PATH = Path(__file__).parent.parent.parent / "data" / "cache" / "page_sizes.json"
+
+PAGE_SIZE_CONFIG = {
+    "adaptive": os.environ.get("PAGE_SIZE_ADAPTIVE", "1") != "0",
+    "max": int(os.environ.get("PAGE_SIZE_MAX", "2000")),                       # 试探上限
+    "latency_budget": float(os.environ.get("PAGE_LATENCY_BUDGET", "3")),       # 单页请求耗时上限（秒）
+    "reprobe_hours": float(os.environ.get("PAGE_SIZE_REPROBE_HOURS", "168")),  # 已确定的页大小多久后重新试探
+}
+PAGE_SIZE_STEPS = (250, 500, 1000, 2000, 5000)
+
+
+class PageSizer:
+    """单个分页接口的页大小：size 为当前使用值，probe() 试探更大的值，fallback() 出错时退回默认值"""
+
+    def __init__(self, endpoint: str, default: int, cached: dict = None):
+        self.endpoint = endpoint
+        self.default = default
+        self.size = default
+        self.settled = False  # 已找到上限（报错 / 超时 / 截断 / 到顶），不再试探
+        self.probed_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        # 统计
+        self.pages = 0
+        self.probes = 0
+        if cached:
+            self.size = max(int(cached.get("size", default)), default)
+            self.probed_at = cached.get("probed_at")
+            try:
+                age = datetime.now() - datetime.fromisoformat(self.probed_at or "")
+                self.settled = bool(cached.get("settled")) and age < timedelta(
+                    hours=PAGE_SIZE_CONFIG["reprobe_hours"])
+            except ValueError:
+                self.settled = False
+
+    def count(self, pages: int = 1) -> None:
+        with self._lock:
+            self.pages += pages
+
+    def _next_step(self, size: int) -> int | None:
+        for step in PAGE_SIZE_STEPS:
+            if size < step <= PAGE_SIZE_CONFIG["max"]:
+                return step
+        return None
+
+    def should_probe(self, size: int, content_len: int, total: int) -> bool:
+        """本次列表第 0 页已满且还有后续页、且当前值未确定时，值得试探更大的页"""
+        return (PAGE_SIZE_CONFIG["adaptive"] and not self.settled and not self._probing
+                and size == self.size and content_len >= size and total > size
+                and self._next_step(size) is not None)
+
+    def probe(self, fetch, size: int, data: dict, extract) -> tuple[int, dict]:
+        """
+        用逐级放大的 size 重取第 0 页，返回 (本次列表使用的 size, 对应的第 0 页响应)
+        fetch(size) 取第 0 页响应（并计入 count()，出错抛 requests.RequestException），extract(data) 返回 (content, total)
+        同一时间只有一个线程试探，其余调用直接沿用当前值
+        """
+        with self._lock:
+            if self._probing:
+                return size, data
+            self._probing = True
+        try:
+            while True:
+                candidate = self._next_step(size)
+                if candidate is None:
+                    self._settle(size, "已到上限")
+                    break
+                self.probes += 1
+                started = time.perf_counter()
+                try:
+                    new = fetch(candidate)
+                except requests.RequestException as e:
+                    self._settle(size, f"size={candidate} 请求失败: {e}")
+                    break
+                elapsed = time.perf_counter() - started
+                content, total = extract(new)
+                if elapsed > PAGE_SIZE_CONFIG["latency_budget"]:
+                    self._settle(size, f"size={candidate} 耗时 {elapsed:.1f}s 超出预算")
+                    break
+                if len(content) < min(candidate, total):
+                    # 服务端静默截断：实际上限即返回条数（后续页按该值请求，偏移一致）
+                    if len(content) > size:
+                        size, data = len(content), new
+                    self._settle(size, f"服务端单页上限 {len(content)}")
+                    break
+                size, data = candidate, new
+                if total <= candidate and self._next_step(size) is not None:
+                    self._save(size)  # 一页已取完，更大的值本次无法验证，下次需要多页时继续试探
+                    break
+        finally:
+            self._probing = False
+        return size, data
+
+    def fallback(self, size: int, error: Exception) -> int | None:
+        """沿用的页大小请求出错：可退回默认值时清除缓存并返回默认值，否则返回 None（调用方按原逻辑报错）"""
+        if size <= self.default:
+            return None
+        if isinstance(error, requests.HTTPError):
+            status = error.response.status_code if error.response is not None else 0
+            if not 400 <= status < 500 or status in (401, 429):
+                return None
+        elif not isinstance(error, requests.Timeout):
+            return None
+        print(f"[PageSize] {self.endpoint}: size={size} 请求失败（{error}），退回默认 {self.default}")
+        with self._lock:
+            self.size = self.default
+            self.settled = False
+        _forget(self.endpoint)
+        return self.default
+
+    def _settle(self, size: int, reason: str) -> None:
+        with self._lock:
+            self.settled = True
+        print(f"[PageSize] {self.endpoint}: 页大小确定为 {size}（{reason}）")
+        self._save(size)
+
+    def _save(self, size: int) -> None:
+        with self._lock:
+            self.size = size
+            self.probed_at = datetime.now().isoformat(timespec="seconds")
+            entry = {"size": size, "settled": self.settled, "probed_at": self.probed_at}
+        _store(self.endpoint, entry)
+
+    def summary(self) -> dict:
+        return {"endpoint": self.endpoint, "size": self.size, "default": self.default,
+                "settled": self.settled, "pages": self.pages, "probes": self.probes}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.pages = 0
+            self.probes = 0
+
+
+_sizers: dict[str, PageSizer] = {}
+_registry_lock = threading.Lock()
+_cache_lock = threading.Lock()
+
+
+def _load_cache() -> dict:
+    if not PAGE_SIZE_CACHE_PATH.exists():
+        return {}
+    try:
+        with open(PAGE_SIZE_CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] 页大小缓存读取失败，忽略: {e}")
+        return {}
+
+
+def _write_cache(cache: dict) -> None:
+    PAGE_SIZE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = PAGE_SIZE_CACHE_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, PAGE_SIZE_CACHE_PATH)
+
+
+def _store(endpoint: str, entry: dict) -> None:
+    with _cache_lock:
+        cache = _load_cache()
+        cache[endpoint] = entry
+        _write_cache(cache)
+
+
+def _forget(endpoint: str) -> None:
+    with _cache_lock:
+        cache = _load_cache()
+        if cache.pop(endpoint, None) is not None:
+            _write_cache(cache)
+
+
+def get_sizer(endpoint: str, default: int) -> PageSizer:
+    """获取分页接口的共享页大小（首次调用时从缓存文件载入）"""
+    with _registry_lock:
+        sizer = _sizers.get(endpoint)
+        if sizer is None:
+            cached = _load_cache().get(endpoint) if PAGE_SIZE_CONFIG["adaptive"] else None
+            sizer = PageSizer(endpoint, default, cached)
+            _sizers[endpoint] = sizer
+        return sizer
+
+
+def fetch_first_page(sizer: PageSizer, fetch, extract) -> tuple[int, dict]:
+    """
+    分页列表取第 0 页：按 sizer 当前值请求（出错时按 fallback() 退回默认值重试），需要多页时顺带试探更大的页
+    返回 (本次列表后续页使用的 size, 第 0 页响应)；参数含义同 PageSizer.probe
+    """
+    size = sizer.size
+    try:
+        data = fetch(size)
+    except requests.RequestException as e:
+        fallback = sizer.fallback(size, e)
+        if fallback is None:
+            raise
+        size = fallback
+        data = fetch(size)
+    content, total = extract(data)
+    if sizer.should_probe(size, len(content), total):
+        size, data = sizer.probe(fetch, size, data, extract)
+    return size, data
+
+
+def log_page_stats(upstream: str) -> None:
+    """把上游各分页接口本次运行的页大小与请求页数写入运行日志，随后清零统计"""
+    with _registry_lock:
+        sizers = [s for name, s in sorted(_sizers.items()) if name.split(".", 1)[0] == upstream]
+    for sizer in sizers:
+        s = sizer.summary()
+        sizer.reset_stats()
+        if not s["pages"]:
+            continue
+        state = "已确定" if s["settled"] else "试探中" if s["size"] > s["default"] else "默认"
+        if s["size"] != s["default"]:
+            state += f"，默认 {s['default']}"
+        print(f"[Pages] {s['endpoint']}: 页大小 {s['size']}（{state}）"
+              f" | 请求 {s['pages']} 页 | 其中试探 {s['probes']} 次")
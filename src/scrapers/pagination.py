@@ -0,0 +1,27 @@
+"""
+分页并发预取 - 第 0 页拿到 totalElements 后，其余页按批并发请求、按页序产出
+供 shop_order_scraper.fetch_all_orders 与 nwms_scraper.fetch_all_issue_heads 共用
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
+
+
+def page_count(total: int, page_size: int) -> int:
+    return -(-total // page_size) if page_size > 0 else 0
+
+
+def iter_pages(fetch: Callable[[int], dict], first: int, last: int,
+               workers: int = 1) -> Iterator[tuple[int, dict]]:
+    """
+    并发拉取 [first, last) 页，按页序逐页产出 (page, 响应)
+    每批 workers 页同时在途（请求速率由上游令牌桶控制）；调用方 break 后不再提交后续批次
+    某页请求异常时，在产出该页的位置原样抛出（之前的页已正常产出）
+    """
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch_start in range(first, last, workers):
+            pages = range(batch_start, min(batch_start + workers, last))
+            futures = [pool.submit(fetch, p) for p in pages]
+            for p, fut in zip(pages, futures):
+                yield p, fut.result()
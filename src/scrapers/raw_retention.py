@@ -0,0 +1,176 @@
+"""
+data/raw 时间戳快照的分层保留与归档
+  - 近 keep_all_days 天：全部保留
+  - 之后 keep_daily_weeks 周内：每个来源每天只保留当天最后一份
+  - 更早：同样每天一份，打包进 data/raw/archive/{来源}_{YYYYMM}.zip 后从 data/raw 删除
+  - 每个来源（含扩展名）最新的一份始终保留；*_latest.*、分析报告、摘要清单不受影响
+  - 写入中的临时文件（*.part / *.tmp）不算快照
+时间戳文件命名：{来源}_{YYYYMMDD_HHMM}.{扩展名}，如 shop_orders_20260301_1000.jsonl.gz、线边仓库存报表_20260301_1000.csv
+
+运行：
+  python3 -m src.scrapers.raw_retention              # 执行保留策略
+  python3 -m src.scrapers.raw_retention --dry-run    # 只打印计划
+  python3 -m src.scrapers.raw_retention --usage      # 只看各来源磁盘占用
+"""
+
+import os
+import re
+import zipfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from src.scrapers.raw_store import RAW_DIR
+
+ARCHIVE_DIR = RAW_DIR / "archive"
+
+RETENTION_CONFIG = {
+    "keep_all_days": int(os.environ.get("RAW_KEEP_ALL_DAYS", "7")),
+    "keep_daily_weeks": int(os.environ.get("RAW_KEEP_DAILY_WEEKS", "8")),
+}
+
+_TS_FILE = re.compile(r"^(?P<source>.+)_(?P<ts>\d{8}_\d{4})\.(?P<ext>[A-Za-z0-9.]+)$")
+_ARCHIVE_FILE = re.compile(r"^(?P<source>.+)_(?P<month>\d{6})\.zip$")
+_IN_PROGRESS = (".part", ".tmp")  # 原子写入的临时文件后缀（raw_store / inventory_scraper）
+
+
+def scan_snapshots(raw_dir: Path = None) -> list[dict]:
+    """列出 raw_dir 下全部时间戳快照：[{path, source, ext, ts(datetime), size}]"""
+    raw_dir = raw_dir or RAW_DIR
+    if not raw_dir.exists():
+        return []
+    snaps = []
+    for entry in os.scandir(raw_dir):
+        if not entry.is_file() or entry.name.endswith(_IN_PROGRESS):
+            continue
+        m = _TS_FILE.match(entry.name)
+        if not m:
+            continue
+        try:
+            ts = datetime.strptime(m.group("ts"), "%Y%m%d_%H%M")
+        except ValueError:
+            continue
+        snaps.append({
+            "path": Path(entry.path),
+            "source": m.group("source"),
+            "ext": m.group("ext"),
+            "ts": ts,
+            "size": entry.stat().st_size,
+        })
+    return snaps
+
+
+def plan_retention(snaps: list[dict], now: datetime = None) -> dict[str, list[dict]]:
+    """
+    按分层策略给每个快照定去向：{"keep": [...], "delete": [...], "archive": [...]}
+    delete = 超出全量保留区且非当天最后一份；archive = 超出每日保留区的当天最后一份（打包后删除）
+    """
+    now = now or datetime.now()
+    all_cutoff = now - timedelta(days=RETENTION_CONFIG["keep_all_days"])
+    daily_cutoff = all_cutoff - timedelta(weeks=RETENTION_CONFIG["keep_daily_weeks"])
+
+    plan = {"keep": [], "delete": [], "archive": []}
+    groups = defaultdict(list)
+    for s in snaps:
+        groups[(s["source"], s["ext"])].append(s)
+
+    for items in groups.values():
+        items.sort(key=lambda s: s["ts"])
+        newest = items[-1]
+        last_of_day = {}
+        for s in items:
+            last_of_day[s["ts"].date()] = s  # 升序遍历，最后写入的即当天最后一份
+        for s in items:
+            if s is newest or s["ts"] >= all_cutoff:
+                plan["keep"].append(s)
+            elif last_of_day[s["ts"].date()] is not s:
+                plan["delete"].append(s)
+            elif s["ts"] >= daily_cutoff:
+                plan["keep"].append(s)
+            else:
+                plan["archive"].append(s)
+    return plan
+
+
+def _archive_snapshot(s: dict) -> Path:
+    """把单个快照追加进 {来源}_{YYYYMM}.zip（已压缩的 .gz 直接存储，其余 deflate）"""
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    zip_path = ARCHIVE_DIR / f"{s['source']}_{s['ts'].strftime('%Y%m')}.zip"
+    method = zipfile.ZIP_STORED if s["path"].name.endswith(".gz") else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(zip_path, "a", compression=method) as zf:
+        if s["path"].name not in zf.namelist():
+            zf.write(s["path"], arcname=s["path"].name)
+    return zip_path
+
+
+def apply_retention(dry_run: bool = False, now: datetime = None) -> dict:
+    """执行保留策略，返回统计 {kept, deleted, archived, freed_bytes}"""
+    plan = plan_retention(scan_snapshots(), now=now)
+    freed = 0
+    for s in plan["delete"]:
+        if not dry_run:
+            s["path"].unlink(missing_ok=True)
+        freed += s["size"]
+    for s in plan["archive"]:
+        if not dry_run:
+            _archive_snapshot(s)
+            s["path"].unlink(missing_ok=True)
+        freed += s["size"]
+
+    stats = {
+        "kept": len(plan["keep"]),
+        "deleted": len(plan["delete"]),
+        "archived": len(plan["archive"]),
+        "freed_bytes": freed,
+    }
+    prefix = "[Retention][dry-run]" if dry_run else "[Retention]"
+    print(f"{prefix} 保留 {stats['kept']} 个，删除 {stats['deleted']} 个，归档 {stats['archived']} 个，"
+          f"释放 {freed / 1024 / 1024:.1f} MB")
+    return stats
+
+
+def disk_usage() -> dict[str, dict]:
+    """
+    各来源磁盘占用：{来源: {"snapshots", "snapshot_bytes", "archives", "archive_bytes"}}
+    只统计时间戳快照与归档包（latest 多为硬链接，不重复计入）
+    """
+    usage = defaultdict(lambda: {"snapshots": 0, "snapshot_bytes": 0, "archives": 0, "archive_bytes": 0})
+    for s in scan_snapshots():
+        u = usage[s["source"]]
+        u["snapshots"] += 1
+        u["snapshot_bytes"] += s["size"]
+    if ARCHIVE_DIR.exists():
+        for entry in os.scandir(ARCHIVE_DIR):
+            m = _ARCHIVE_FILE.match(entry.name)
+            if m and entry.is_file():
+                u = usage[m.group("source")]
+                u["archives"] += 1
+                u["archive_bytes"] += entry.stat().st_size
+    return dict(sorted(usage.items()))
+
+
+def print_disk_usage() -> None:
+    print("[Retention] data/raw 各来源占用：")
+    for source, u in disk_usage().items():
+        print(f"  {source}: 快照 {u['snapshots']} 个 {u['snapshot_bytes'] / 1024 / 1024:.1f} MB"
+              f" | 归档 {u['archives']} 个 {u['archive_bytes'] / 1024 / 1024:.1f} MB")
+
+
+def run(dry_run: bool = False) -> dict:
+    stats = apply_retention(dry_run=dry_run)
+    print_disk_usage()
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="data/raw 时间戳快照分层保留与归档")
+    parser.add_argument("--dry-run", action="store_true", help="只打印计划，不删除/归档")
+    parser.add_argument("--usage", action="store_true", help="只输出各来源磁盘占用")
+    args = parser.parse_args()
+
+    if args.usage:
+        print_disk_usage()
+    else:
+        run(dry_run=args.dry_run)
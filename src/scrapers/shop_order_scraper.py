@@ -6,19 +6,27 @@
 import os
 import requests
 import json
-import csv
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 
-from src.auth.token_manager import refresh_imes_token
+from src.auth.token_manager import IMES_TOKENS
+from src.scrapers.circuit_breaker import breaker_tripped
+from src.scrapers.http_client import http_get_with_token
+from src.scrapers.page_size import fetch_first_page, get_sizer, log_page_stats
+from src.scrapers.pagination import iter_pages, page_count
+from src.scrapers.raw_store import persist_in_background, save_snapshot
+from src.scrapers.source_digest import digest_records, record_digest
+from src.scrapers.throttle import log_limiter_stats
 
 # ─── 配置区（优先读环境变量，回退到硬编码值）────────────────────────────────
 CONFIG = {
-    "base_url": "http://10.80.35.11:8080/imes-service/v1/0/shopOrder",
-    "token": os.environ.get("IMES_TOKEN", ""),
+    "base_url": os.environ.get("IMES_SERVICE_URL", "http://10.80.35.11:8080/imes-service") + "/v1/0/shopOrder",
     "site": "2010",
-    "page_size": 100,
+    "page_size": 100,                                                    # 默认页大小（实际值见 page_size.py 自适应）
+    "lookback_days": int(os.environ.get("ORDER_LOOKBACK_DAYS", "7")),    # 增量模式：每次重拉最近 N 天计划开工的工单
+    "sweep_hours": float(os.environ.get("ORDER_SWEEP_HOURS", "24")),     # 增量模式：未完工工单全量扫描间隔
+    "page_workers": int(os.environ.get("IMES_PAGE_WORKERS", "4")),       # 翻页并发预取数（1=逐页）
 }
 
 def _make_headers(token: str) -> dict:
@@ -37,18 +45,24 @@ def _make_headers(token: str) -> dict:
         ),
     }
 
-HEADERS = _make_headers(CONFIG["token"])
+
+def imes_get(endpoint: str, url: str, **kwargs):
+    """IMES 请求统一入口：Token 由 IMES_TOKENS 提供（临近过期主动刷新，401 单飞刷新后重试）"""
+    return http_get_with_token(endpoint, url, IMES_TOKENS, _make_headers, **kwargs)
 
 OUTPUT_DIR = Path(__file__).parent.parent.parent / "data" / "raw"
 
 
-def fetch_page(page: int, start_date: str, classes: str = "A") -> dict:
-    """拉取单页工单数据，401 时自动刷新 Token 并重试"""
-    global HEADERS
+def _sizer():
+    return get_sizer("imes.shop_order", CONFIG["page_size"])
+
+
+def fetch_page(page: int, start_date: str, classes: str = "A", size: int = None) -> dict:
+    """拉取单页工单数据，401 时自动刷新 Token 并重试；size 默认取当前自适应页大小"""
     params = {
         "signTime": int(time.time() * 1000),
         "page": page,
-        "size": CONFIG["page_size"],
+        "size": size or _sizer().size,
         "classes": classes,
         "plannedCheck": "false",
         "plannedStartDate": start_date,
@@ -56,32 +70,38 @@ def fetch_page(page: int, start_date: str, classes: str = "A") -> dict:
         "site": CONFIG["site"],
         "language": "zh_CN",
     }
-    resp = requests.get(CONFIG["base_url"], headers=HEADERS, params=params, timeout=30)
-    if resp.status_code == 401:
-        print("[TokenManager] IMES Token 已过期，自动刷新...")
-        new_token = refresh_imes_token()
-        HEADERS = _make_headers(new_token)
-        resp = requests.get(CONFIG["base_url"], headers=HEADERS, params=params, timeout=30)
+    resp = imes_get("imes.shop_order", CONFIG["base_url"], params=params)
     resp.raise_for_status()
     return resp.json()
 
 
-def fetch_all_orders(start_date: str, classes: str = "A") -> list[dict]:
+def fetch_all_orders(start_date: str, classes: str = "A", stats: dict = None) -> list[dict]:
     """
     分页拉取全部工单
     start_date 格式: "2026-01-01 00:00:00"（不传结束日期，避免漏掉计划完工在未来的在制工单）
+    stats: 可选，传入 dict 时累加实际请求页数到 stats["pages"]，并在 stats["complete"] 记录是否完整拉取
+           （累计条数达到第 0 页的 totalElements 才算完整；中途请求失败、空页或不足一页提前结束时
+            返回已拉到的部分，complete=False）
     """
     all_orders = []
-    page = 0
+    workers = CONFIG["page_workers"]
+    sizer = _sizer()
+    size = sizer.size
 
     print(f"[INFO] 开始拉取工单 | 计划开始日期 ≥ {start_date[:10]} | 类型: {classes}")
 
-    while True:
-        try:
-            data = fetch_page(page, start_date, classes)
-        except requests.RequestException as e:
-            print(f"[ERROR] 第 {page} 页请求失败: {e}")
-            break
+    def _fetch(page: int, page_size: int = None) -> dict:
+        sizer.count()
+        return fetch_page(page, start_date, classes, page_size or size)
+
+    def _rows(data: dict) -> tuple[list, int]:
+        rows = data.get("rows", {})
+        return rows.get("content", []), rows.get("totalElements", 0)
+
+    def _take(page: int, data: dict) -> bool:
+        """处理单页响应，返回是否继续翻页"""
+        if stats is not None:
+            stats["pages"] = stats.get("pages", 0) + 1
 
         # ── 响应结构: {"success":true, "rows": {"content":[...], "totalElements":N}} ──
         rows = data.get("rows", {})
@@ -89,63 +109,190 @@ def fetch_all_orders(start_date: str, classes: str = "A") -> list[dict]:
 
         if not content:
             print(f"[WARN] 第 {page} 页无数据，停止翻页")
-            break
+            return False
 
         all_orders.extend(content)
         total = rows.get("totalElements", 0)
         print(f"  → 第 {page + 1} 页: 获取 {len(content)} 条，累计 {len(all_orders)} / {total} 条")
 
         if len(all_orders) >= total:
-            break
-        if len(content) < CONFIG["page_size"]:
-            break  # 不足一页，说明已是最后一页
+            return False
+        if len(content) < size:
+            return False  # 不足一页，说明已是最后一页
+        return True
 
-        page += 1
-        time.sleep(0.3)  # 礼貌性延迟，避免压垮内网服务
+    # 第 0 页拿到 totalElements 后，其余页按批并发预取（速率由 IMES 令牌桶控制，避免压垮内网服务）
+    # iter_pages 按页序产出，出错页 = 最后一个成功页 + 1；第 0 页需要多页时顺带试探更大的页大小
+    last = -1
+    total = None
+    try:
+        size, data = fetch_first_page(sizer, lambda s: _fetch(0, s), _rows)
+        last = 0
+        total = _rows(data)[1]
+        if _take(0, data):
+            n_pages = page_count(_rows(data)[1], size)
+            for last, data in iter_pages(_fetch, 1, n_pages, workers=workers):
+                if not _take(last, data):
+                    break
+    except requests.RequestException as e:
+        print(f"[ERROR] 第 {last + 1} 页请求失败: {e}")
 
-    print(f"[INFO] 拉取完成，共 {len(all_orders)} 条工单")
+    # 空页 / 不足一页提前结束（如服务端截断了缓存的页大小）同样不完整，调用方不得据此删除工单或推进水位
+    complete = total is not None and len(all_orders) >= total
+    if total is not None and not complete:
+        print(f"[WARN] 翻页提前结束：获取 {len(all_orders)} / {total} 条，按不完整处理")
+
+    if stats is not None:
+        stats["complete"] = complete
+    print(f"[INFO] 拉取完成，共 {len(all_orders)} 条工单" + ("" if complete else "（不完整）"))
     return all_orders
 
 
-def save_json(orders: list[dict], filename: str) -> Path:
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    path = OUTPUT_DIR / filename
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(orders, f, ensure_ascii=False, indent=2)
-    print(f"[SAVE] JSON → {path}")
-    return path
+# ═══════════════════════════════════════════════════════════════════════════════
+# 增量模式：本地工单库（按 shopOrder）+ 计划开工日期水位
+#   - 每次只重拉最近 lookback_days 天计划开工的工单（新下达 / 近期变动最频繁）
+#   - 每 sweep_hours 小时做一次未完工扫描：从本地库中最早的未完工工单计划日期起重拉
+#   - 已完工且早于扫描起点的工单不会再变化，直接沿用本地库
+#   - 只有完整拉取才推进扫描水位，并删除本地库中该日期范围内上游已不再返回的工单；
+#     中途失败时合并已拉到的部分，下次运行仍做扫描
+# ═══════════════════════════════════════════════════════════════════════════════
 
+ORDER_STORE_PATH = OUTPUT_DIR.parent / "cache" / "shop_order_store.json"
+ORDER_DATE_FIELD = "plannedStartDate"
+# 与 build_report.COMPLETED_STATUSES 保持一致
+COMPLETED_STATUSES = {"Completado", "完成", "Completed", "已完成"}
 
-def save_csv(orders: list[dict], filename: str) -> Path:
-    if not orders:
-        print("[WARN] 无数据可保存")
-        return None
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    path = OUTPUT_DIR / filename
-    keys = list(orders[0].keys())
-    with open(path, "w", newline="", encoding="utf-8-sig") as f:
-        writer = csv.DictWriter(f, fieldnames=keys, extrasaction="ignore")
-        writer.writeheader()
-        writer.writerows(orders)
-    print(f"[SAVE] CSV  → {path}")
-    return path
-
-
-def run(start_date: str = None):
-    """主入口"""
+
+def load_order_store() -> dict:
+    if not ORDER_STORE_PATH.exists():
+        return {"orders": {}, "last_sweep": ""}
+    try:
+        with open(ORDER_STORE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] 工单库读取失败，按全量处理: {e}")
+        return {"orders": {}, "last_sweep": ""}
+
+
+def save_order_store(store: dict) -> None:
+    ORDER_STORE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = ORDER_STORE_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(store, f, ensure_ascii=False)
+    os.replace(tmp, ORDER_STORE_PATH)
+    print(f"[SAVE] 工单库 → {ORDER_STORE_PATH}（{len(store['orders'])} 个工单）")
+
+
+def _sweep_start(orders: dict, floor: str) -> str:
+    """未完工工单中最早的计划开工时间（不早于 floor）；取不到日期时退回 floor"""
+    dates = [
+        str(o.get(ORDER_DATE_FIELD) or "")[:19]
+        for o in orders.values()
+        if o.get("statusDesc") not in COMPLETED_STATUSES
+    ]
+    if not dates or not all(dates):
+        return floor
+    return max(min(dates), floor)
+
+
+def _prune_missing(orders: dict, fetched: list[dict], since: str) -> int:
+    """完整拉取 since 起的工单后，删除本地库中该范围内上游已不再返回的工单（删除 / 改期），返回删除数"""
+    seen = {o.get("shopOrder") for o in fetched}
+    stale = [so for so, o in orders.items()
+             if so not in seen and str(o.get(ORDER_DATE_FIELD) or "")[:19] >= since[:19]]
+    for so in stale:
+        del orders[so]
+    return len(stale)
+
+
+def fetch_orders_incremental(start_date: str, classes: str = "A", stats: dict = None) -> list[dict]:
+    """
+    增量拉取工单并合并到本地工单库，返回窗口内（计划开工 ≥ start_date）的全部工单
+    首次运行（本地库为空或尚无完整扫描）等同于全量拉取
+    stats: 同 fetch_all_orders；complete=False 时本地库只合并了部分结果，扫描水位未推进
+    """
+    store = load_order_store()
+    orders = store["orders"]
+    now = datetime.now()
+    stats = {} if stats is None else stats
+    stats["pages"] = 0
+    sweep = True
+
+    try:
+        last_sweep = datetime.fromisoformat(store.get("last_sweep", ""))
+    except ValueError:
+        last_sweep = None
+    if not orders or last_sweep is None:
+        # 尚无完整扫描（首次运行或上次全量中途失败）：本地库可能缺工单，从 start_date 全量重拉
+        print("[INFO] 工单库为空或尚无完整扫描，执行全量拉取")
+        since = start_date
+    elif now - last_sweep > timedelta(hours=CONFIG["sweep_hours"]):
+        since = _sweep_start(orders, start_date)
+        print(f"[INFO] 未完工工单扫描：从 {since[:10]} 起重拉")
+    else:
+        sweep = False
+        since = max((now - timedelta(days=CONFIG["lookback_days"])).strftime("%Y-%m-%d 00:00:00"), start_date)
+        print(f"[INFO] 增量拉取：计划开工 ≥ {since[:10]}")
+    fetched = fetch_all_orders(since, classes, stats=stats)
+
+    for o in fetched:
+        if o.get("shopOrder"):
+            orders[o["shopOrder"]] = o
+    if stats["complete"]:
+        pruned = _prune_missing(orders, fetched, since)
+        if pruned:
+            print(f"[INFO] 上游已不再返回 {pruned} 个工单（计划开工 ≥ {since[:10]}），从工单库删除")
+        if sweep:
+            store["last_sweep"] = now.isoformat(timespec="seconds")
+    else:
+        print("[WARN] 工单拉取不完整：已合并拉到的部分，扫描水位不推进，下次运行重新扫描")
+    save_order_store(store)
+
+    window = [o for o in orders.values() if str(o.get(ORDER_DATE_FIELD) or start_date)[:19] >= start_date[:19]]
+    full_pages = page_count(len(window), _sizer().size)
+    print(f"[INFO] 工单翻页：实际请求 {stats['pages']} 页，全量约需 {full_pages} 页，"
+          f"节省 {max(full_pages - stats['pages'], 0)} 页")
+    return window
+
+
+def run(start_date: str = None, incremental: bool = False, export_csv: bool = None,
+        background: bool = False) -> list[dict] | None:
+    """
+    主入口，返回本次工单列表（无数据时 None）
+    incremental=True：走本地工单库增量拉取（见 fetch_orders_incremental），输出文件与全量一致
+    export_csv=True：额外导出 shop_orders_latest.csv（None = 读 RAW_EXPORT_CSV）
+    background=True：快照在后台落盘（调度器流水线模式，返回值直接交给分析）
+    """
     today = datetime.now().strftime("%Y-%m-%d")
     start_date = start_date or f"{today} 00:00:00"
 
     ts = datetime.now().strftime("%Y%m%d_%H%M")
-    orders = fetch_all_orders(start_date, classes="A")
+    stats = {}
+    if incremental:
+        orders = fetch_orders_incremental(start_date, classes="A", stats=stats)
+    else:
+        orders = fetch_all_orders(start_date, classes="A", stats=stats)
 
+    # 增量模式中途失败时，本地库合并结果仍比上一份 latest 新（缺的工单沿用库中旧值），照常输出；
+    # 全量模式只拿到前几页，输出会丢工单
+    if breaker_tripped("imes") or (not incremental and not stats["complete"]):
+        print("[WARN] IMES 已熔断或工单拉取中途失败，本次工单数据不完整，保留上一份 latest 快照")
+        log_page_stats("imes")
+        log_limiter_stats("imes")
+        return None
     if orders:
-        save_json(orders, f"shop_orders_{ts}.json")
-        save_csv(orders, f"shop_orders_{ts}.csv")
-        save_json(orders, "shop_orders_latest.json")
-        save_csv(orders, "shop_orders_latest.csv")
+        def _persist():
+            latest = save_snapshot(orders, "shop_orders", ts, export=export_csv)
+            record_digest("shop_orders", digest_records(orders), latest.name)
+        if background:
+            persist_in_background(_persist)
+        else:
+            _persist()
     else:
         print("[WARN] 未获取到任何工单数据，请检查 token 是否过期或日期范围是否正确")
+    log_page_stats("imes")
+    log_limiter_stats("imes")
+    return orders or None
 
 
 if __name__ == "__main__":
@@ -153,6 +300,9 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="IMES 工单数据爬虫")
     parser.add_argument("--start", default=None, help="计划开始日期，格式: 2026-01-01 00:00:00")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量模式：只拉近期工单 + 定期扫描未完工工单，合并本地工单库后输出")
+    parser.add_argument("--csv", action="store_true", help="额外导出 shop_orders_latest.csv")
     args = parser.parse_args()
 
-    run(args.start)
+    run(args.start, incremental=args.incremental, export_csv=args.csv or None)
@@ -0,0 +1,122 @@
+"""
+数据源内容摘要 - 各爬虫输出 latest 文件时记录规范化内容的 SHA-256
+同步阶段（db/sync.py）据此判断分析输入是否与上一批次完全一致，一致则跳过重算
+摘要清单：data/raw/source_digests.json
+  { 来源: {"digest", "file", "size", "mtime_ns", "updated_at"} }
+文件被手工替换（大小或修改时间与清单不符）时，退化为直接对文件字节求摘要
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+RAW_DIR = Path(__file__).parent.parent.parent / "data" / "raw"
+DIGEST_PATH = RAW_DIR / "source_digests.json"
+
+# build_report 读取的分析输入：来源 → latest 文件名
+ANALYSIS_SOURCES = {
+    "inventory": "inventory_latest.csv",
+    "shop_orders": "shop_orders_latest.jsonl.gz",
+    "bom": "bom_details_latest.jsonl.gz",
+    "nwms_details": "nwms_issue_details_latest.jsonl.gz",
+}
+
+# build_report.run(inputs) 的内存输入键 → 来源（库存为原始字节摘要，只能从文件取）
+INPUT_SOURCES = {
+    "shop_orders": "shop_orders",
+    "bom_details": "bom",
+    "nwms_issue_details": "nwms_details",
+}
+
+_lock = threading.Lock()
+
+
+def digest_records(records) -> str:
+    """JSON 记录的规范化摘要：键排序、紧凑分隔符，与缩进/键顺序无关"""
+    payload = json.dumps(records, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def digest_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_digests() -> dict:
+    if not DIGEST_PATH.exists():
+        return {}
+    try:
+        with open(DIGEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"[WARN] 摘要清单读取失败，忽略：{DIGEST_PATH}")
+        return {}
+
+
+def record_digest(source: str, digest: str, filename: str) -> None:
+    """登记某来源 latest 文件的内容摘要（需在文件写完后调用，同时记下文件大小与修改时间）"""
+    path = RAW_DIR / filename
+    st = path.stat()
+    with _lock:
+        digests = load_digests()
+        digests[source] = {
+            "digest": digest,
+            "file": filename,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        DIGEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = DIGEST_PATH.with_name(DIGEST_PATH.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(digests, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, DIGEST_PATH)
+    print(f"[DIGEST] {source}: {digest[:12]}")
+
+
+def current_source_digests(skip=()) -> dict[str, str]:
+    """
+    返回各分析输入的当前摘要；文件不存在记为空串
+    skip 中的来源不读文件（调用方已从内存数据算出摘要，文件可能仍在后台写入）
+    """
+    digests = load_digests()
+    result = {}
+    for source, filename in ANALYSIS_SOURCES.items():
+        if source in skip:
+            continue
+        path = RAW_DIR / filename
+        if not path.exists():
+            result[source] = ""
+            continue
+        st = path.stat()
+        entry = digests.get(source) or {}
+        if entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            result[source] = entry["digest"]
+        else:
+            result[source] = digest_file(path)
+    return result
+
+
+def input_source_digests(inputs: dict) -> dict[str, str]:
+    """
+    分析输入摘要：inputs 中提供了内存数据的来源按记录求摘要（与爬虫登记的一致），其余读文件
+    inputs 即 build_report.run 的参数，None 时全部读文件
+    """
+    in_memory = {INPUT_SOURCES[k]: v for k, v in (inputs or {}).items()
+                 if k in INPUT_SOURCES and v is not None}
+    result = current_source_digests(skip=in_memory)
+    for source, records in in_memory.items():
+        result[source] = digest_records(records)
+    return result
+
+
+def combined_digest(source_digests: dict[str, str]) -> str:
+    """把各来源摘要合成一个批次输入摘要（写入 KPIHistory.input_digest）"""
+    payload = "|".join(f"{k}={source_digests.get(k, '')}" for k in sorted(ANALYSIS_SOURCES))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -0,0 +1,137 @@
+"""
+爬虫限速工具 - 每个上游系统一个自适应令牌桶
+  - 令牌桶：按当前速率匀速补充令牌，允许少量突发（burst），线程安全
+  - 自适应（AIMD）：响应快于目标延迟时线性提速；变慢时小幅降速；429/5xx/请求异常时速率减半
+  - 由 http_client.http_get 统一调用，替代各爬虫中的固定 time.sleep
+"""
+
+import os
+import threading
+import time
+
+# ─── 各上游速率区间（请求/秒，优先读环境变量）─────────────────────────────────
+LIMITER_CONFIG = {
+    "imes": {
+        "initial": 5.0,
+        "min": 1.0,
+        "max": float(os.environ.get("IMES_MAX_RPS", "20")),
+        "target_latency": 0.5,
+    },
+    "nwms": {
+        "initial": 5.0,
+        "min": 1.0,
+        "max": float(os.environ.get("NWMS_MAX_RPS", "30")),
+        "target_latency": 0.5,
+    },
+    "ssrs": {
+        "initial": 1.0,
+        "min": 0.2,
+        "max": 2.0,
+        "target_latency": 30.0,
+    },
+}
+DEFAULT_LIMITER = {"initial": 5.0, "min": 1.0, "max": 10.0, "target_latency": 0.5}
+
+
+class AdaptiveTokenBucket:
+    """自适应令牌桶：acquire() 取令牌（不足则等待），observe() 根据响应调整速率"""
+
+    def __init__(self, name: str, initial: float, min_rate: float, max_rate: float,
+                 target_latency: float, burst: float = 2.0):
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.rate = min(max(initial, min_rate), self.max_rate)
+        self.target_latency = target_latency
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        # 统计
+        self.requests = 0
+        self.backoffs = 0
+        self.wait_seconds = 0.0
+        self._first_at = None
+        self._last_at = None
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        """阻塞直到拿到一个令牌（先预占再等待，多线程下不会超发）"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.requests += 1
+            self.wait_seconds += wait
+            if self._first_at is None:
+                self._first_at = now
+        if wait > 0:
+            time.sleep(wait)
+
+    def observe(self, latency: float, status: int | None) -> None:
+        """
+        记录一次请求结果并调整速率
+        status=None 表示请求异常（超时/连接失败）
+        """
+        with self._lock:
+            self._last_at = time.monotonic()
+            if status is None or status == 429 or status >= 500:
+                self.rate = max(self.min_rate, self.rate * 0.5)
+                self.backoffs += 1
+            elif latency > 2 * self.target_latency:
+                self.rate = max(self.min_rate, self.rate * 0.8)
+            elif latency < self.target_latency:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def reset_stats(self) -> None:
+        """清零统计（保留已学习到的速率），每次运行结束记录日志后调用"""
+        with self._lock:
+            self.requests = 0
+            self.backoffs = 0
+            self.wait_seconds = 0.0
+            self._first_at = None
+            self._last_at = None
+
+    def summary(self) -> dict:
+        with self._lock:
+            span = (self._last_at - self._first_at) if self._first_at and self._last_at else 0.0
+            return {
+                "name": self.name,
+                "rate": round(self.rate, 2),
+                "requests": self.requests,
+                "effective_rps": round(self.requests / span, 2) if span > 0 else 0.0,
+                "backoffs": self.backoffs,
+                "wait_seconds": round(self.wait_seconds, 1),
+            }
+
+
+_limiters: dict[str, AdaptiveTokenBucket] = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(upstream: str) -> AdaptiveTokenBucket:
+    """获取上游系统的共享令牌桶（首次调用时按 LIMITER_CONFIG 创建）"""
+    with _registry_lock:
+        limiter = _limiters.get(upstream)
+        if limiter is None:
+            cfg = LIMITER_CONFIG.get(upstream, DEFAULT_LIMITER)
+            limiter = AdaptiveTokenBucket(
+                upstream, cfg["initial"], cfg["min"], cfg["max"], cfg["target_latency"],
+            )
+            _limiters[upstream] = limiter
+        return limiter
+
+
+def log_limiter_stats(upstream: str) -> None:
+    """把上游本次运行的实际速率写入运行日志，随后清零统计"""
+    if upstream not in _limiters:
+        return
+    limiter = _limiters[upstream]
+    s = limiter.summary()
+    limiter.reset_stats()
+    print(f"[RateLimit] {s['name']}: 当前速率 {s['rate']}/s | 请求 {s['requests']} 次"
+          f" | 实际 {s['effective_rps']} req/s | 降速 {s['backoffs']} 次 | 限速等待 {s['wait_seconds']}s")
@@ -0,0 +1,165 @@
+"""
+分析阶段线性回归压测 - 按多个规模合成输入跑 build_report，检查各阶段耗时随库存行数近似线性增长
+  - 输入由 tools/upstream_stub.py 的 StubDataset.synthetic 合成（工单 / BOM / 发料行明细 / 库存互相关联），
+    按调度器流水线模式以内存数据交给 build_report，不读写 data/raw
+  - --hot-share 比例的库存行集中到 --hot-groups 个 (工单, 物料) 组、条码约一半重复，
+    模拟少数组积压上千条码的情况（条码去重的热点）
+  - 分阶段计时：load_inventory（条码聚合）、build_inventory_audit（退料预警 / 库存状态 / 分层计数）、
+    run 全流程（含数据质量统计）；各阶段取 --repeat 次中的最小值
+  - 以最小规模的“每千行耗时”为基准，最大规模超过 --max-ratio 倍即判为非线性，退出码 1
+
+运行：
+  PYTHONPATH=. python3 tools/bench_build_report.py                         # 规模 1 / 10（10× 约 20 万条库存）
+  PYTHONPATH=. python3 tools/bench_build_report.py --scales 1,2,5,10 --repeat 3
+  PYTHONPATH=. python3 tools/bench_build_report.py --hot-share 0.5 --hot-groups 5 --json bench_report.json
+  PYTHONPATH=. python3 tools/bench_build_report.py --engine columnar          # 库存聚合用 NumPy 列式实现（读临时 CSV）
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from upstream_stub import StubDataset
+
+STAGES = ["load_inventory", "inventory_audit", "run"]
+
+
+def build_inputs(scale: float, hot_share: float, hot_groups: int, seed: int = 1) -> dict:
+    """合成一份流水线模式的 build_report 输入（键同调度器交接的 inputs）"""
+    ds = StubDataset.synthetic(scale, seed=seed)
+    rnd = random.Random(seed)
+    inventory = list(csv.DictReader(io.StringIO(ds.inventory_csv.decode("utf-8-sig"))))
+    if hot_share > 0 and hot_groups > 0:
+        hot = [(r["指定工单"], r["物料"]) for r in rnd.sample(inventory, min(hot_groups, len(inventory)))]
+        for i, r in enumerate(inventory):
+            if rnd.random() < hot_share:
+                r["指定工单"], r["物料"] = rnd.choice(hot)
+                r["条码"] = f"HOT{i // 2:08d}"  # 相邻两行共用条码，走去重分支
+
+    heads = {str(h["instructionDocId"]): h for h in ds.heads}
+    details = []
+    for doc_id, lines in ds.lines_by_doc.items():
+        h = heads[doc_id]
+        for ln in lines:
+            details.append({
+                **ln,
+                "_instructionDocId": doc_id,
+                "_demandListNumber": h["demandListNumber"],
+                "_workOrderNum": h["workOrderNum"],
+                "_productionLine": h["productionLine"],
+                "_wareHouse": h["wareHouse"],
+                "_docStatus": h["instructionDocStatus"],
+                "_ppStartTime": h["ppStartTime"],
+            })
+    return {
+        "shop_orders": ds.orders,
+        "bom_details": [r for rows in ds.bom_by_order.values() for r in rows],
+        "inventory": inventory,
+        "nwms_issue_details": details,
+    }
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def bench_scale(scale: float, args) -> dict:
+    from src.analysis import build_report as br
+
+    inputs = build_inputs(scale, args.hot_share, args.hot_groups)
+    best = {stage: float("inf") for stage in STAGES}
+    with tempfile.TemporaryDirectory(prefix="bench_report_") as tmp, \
+            contextlib.redirect_stdout(io.StringIO()):
+        br.BASE = Path(tmp)  # save_csv 写入临时目录
+        br.INVENTORY_ENGINE = args.engine
+        br.ANALYSIS_INCREMENTAL = False  # 重复运行同一份输入，增量分析会全部命中缓存；压测全量计算
+        source = inputs["inventory"]
+        if args.engine == "columnar":  # 列式实现只用于读 CSV：load_inventory 阶段改为读临时目录下的库存 CSV
+            with open(Path(tmp) / "inventory_latest.csv", "w", encoding="utf-8-sig", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(source[0].keys()))
+                writer.writeheader()
+                writer.writerows(source)
+            source = None
+        for _ in range(args.repeat):
+            t, (inventory, raw_rows) = _timed(lambda: br.load_inventory(source))
+            best["load_inventory"] = min(best["load_inventory"], t)
+            orders = br.load_shop_orders(inputs["shop_orders"])
+            bom_index = br.load_bom(inputs["bom_details"])
+            t, _ = _timed(lambda: br.build_inventory_audit(orders, bom_index, inventory))
+            best["inventory_audit"] = min(best["inventory_audit"], t)
+            t, _ = _timed(lambda: br.run(inputs))
+            best["run"] = min(best["run"], t)
+    return {
+        "scale": scale,
+        "inventory_rows": len(inputs["inventory"]),
+        "groups": len(inventory),
+        "max_barcodes_per_group": max((len(g["barcode_list"]) for g in inventory.values()), default=0),
+        "seconds": {k: round(v, 4) for k, v in best.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build_report 分析阶段线性回归压测")
+    parser.add_argument("--scales", default="1,10", help="逗号分隔的合成规模（1 ≈ 2 万条库存）")
+    parser.add_argument("--repeat", type=int, default=1, help="每个规模重复次数，各阶段取最小值")
+    parser.add_argument("--hot-share", type=float, default=0.2, help="集中到热点组的库存行比例")
+    parser.add_argument("--hot-groups", type=int, default=10, help="热点 (工单, 物料) 组数")
+    parser.add_argument("--max-ratio", type=float, default=3.0,
+                        help="最大规模每千行耗时 / 最小规模每千行耗时 的允许上限")
+    parser.add_argument("--engine", choices=["python", "columnar"], default="python",
+                        help="库存聚合实现（同 INVENTORY_ENGINE；columnar 时 load_inventory 阶段读 CSV）")
+    parser.add_argument("--json", help="结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    scales = sorted(float(s) for s in args.scales.split(",") if s.strip())
+    results = []
+    for scale in scales:
+        print(f"[Bench] scale={scale:g} 合成数据并运行...")
+        results.append(bench_scale(scale, args))
+
+    base = results[0]
+    header = f"{'scale':>6} | {'库存行':>8} | {'组数':>7} | {'最大组条码':>8} | " + " | ".join(
+        f"{s + '(s)':>18} {'ms/千行':>8}" for s in STAGES)
+    print("\n" + header)
+    for r in results:
+        cells = " | ".join(f"{r['seconds'][s]:>18.3f} {r['seconds'][s] / r['inventory_rows'] * 1e6:>8.2f}"
+                           for s in STAGES)
+        print(f"{r['scale']:>6g} | {r['inventory_rows']:>8} | {r['groups']:>7} | "
+              f"{r['max_barcodes_per_group']:>8} | {cells}")
+
+    failed = []
+    if len(results) > 1:
+        top = results[-1]
+        print(f"\n[Bench] 每千行耗时比（scale {top['scale']:g} / scale {base['scale']:g}，上限 {args.max_ratio:g}）")
+        for s in STAGES:
+            per_base = base["seconds"][s] / base["inventory_rows"]
+            per_top = top["seconds"][s] / top["inventory_rows"]
+            ratio = per_top / per_base if per_base > 0 else 0.0
+            ok = ratio <= args.max_ratio
+            if not ok:
+                failed.append(s)
+            print(f"  {s:>16}: {ratio:5.2f}  {'OK' if ok else '非线性'}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results, "failed": failed}, f, ensure_ascii=False, indent=2)
+        print(f"[SAVE] {args.json}")
+    if failed:
+        print(f"[FAIL] 以下阶段未保持线性: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
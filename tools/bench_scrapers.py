@@ -0,0 +1,184 @@
+"""
+爬虫离线压测 - 在本地替身（tools/upstream_stub.py）上依次跑各爬虫，报告墙钟时间与请求吞吐
+  - 替身默认在本进程后台线程启动（自动选端口）；--url 可改连已单独启动的替身
+  - 爬虫输出、缓存、检查点与 .env 写入全部重定向到临时目录，不触碰 data/ 与项目 .env
+  - Token 初始为空：首个请求走替身的 OAuth 登录，--token-ttl 调小可观察运行中的主动刷新
+  - 每个爬虫按全量模式运行（无缓存命中），吞吐 = 替身侧统计的请求数 / 墙钟时间
+
+运行：
+  PYTHONPATH=. python3 tools/bench_scrapers.py                                   # scale=1，无延迟
+  PYTHONPATH=. python3 tools/bench_scrapers.py --scale 0.2 --latency-ms 40 --jitter-ms 20 --error-rate 0.01
+  PYTHONPATH=. python3 tools/bench_scrapers.py --only nwms,bom --concurrency 16 --workers 8 --max-rps 200
+  PYTHONPATH=. python3 tools/bench_scrapers.py --json bench.json                 # 结果另存 JSON 便于对比
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+from upstream_stub import add_stub_arguments, build_from_args, start_stub, stub_env
+
+SCRAPERS = ["inventory", "shop_orders", "nwms", "bom"]
+
+
+def _isolate(tmp: Path) -> None:
+    """把各模块的输出目录 / 缓存 / 检查点 / .env 指到临时目录"""
+    from src.auth import token_manager
+    from src.analysis import build_report
+    from src.scrapers import (bom_scraper, crawl_checkpoint, inventory_scraper, nwms_scraper, page_size,
+                              raw_store, shop_order_scraper, source_digest)
+    raw, cache = tmp / "raw", tmp / "cache"
+    raw.mkdir(parents=True, exist_ok=True)
+    raw_store.RAW_DIR = raw
+    source_digest.RAW_DIR = raw
+    source_digest.DIGEST_PATH = raw / "source_digests.json"
+    build_report.BASE = raw
+    inventory_scraper.OUTPUT_DIR = raw
+    shop_order_scraper.OUTPUT_DIR = raw
+    shop_order_scraper.ORDER_STORE_PATH = cache / "shop_order_store.json"
+    bom_scraper.OUTPUT_DIR = raw
+    bom_scraper.BOM_CACHE_PATH = cache / "bom_cache.json"
+    nwms_scraper.OUTPUT_DIR = raw
+    nwms_scraper.NWMS_CACHE_PATH = cache / "nwms_lines_cache.json"
+    crawl_checkpoint.CHECKPOINT_DIR = cache / "checkpoints"
+    page_size.PAGE_SIZE_CACHE_PATH = cache / "page_sizes.json"
+    token_manager.ENV_FILE = tmp / ".env"
+
+
+def _scraper_jobs(args) -> dict:
+    from src.scrapers import bom_scraper, inventory_scraper, nwms_scraper, shop_order_scraper
+    return {
+        "inventory": lambda: inventory_scraper.run(collect_rows=True),
+        "shop_orders": lambda: shop_order_scraper.run(start_date="2026-01-01 00:00:00"),
+        "nwms": lambda: nwms_scraper.run(start_date="2026-01-01", concurrency=args.concurrency,
+                                         full=True, fetch_scans=args.scan_records),
+        "bom": lambda: bom_scraper.run(workers=args.workers, full=True),
+    }
+
+
+def _stats(server, url: str) -> dict:
+    if server is not None:
+        return server.snapshot_stats()
+    with urllib.request.urlopen(f"{url}/__stats", timeout=5) as resp:
+        return json.loads(resp.read())
+
+
+def _delta(after: dict, before: dict) -> dict:
+    total = {"requests": 0, "errors": 0, "unauthorized": 0, "bytes": 0, "logins": 0}
+    for endpoint, s in after.items():
+        b = before.get(endpoint, {})
+        diff = {k: s.get(k, 0) - b.get(k, 0) for k in ("requests", "errors", "unauthorized", "bytes")}
+        if endpoint == "oauth.authorize":
+            total["logins"] += diff["requests"]
+        elif endpoint.split(".", 1)[0] in ("imes", "nwms", "ssrs"):
+            for k, v in diff.items():
+                total[k] += v
+    return total
+
+
+def run_bench(args) -> list[dict]:
+    server = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        dataset, knobs = build_from_args(args)
+        server = start_stub(dataset, **knobs)
+        base_url = server.base_url
+        print(f"[Bench] 替身 {base_url} | 数据集 {dataset.summary()}")
+
+    # 须在 import src.* 之前设置：各模块在导入时读取上游地址与限速上限
+    os.environ.update(stub_env(base_url))
+    os.environ.update({"IMES_TOKEN": "", "NWMS_TOKEN": "", "IMES_TOKEN_EXPIRES_AT": "", "NWMS_TOKEN_EXPIRES_AT": ""})
+    if args.max_rps:
+        os.environ["IMES_MAX_RPS"] = str(args.max_rps)
+        os.environ["NWMS_MAX_RPS"] = str(args.max_rps)
+
+    tmp = Path(tempfile.mkdtemp(prefix="bench_scrapers_"))
+    _isolate(tmp)
+    from src.scrapers.raw_store import wait_for_persist
+
+    jobs = _scraper_jobs(args)
+    only = [s.strip() for s in args.only.split(",")] if args.only else SCRAPERS
+    # bom 依赖工单快照：单独压 bom 时先静默跑一次工单
+    if "bom" in only and "shop_orders" not in only:
+        with contextlib.redirect_stdout(io.StringIO()):
+            jobs["shop_orders"]()
+
+    results = []
+    try:
+        for name in only:
+            before = _stats(server, base_url)
+            log = io.StringIO()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(log if not args.verbose else sys.stdout):
+                out = jobs[name]()
+                wait_for_persist()
+            wall = time.perf_counter() - started
+            d = _delta(_stats(server, base_url), before)
+            results.append({
+                "scraper": name,
+                "wall_s": round(wall, 2),
+                "records": len(out) if out else 0,
+                "requests": d["requests"],
+                "req_per_s": round(d["requests"] / wall, 1) if wall > 0 else 0.0,
+                "errors_injected": d["errors"],
+                "unauthorized": d["unauthorized"],
+                "logins": d["logins"],
+                "mb": round(d["bytes"] / 1024 / 1024, 2),
+            })
+            rate_lines = [ln for ln in log.getvalue().splitlines()
+                          if ln.startswith(("[RateLimit]", "[Pages]", "[PageSize]"))]
+            for ln in rate_lines:
+                print(f"  {ln}")
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if args.keep:
+            print(f"[Bench] 输出保留在 {tmp}")
+        else:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def print_table(results: list[dict]) -> None:
+    cols = [("scraper", "爬虫"), ("wall_s", "墙钟(s)"), ("requests", "请求数"), ("req_per_s", "req/s"),
+            ("records", "记录数"), ("errors_injected", "注入错误"), ("unauthorized", "401"),
+            ("logins", "登录"), ("mb", "MB")]
+    print("\n" + " | ".join(f"{title:>10}" for _, title in cols))
+    for r in results:
+        print(" | ".join(f"{r[key]!s:>10}" for key, _ in cols))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="在本地替身上压测各爬虫吞吐")
+    add_stub_arguments(parser)
+    parser.add_argument("--url", default=None, help="连接已启动的替身（如 http://127.0.0.1:18080），不再内置启动")
+    parser.add_argument("--only", default=None, help=f"只跑部分爬虫，逗号分隔：{','.join(SCRAPERS)}")
+    parser.add_argument("--concurrency", type=int, default=8, help="NWMS 行明细异步并发数")
+    parser.add_argument("--workers", type=int, default=4, help="BOM 并发拉取数")
+    parser.add_argument("--scan-records", action="store_true", help="NWMS 同时拉取扫码记录")
+    parser.add_argument("--max-rps", type=float, default=None,
+                        help="覆盖 IMES_MAX_RPS / NWMS_MAX_RPS（默认沿用环境变量，即生产限速上限）")
+    parser.add_argument("--json", default=None, help="结果另存为 JSON 文件")
+    parser.add_argument("--keep", action="store_true", help="保留临时输出目录")
+    parser.add_argument("--verbose", action="store_true", help="显示爬虫原始日志")
+    args = parser.parse_args()
+
+    results = run_bench(args)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n[SAVE] {args.json}")
@@ -0,0 +1,140 @@
+"""
+增量分析一致性校验 - 连续多轮随机变更输入，逐轮对比增量分析（src/analysis/incremental.py）与全量计算
+  - 输入同 tools/bench_build_report.py（upstream_stub 合成工单 / BOM / 发料行明细 / 库存），首轮为全量计算
+  - 每轮按 --change 比例随机变更：库存现存量 / 接收时间增删改、工单状态流转（在制 / 待开工 / 完工之间，
+    带动在制 / 待开工 BOM 物料集合变化）、工单移出 IMES 窗口、BOM 用量与总需求、发料行实发量与增删，
+    并把分析时间推后若干小时（预警行库龄）
+  - 逐项比较退料预警行、库存状态行、超发预警行（字段取值、字段顺序、行顺序）与各项计数，报告两种方式的耗时
+  - 任一轮不一致退出码 1
+
+运行：
+  PYTHONPATH=. python3 tools/check_incremental.py
+  PYTHONPATH=. python3 tools/check_incremental.py --scale 10 --rounds 3 --change 0.01
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import contextlib
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+from bench_build_report import build_inputs
+
+STATUSES = ["Se ha iniciado la construcción", "Se puede emitir", "Completado", "Liberado"]
+
+
+def _pick(rnd: random.Random, items: list, share: float) -> list[int]:
+    return rnd.sample(range(len(items)), min(len(items), max(1, int(len(items) * share))))
+
+
+def mutate(inputs: dict, rnd: random.Random, share: float) -> dict:
+    """返回变更后的新一轮输入（复制被改动的记录，不改上一轮对象）"""
+    orders = list(inputs["shop_orders"])
+    for i in _pick(rnd, orders, share):
+        orders[i] = {**orders[i], "statusDesc": rnd.choice(STATUSES), "qtyDone": rnd.randint(0, 100)}
+    for i in sorted(_pick(rnd, orders, share / 4), reverse=True):
+        del orders[i]  # 移出 IMES 窗口
+
+    bom = list(inputs["bom_details"])
+    for i in _pick(rnd, bom, share):
+        bom[i] = {**bom[i], "qty": rnd.choice([1, 2]), "sumQty": rnd.choice([0, 50, 100, 200])}
+    for i in sorted(_pick(rnd, bom, share / 4), reverse=True):
+        del bom[i]
+
+    inventory = list(inputs["inventory"])
+    for i in _pick(rnd, inventory, share):
+        inventory[i] = {**inventory[i], "现存量": f"{rnd.uniform(0, 500):.2f}",
+                        "接收时间": rnd.choice(["", "2025/12/30 8:00:00", "2026/9/1 9:00:00", "2026-10-17"])}
+    for i in sorted(_pick(rnd, inventory, share / 2), reverse=True):
+        del inventory[i]
+    for i in _pick(rnd, inventory, share / 2):
+        inventory.append({**inventory[i], "条码": f"NEW{rnd.randrange(10 ** 8):08d}",
+                          "物料": rnd.choice(inventory)["物料"]})
+
+    details = list(inputs["nwms_issue_details"])
+    for i in _pick(rnd, details, share):
+        details[i] = {**details[i], "actualQuantity": round(rnd.uniform(0, 200), 2)}
+    for i in sorted(_pick(rnd, details, share / 4), reverse=True):
+        del details[i]
+    for i in _pick(rnd, details, share / 4):
+        details.append({**details[i], "_instructionDocId": f"N{rnd.randrange(10 ** 6)}"})
+    return {"shop_orders": orders, "bom_details": bom, "inventory": inventory, "nwms_issue_details": details}
+
+
+def _diff_rows(label: str, a: list[dict], b: list[dict]) -> str:
+    if len(a) != len(b):
+        return f"{label} 行数不同: {len(a)} / {len(b)}"
+    for i, (x, y) in enumerate(zip(a, b)):
+        if list(x.items()) != list(y.items()):
+            return f"{label} 第 {i} 行不同: {x} / {y}"
+    return ""
+
+
+def check_round(inputs: dict, now: datetime) -> tuple[str, dict]:
+    from src.analysis import build_report as br, incremental
+
+    orders = br.load_shop_orders(inputs["shop_orders"])
+    bom_index = br.load_bom(inputs["bom_details"])
+    inventory, _ = br.load_inventory(inputs["inventory"])
+    nwms = br.load_nwms_lines(inputs["nwms_issue_details"])
+
+    seconds = {}
+    started = time.perf_counter()
+    full_inv = br.build_inventory_audit(orders, bom_index, inventory, now)
+    full_issue = br.build_issue_audit(nwms, orders, bom_index)
+    seconds["full"] = time.perf_counter() - started
+    started = time.perf_counter()
+    inc_inv = incremental.inventory_audit(orders, bom_index, inventory, now)
+    inc_issue = incremental.issue_audit(nwms, orders, bom_index)
+    seconds["incremental"] = time.perf_counter() - started
+
+    diff = (_diff_rows("退料预警", full_inv[0], inc_inv[0])
+            or _diff_rows("库存状态", full_inv[1], inc_inv[1])
+            or _diff_rows("超发预警", full_issue[0], inc_issue[0]))
+    if not diff and full_inv[2] != inc_inv[2]:
+        diff = f"分层计数不同: {full_inv[2]} / {inc_inv[2]}"
+    if not diff and full_issue[1:] != inc_issue[1:]:
+        diff = f"发料行计数不同: {full_issue[1:]} / {inc_issue[1:]}"
+    return diff, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量分析一致性校验")
+    parser.add_argument("--scale", type=float, default=1, help="合成规模（1 ≈ 2 万条库存）")
+    parser.add_argument("--rounds", type=int, default=8, help="首轮之后的变更轮数")
+    parser.add_argument("--change", type=float, default=0.02, help="每轮各类输入的变更比例")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    from src.analysis import incremental
+    incremental.reset()
+    rnd = random.Random(args.seed)
+    inputs = build_inputs(args.scale, hot_share=0.2, hot_groups=10)
+    now = datetime(2026, 10, 18, 8, 0, 0)
+
+    ok = True
+    for round_no in range(args.rounds + 1):
+        if round_no:
+            inputs = mutate(inputs, rnd, args.change)
+            now += timedelta(hours=rnd.choice([0, 4, 28]))
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            diff, seconds = check_round(inputs, now)
+        recomputed = " | ".join(line.strip() for line in log.getvalue().splitlines() if "[增量]" in line)
+        print(f"  第 {round_no} 轮 | 全量 {seconds['full']:6.2f}s | 增量 {seconds['incremental']:6.2f}s"
+              f" | {recomputed} | {diff or '一致'}")
+        ok &= not diff
+
+    if not ok:
+        print("[FAIL] 增量分析与全量计算不一致")
+        sys.exit(1)
+    print("[OK] 增量分析与全量计算一致")
+
+
+if __name__ == "__main__":
+    main()
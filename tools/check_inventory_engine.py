@@ -0,0 +1,131 @@
+"""
+库存聚合引擎一致性校验 - 对比 load_inventory 的逐行实现（python）与 NumPy 列式实现（columnar）
+  - 数据：upstream_stub 合成库存（含热点组与重复条码）、手工构造的边界 CSV（空行 / 千分位 / 非数字现存量 / nan /
+    空条码回退 barcode 列 / 空描述 / 首尾空白 / 无线边仓描述列，另一份追加短行），
+    以及 data/raw/inventory_latest.csv（存在时）
+  - 每份数据以 CSV 文件输入运行两个引擎，逐项比较 grouped（组顺序、字段、条码顺序）与 raw_rows，并报告耗时
+    （列式实现只用于 CSV；传入内存行时 load_inventory 总用逐行实现）
+  - 任一不一致退出码 1；未安装 numpy 时退出码 2
+
+运行：
+  PYTHONPATH=. python3 tools/check_inventory_engine.py
+  PYTHONPATH=. python3 tools/check_inventory_engine.py --scales 1,10 --skip-latest
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import csv
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from bench_build_report import build_inputs
+
+EDGE_CSV = (
+    "指定工单,物料,物料描述,现存量,单位,条码,barcode,线边仓,接收时间,最新发料单时间\r\n"
+    "WO1,M1,,\"1,234.50\",PCS,B1,,仓1,2026/2/6 9:57:22,2026-02-07 10:00:00\r\n"
+    "\r\n"
+    " WO1 , M1 ,描述1,2,,B1,,仓2,2026/1/6 9:57:22,\r\n"
+    "WO1,M1,描述X,3,PCS,,BX,,,2026-03-01 00:00:00\r\n"
+    "WO2,M2,,abc,PCS,B2,,仓1,2026/2/6 9:57:22,\r\n"
+    "WO2,M2,,0.01,PCS,B3,,仓1,2026/2/6 9:57:22,\r\n"
+    "WO2,M2,,5,,  ,,,,\r\n"
+    "WO2,M2,,6,,,,,,\r\n"
+    ",M3,,9,PCS,B4,,仓1,,\r\n"
+    "WO3,M3,物料3,nan,PCS,B5,,仓1,2025/12/31 8:00:00,2026-01-01 00:00:00\r\n"
+)
+# 短行（缺失字段为 None）：逐行实现在条码 strip 时报错，只校验列式实现能跑通
+EDGE_SHORT_CSV = EDGE_CSV + "WO3,M3,物料3,1e2\r\n"
+
+
+def _compare(a: tuple, b: tuple) -> str:
+    """返回首个差异描述，一致时返回空串"""
+    (ga, ra), (gb, rb) = a, b
+    if type(ga) is not type(gb):
+        return f"grouped 类型不同: {type(ga).__name__} / {type(gb).__name__}"
+    if list(ga) != list(gb):
+        return f"组顺序不同（{len(ga)} / {len(gb)} 组）"
+    for key, va in ga.items():
+        vb = gb[key]
+        if list(va.items()) != list(vb.items()) and repr(va) != repr(vb):
+            return f"组 {key} 不同: {va} / {vb}"
+    if len(ra) != len(rb):
+        return f"raw_rows 行数不同: {len(ra)} / {len(rb)}"
+    for i, (x, y) in enumerate(zip(ra, rb)):
+        if list(x.items()) != list(y.items()) and repr(x) != repr(y):
+            return f"raw_rows 第 {i} 行不同: {x} / {y}"
+    return ""
+
+
+def check_dataset(label: str, csv_path: Path, tmp: Path) -> bool:
+    from src.analysis import build_report as br
+
+    base = tmp / label
+    base.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(csv_path, base / "inventory_latest.csv")
+    br.BASE = base
+    with open(csv_path, encoding="utf-8-sig") as f:
+        n_rows = sum(1 for _ in csv.DictReader(f))
+
+    results, seconds = {}, {}
+    for engine in ("python", "columnar"):
+        started = time.perf_counter()
+        try:
+            results[engine] = br.load_inventory(engine=engine)
+        except AttributeError as e:
+            results[engine] = e  # 逐行实现不支持短行
+        seconds[engine] = time.perf_counter() - started
+    if isinstance(results["python"], Exception):
+        status = "跳过（逐行实现不支持该输入）"
+        ok = not isinstance(results["columnar"], Exception)
+    else:
+        diff = _compare(results["python"], results["columnar"])
+        ok = not diff
+        status = "一致" if ok else f"不一致: {diff}"
+    print(f"  {label:>12} {n_rows:>7} 行 | python {seconds['python']:6.2f}s"
+          f" | columnar {seconds['columnar']:6.2f}s | {status}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="库存聚合引擎一致性校验")
+    parser.add_argument("--scales", default="0.2,1", help="合成库存规模，逗号分隔（1 ≈ 2 万行）")
+    parser.add_argument("--skip-latest", action="store_true", help="不校验 data/raw/inventory_latest.csv")
+    args = parser.parse_args()
+
+    from src.analysis import build_report as br, inventory_columnar
+    if not inventory_columnar.available():
+        print("[ERROR] 未安装 numpy，无法校验列式实现")
+        sys.exit(2)
+    latest = br.BASE / "inventory_latest.csv"
+
+    ok = True
+    with tempfile.TemporaryDirectory(prefix="check_inventory_") as tmp:
+        tmp = Path(tmp)
+        for label, text in (("edge", EDGE_CSV), ("edge_short", EDGE_SHORT_CSV)):
+            path = tmp / f"{label}.csv"
+            path.write_text(text, encoding="utf-8-sig")
+            ok &= check_dataset(label, path, tmp)
+        for scale in (float(s) for s in args.scales.split(",") if s.strip()):
+            inventory = build_inputs(scale, hot_share=0.2, hot_groups=10)["inventory"]
+            path = tmp / f"synthetic_{scale:g}.csv"
+            with open(path, "w", encoding="utf-8-sig", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(inventory[0].keys()))
+                writer.writeheader()
+                writer.writerows(inventory)
+            ok &= check_dataset(f"scale={scale:g}", path, tmp)
+        if not args.skip_latest and latest.exists():
+            ok &= check_dataset("latest", latest, tmp)
+
+    if not ok:
+        print("[FAIL] 两种实现结果不一致")
+        sys.exit(1)
+    print("[OK] 两种实现结果一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -153,5 +153,64 @@ try:
 except sqlite3.OperationalError as e:
     print(f"[MIGRATE] ❌ 错误: {e}")
 
+# 输入变化检测：kpi_history 新增输入摘要 / unchanged 标记 / 快照所在批次
+for col, coltype in [
+    ("input_digest",  "VARCHAR(64) DEFAULT ''"),
+    ("unchanged",     "INTEGER DEFAULT 0"),
+    ("data_batch_id", "VARCHAR(50) DEFAULT ''"),
+]:
+    try:
+        cursor.execute(f"ALTER TABLE kpi_history ADD COLUMN {col} {coltype};")
+        conn.commit()
+        print(f"[MIGRATE] ✅ kpi_history.{col} 列新增成功")
+    except sqlite3.OperationalError as e:
+        if "duplicate column name" in str(e):
+            print(f"[MIGRATE] ℹ️  kpi_history.{col} 列已存在，跳过")
+        else:
+            print(f"[MIGRATE] ❌ 错误: {e}")
+
+# 上游熔断降级：kpi_history 新增降级标记 / 过期来源
+for col, coltype in [
+    ("degraded",      "INTEGER DEFAULT 0"),
+    ("stale_sources", "VARCHAR(200) DEFAULT ''"),
+]:
+    try:
+        cursor.execute(f"ALTER TABLE kpi_history ADD COLUMN {col} {coltype};")
+        conn.commit()
+        print(f"[MIGRATE] ✅ kpi_history.{col} 列新增成功")
+    except sqlite3.OperationalError as e:
+        if "duplicate column name" in str(e):
+            print(f"[MIGRATE] ℹ️  kpi_history.{col} 列已存在，跳过")
+        else:
+            print(f"[MIGRATE] ❌ 错误: {e}")
+
+# 上游请求指标：新建 upstream_metric_snapshots 表
+try:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS upstream_metric_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id VARCHAR(50) NOT NULL,
+            timestamp DATETIME,
+            endpoint VARCHAR(50),
+            requests INTEGER DEFAULT 0,
+            errors INTEGER DEFAULT 0,
+            rejected INTEGER DEFAULT 0,
+            retries INTEGER DEFAULT 0,
+            bytes INTEGER DEFAULT 0,
+            latency_avg REAL DEFAULT 0.0,
+            latency_p50 REAL DEFAULT 0.0,
+            latency_p95 REAL DEFAULT 0.0,
+            latency_max REAL DEFAULT 0.0,
+            status_counts TEXT DEFAULT '{}',
+            latency_histogram TEXT DEFAULT '[]'
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_upstream_metric_batch_endpoint "
+                   "ON upstream_metric_snapshots (batch_id, endpoint);")
+    conn.commit()
+    print("[MIGRATE] ✅ upstream_metric_snapshots 表已就绪")
+except sqlite3.OperationalError as e:
+    print(f"[MIGRATE] ❌ 错误: {e}")
+
 conn.close()
 print("[MIGRATE] 迁移完成")
@@ -99,7 +99,9 @@ def run_tests():
     else:
         # 直接从最新批次查询
         latest_batch = db_query(
-            "SELECT batch_id FROM kpi_history ORDER BY timestamp DESC LIMIT 1"
+            # unchanged 标记批次的快照在 data_batch_id 指向的批次中
+            "SELECT COALESCE(NULLIF(data_batch_id, ''), batch_id) AS batch_id "
+            "FROM kpi_history ORDER BY timestamp DESC LIMIT 1"
         )
         if latest_batch:
             bid = latest_batch[0]["batch_id"]
@@ -135,7 +137,9 @@ def run_tests():
         results.append(None)
     else:
         latest_batch = db_query(
-            "SELECT batch_id FROM kpi_history ORDER BY timestamp DESC LIMIT 1"
+            # unchanged 标记批次的快照在 data_batch_id 指向的批次中
+            "SELECT COALESCE(NULLIF(data_batch_id, ''), batch_id) AS batch_id "
+            "FROM kpi_history ORDER BY timestamp DESC LIMIT 1"
         )
         if latest_batch:
             bid = latest_batch[0]["batch_id"]
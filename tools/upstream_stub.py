@@ -0,0 +1,481 @@
+"""
+上游系统本地替身 - 离线压测爬虫吞吐用，不访问生产主机 10.80.35.11 / 10.70.35.26
+模拟爬虫实际调用的全部接口：
+  - IMES  工单列表        GET /imes-service/v1/0/shopOrder
+  - IMES  工单 BOM        GET /imes-service/v1/0/shopOrder/bom
+  - NWMS  备料单头表      GET /nwms/v1/9/mt-work-orders/ins_woissue_head
+  - NWMS  发料行明细      GET /nwms/v1/9/mt-work-orders/woissueLineDetail/{instructionDocId}/
+  - NWMS  扫码实发记录    GET /nwms/v1/9/mt-work-orders/woissueLineActualDetail
+  - SSRS  报表 CSV 导出   GET /ReportServer?/imesreport/线边仓库存报表&rs:Format=CSV（不发 NTLM 质询，直接 200）
+  - HZERO OAuth 登录      GET/POST /oauth/login，GET /oauth/oauth/authorize（302 到 redirect_uri#access_token=...）
+  - 计数                  GET /__stats（各接口请求数 / 注入错误数 / 响应字节数）
+IMES/NWMS 接口校验 Bearer Token（由 OAuth 流程签发，过期或未知返回 401，可测 Token 刷新）
+数据集：默认按 --scale 合成（工单/BOM/备料单/行明细/库存互相关联，固定种子可复现）；
+       --from-raw 用 data/raw 下的 latest 快照回放（扫码记录仍为合成）
+可调：--latency-ms / --jitter-ms 每次响应延迟，--error-rate 按比例返回 --error-status，--token-ttl Token 有效期
+
+运行：
+  PYTHONPATH=. python3 tools/upstream_stub.py --port 18080 --scale 1 --latency-ms 30 --error-rate 0.01
+  # 爬虫指向替身（需在进程启动前设置）：
+  export IMES_SERVICE_URL=http://127.0.0.1:18080/imes-service
+  export NWMS_SERVICE_URL=http://127.0.0.1:18080/nwms
+  export SSRS_REPORT_SERVER=http://127.0.0.1:18080/ReportServer
+  export HZERO_OAUTH_URL=http://127.0.0.1:18080/oauth
+一键压测见 tools/bench_scrapers.py
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv
+import io
+import json
+import random
+import secrets
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+ORDER_STATUSES = ["Completado", "Se ha iniciado la construcción", "Se puede emitir", "Liberado"]
+DOC_STATUSES = ["COMPLETED", "COMPLETED", "RELEASED", "CANCEL"]
+INVENTORY_FIELDS = ["指定工单", "物料", "物料描述", "现存量", "单位", "条码", "线边仓描述", "接收时间", "最新发料单时间"]
+
+# scale=1 时各数据集规模（约为生产环境一次全量的量级）
+BASE_SIZES = {
+    "orders": 2000,
+    "bom_per_order": 15,
+    "heads": 3000,
+    "lines_per_head": 8,
+    "inventory": 20000,
+    "materials": 6000,
+}
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# 数据集
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class StubDataset:
+    """替身返回的全部数据：工单、BOM（按工单）、备料单头表（ppStartTime 倒序）、行明细（按备料单）、库存 CSV"""
+
+    def __init__(self, orders, bom_by_order, heads, lines_by_doc, inventory_rows, seed: int = 1):
+        self.orders = sorted(orders, key=lambda o: str(o.get("plannedStartDate") or ""))
+        self.bom_by_order = bom_by_order
+        self.heads = sorted(heads, key=lambda h: str(h.get("ppStartTime") or ""), reverse=True)
+        self.lines_by_doc = lines_by_doc
+        self.seed = seed
+        buf = io.StringIO()
+        fields = list(inventory_rows[0].keys()) if inventory_rows else INVENTORY_FIELDS
+        writer = csv.DictWriter(buf, fieldnames=fields, extrasaction="ignore", lineterminator="\r\n")
+        writer.writeheader()
+        writer.writerows(inventory_rows)
+        self.inventory_csv = buf.getvalue().encode("utf-8-sig")
+        self.inventory_count = len(inventory_rows)
+
+    @classmethod
+    def synthetic(cls, scale: float = 1.0, seed: int = 1) -> "StubDataset":
+        rnd = random.Random(seed)
+        n = {k: max(1, int(v * scale)) for k, v in BASE_SIZES.items()}
+        n["bom_per_order"] = BASE_SIZES["bom_per_order"]
+        n["lines_per_head"] = BASE_SIZES["lines_per_head"]
+        mats = [f"M{i:06d}" for i in range(n["materials"])]
+        day0 = datetime(2026, 1, 1)
+
+        orders, bom_by_order = [], {}
+        for i in range(n["orders"]):
+            so = f"2622{i:08d}"
+            qty = rnd.choice([50, 100, 200, 500])
+            status = rnd.choice(ORDER_STATUSES)
+            orders.append({
+                "shopOrder": so,
+                "site": "2010",
+                "material": f"P{rnd.randint(0, 299):04d}",
+                "statusDesc": status,
+                "qtyOrdered": qty,
+                "qtyDone": qty if status == "Completado" else rnd.randint(0, qty),
+                "plannedStartDate": (day0 + timedelta(days=rnd.randint(0, 180))).strftime("%Y-%m-%d 00:00:00"),
+                "productionLine": f"L{rnd.randint(1, 12):02d}",
+            })
+            rows = []
+            for mat in rnd.sample(mats, min(n["bom_per_order"], len(mats))):
+                unit = rnd.choice([1, 2, 4, 0.5])
+                rows.append({
+                    "shopOrder": so,
+                    "componentGbo": mat,
+                    "componentDesc": f"物料{mat}",
+                    "qty": unit,
+                    "sumQty": unit * qty,
+                    "sendQty": round(unit * qty * rnd.uniform(0.5, 1.2), 2),
+                    "unit": "PCS",
+                })
+            bom_by_order[so] = rows
+
+        heads, lines_by_doc = [], {}
+        for i in range(n["heads"]):
+            doc_id = 100000 + i
+            wos = [rnd.choice(orders)["shopOrder"] for _ in range(rnd.choice([1, 1, 1, 2]))]
+            status = rnd.choice(DOC_STATUSES)
+            heads.append({
+                "instructionDocId": doc_id,
+                "demandListNumber": f"DL{doc_id}",
+                "workOrderNum": ",".join(wos),
+                "productionLine": f"L{rnd.randint(1, 12):02d}",
+                "wareHouse": f"WH{rnd.randint(1, 5)}",
+                "instructionDocStatus": status,
+                "ppStartTime": (day0 + timedelta(days=rnd.randint(0, 180))).strftime("%Y-%m-%d 08:00:00"),
+            })
+            comps = [r["componentGbo"] for wo in wos for r in bom_by_order[wo]]
+            lines = []
+            for j, comp in enumerate(rnd.sample(comps, min(len(comps), n["lines_per_head"]))):
+                demand = rnd.randint(1, 200)
+                lines.append({
+                    "instructionId": doc_id * 100 + j,
+                    "componentCode": comp,
+                    "demandQuantity": demand,
+                    "actualQuantity": round(demand * rnd.uniform(0.6, 1.3), 2) if status != "CANCEL" else 0,
+                    "status": status,
+                    "relatedWoLine": "",
+                })
+            lines_by_doc[str(doc_id)] = lines
+
+        inventory = []
+        for i in range(n["inventory"]):
+            o = rnd.choice(orders)
+            mat = rnd.choice(bom_by_order[o["shopOrder"]])["componentGbo"] if rnd.random() < 0.8 else rnd.choice(mats)
+            inventory.append({
+                "指定工单": o["shopOrder"] if rnd.random() < 0.95 else "",
+                "物料": mat,
+                "物料描述": f"物料{mat}",
+                "现存量": f"{rnd.uniform(0, 500):,.2f}",
+                "单位": "PCS",
+                "条码": f"BC{i:08d}",
+                "线边仓描述": f"线边仓{rnd.randint(1, 5)}",
+                "接收时间": (day0 + timedelta(days=rnd.randint(0, 180), hours=rnd.randint(0, 23))).strftime("%Y/%m/%d %H:%M:%S"),
+                "最新发料单时间": (day0 + timedelta(days=rnd.randint(0, 180))).strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        return cls(orders, bom_by_order, heads, lines_by_doc, inventory, seed=seed)
+
+    @classmethod
+    def from_raw(cls, raw_dir: Path, seed: int = 1) -> "StubDataset":
+        """用 data/raw 下的 latest 快照回放（行明细去掉爬虫附加的 _ 前缀字段后按备料单归组）"""
+        from src.scrapers import raw_store
+        raw_store.RAW_DIR = Path(raw_dir)
+        orders = raw_store.load_latest("shop_orders")
+        bom_by_order = defaultdict(list)
+        for r in raw_store.load_latest("bom_details"):
+            bom_by_order[r.get("shopOrder", "")].append(r)
+        details = raw_store.load_latest("nwms_issue_details")
+        lines_by_doc = defaultdict(list)
+        for ln in details:
+            lines_by_doc[str(ln.get("_instructionDocId", ""))].append(
+                {k: v for k, v in ln.items() if not k.startswith("_")})
+        try:
+            heads = raw_store.load_latest("nwms_issue_heads")
+        except FileNotFoundError:
+            # 没有头表快照时由行明细上附加的头表字段还原
+            heads = {}
+            for ln in details:
+                doc_id = str(ln.get("_instructionDocId", ""))
+                heads.setdefault(doc_id, {
+                    "instructionDocId": doc_id,
+                    "demandListNumber": ln.get("_demandListNumber", ""),
+                    "workOrderNum": ln.get("_workOrderNum", ""),
+                    "productionLine": ln.get("_productionLine", ""),
+                    "wareHouse": ln.get("_wareHouse", ""),
+                    "instructionDocStatus": ln.get("_docStatus", ""),
+                    "ppStartTime": ln.get("_ppStartTime", ""),
+                })
+            heads = list(heads.values())
+        with open(Path(raw_dir) / "inventory_latest.csv", encoding="utf-8-sig") as f:
+            inventory = list(csv.DictReader(f))
+        return cls(orders, dict(bom_by_order), heads, dict(lines_by_doc), inventory, seed=seed)
+
+    def scans_for_line(self, instruction_id: str) -> list[dict]:
+        """扫码记录：按 instructionId 确定性生成 0-3 条"""
+        rnd = random.Random(f"{self.seed}:{instruction_id}")
+        return [{
+            "barcode": f"SC{instruction_id}{k}",
+            "executeQuantity": rnd.randint(1, 50),
+            "executeTime": f"2026-03-{rnd.randint(1, 28):02d} {rnd.randint(0, 23):02d}:00:00",
+            "fromWarehouse": "WMS",
+            "toWarehouse": f"WH{rnd.randint(1, 5)}",
+        } for k in range(rnd.randint(0, 3))]
+
+    def summary(self) -> dict:
+        return {
+            "orders": len(self.orders),
+            "bom_rows": sum(len(v) for v in self.bom_by_order.values()),
+            "heads": len(self.heads),
+            "lines": sum(len(v) for v in self.lines_by_doc.values()),
+            "inventory_rows": self.inventory_count,
+            "inventory_bytes": len(self.inventory_csv),
+        }
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# HTTP 服务
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _page(items: list, params: dict, max_size: int = 0, default_size: int = 100) -> dict:
+    """Spring Data 式分页；max_size > 0 时超出的 size 静默截断为 max_size（偏移按截断后的值计算）"""
+    page = int(params.get("page", 0) or 0)
+    size = int(params.get("size", default_size) or default_size)
+    if max_size > 0:
+        size = min(size, max_size)
+    return {"content": items[page * size:(page + 1) * size], "totalElements": len(items)}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, dataset: StubDataset, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, token_ttl: int = 3600, seed: int = 1,
+                 max_page_size: int = 0):
+        super().__init__(addr, StubHandler)
+        self.dataset = dataset
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token_ttl = token_ttl
+        self.max_page_size = max_page_size
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens: dict[str, float] = {}
+        self.stats = defaultdict(lambda: {"requests": 0, "errors": 0, "unauthorized": 0, "bytes": 0})
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def issue_token(self) -> str:
+        token = secrets.token_hex(16)
+        with self._lock:
+            self._tokens[token] = time.time() + self.token_ttl
+        return token
+
+    def token_valid(self, token: str) -> bool:
+        with self._lock:
+            return self._tokens.get(token, 0) > time.time()
+
+    def roll_error(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self._rnd.random() < self.error_rate
+
+    def delay(self) -> None:
+        if self.latency_ms <= 0 and self.jitter_ms <= 0:
+            return
+        with self._lock:
+            jitter = self._rnd.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+    def count(self, endpoint: str, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[endpoint][key] += n
+
+    def snapshot_stats(self) -> dict:
+        with self._lock:
+            return {k: dict(v) for k, v in self.stats.items()}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 长连接，与真实上游一致（爬虫 Session 复用连接）
+    server: StubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    # ── 响应工具 ──
+    def _send(self, endpoint: str, status: int, body: bytes, content_type: str = "application/json",
+              headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+        self.server.count(endpoint, "bytes", len(body))
+
+    def _json(self, endpoint: str, data, status: int = 200) -> None:
+        self._send(endpoint, status, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def _authorized(self) -> bool:
+        auth = self.headers.get("Authorization", "")
+        scheme, _, token = auth.partition(" ")
+        return scheme.lower() == "bearer" and self.server.token_valid(token.strip())
+
+    # ── 路由 ──
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = unquote(parts.path)
+        params = {k: v[-1] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+
+        if path == "/__stats":
+            return self._json("stub.stats", self.server.snapshot_stats())
+        if path.startswith("/oauth/"):
+            return self._oauth_get(path, params)
+
+        route = self._route(path)
+        if route is None:
+            return self._json("stub.unknown", {"error": f"unknown path {path}"}, status=404)
+        endpoint, handler, needs_token = route
+        self.server.count(endpoint, "requests")
+        self.server.delay()
+        if self.server.roll_error():
+            self.server.count(endpoint, "errors")
+            return self._json(endpoint, {"error": "injected"}, status=self.server.error_status)
+        if needs_token and not self._authorized():
+            self.server.count(endpoint, "unauthorized")
+            return self._json(endpoint, {"error": "invalid_token"}, status=401)
+        handler(endpoint, path, params)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        self.rfile.read(length)
+        path = urlsplit(self.path).path
+        if path == "/oauth/login":
+            self.server.count("oauth.login", "requests")
+            return self._send("oauth.login", 302, b"", "text/html", {"Location": "/oauth/"})
+        self._json("stub.unknown", {"error": f"unknown path {path}"}, status=404)
+
+    def _route(self, path: str):
+        if path == "/imes-service/v1/0/shopOrder":
+            return "imes.shop_order", self._shop_orders, True
+        if path == "/imes-service/v1/0/shopOrder/bom":
+            return "imes.bom", self._bom, True
+        if path == "/nwms/v1/9/mt-work-orders/ins_woissue_head":
+            return "nwms.head", self._heads, True
+        if path.startswith("/nwms/v1/9/mt-work-orders/woissueLineDetail/"):
+            return "nwms.line", self._lines, True
+        if path == "/nwms/v1/9/mt-work-orders/woissueLineActualDetail":
+            return "nwms.scan", self._scans, True
+        if path == "/ReportServer":
+            return "ssrs.export", self._inventory, False
+        return None
+
+    # ── OAuth（HZERO Implicit Flow）──
+    def _oauth_get(self, path: str, params: dict) -> None:
+        if path == "/oauth/login":
+            self.server.count("oauth.login", "requests")
+            return self._send("oauth.login", 200, b"<html>login</html>", "text/html")
+        if path == "/oauth/oauth/authorize":
+            self.server.count("oauth.authorize", "requests")
+            token = self.server.issue_token()
+            redirect = params.get("redirect_uri", "/")
+            location = f"{redirect}#access_token={token}&token_type=bearer&expires_in={self.server.token_ttl}"
+            return self._send("oauth.authorize", 302, b"", "text/html", {"Location": location})
+        return self._send("oauth.other", 200, b"<html></html>", "text/html")
+
+    # ── IMES ──
+    def _shop_orders(self, endpoint, path, params):
+        since = (params.get("plannedStartDate") or "")[:19]
+        orders = self.server.dataset.orders
+        if since:
+            orders = [o for o in orders if str(o.get("plannedStartDate") or "")[:19] >= since]
+        self._json(endpoint, {"success": True, "rows": _page(orders, params, self.server.max_page_size)})
+
+    def _bom(self, endpoint, path, params):
+        rows = self.server.dataset.bom_by_order.get(params.get("shopOrder", ""), [])
+        self._json(endpoint, {"success": True, "rows": rows})
+
+    # ── NWMS ──
+    def _heads(self, endpoint, path, params):
+        heads = self.server.dataset.heads
+        status = params.get("instructionDocStatus")
+        wo = params.get("workOrderNum")
+        if status:
+            heads = [h for h in heads if h.get("instructionDocStatus") == status]
+        if wo:
+            heads = [h for h in heads if wo in str(h.get("workOrderNum") or "")]
+        self._json(endpoint, {"rows": _page(heads, params, self.server.max_page_size, 200)})
+
+    def _lines(self, endpoint, path, params):
+        doc_id = path.rstrip("/").rsplit("/", 1)[-1]
+        self._json(endpoint, {"rows": _page(self.server.dataset.lines_by_doc.get(doc_id, []), params,
+                                             self.server.max_page_size, 200)})
+
+    def _scans(self, endpoint, path, params):
+        scans = self.server.dataset.scans_for_line(params.get("instructionId", ""))
+        self._json(endpoint, {"rows": _page(scans, params, self.server.max_page_size, 200)})
+
+    # ── SSRS ──
+    def _inventory(self, endpoint, path, params):
+        self._send(endpoint, 200, self.server.dataset.inventory_csv, "text/csv; charset=utf-8")
+
+
+def start_stub(dataset: StubDataset, host: str = "127.0.0.1", port: int = 0, **knobs) -> StubServer:
+    """在后台线程启动替身，返回 server（port=0 时自动选端口，见 server.base_url）"""
+    server = StubServer((host, port), dataset, **knobs)
+    threading.Thread(target=server.serve_forever, daemon=True, name="upstream-stub").start()
+    return server
+
+
+def stub_env(base_url: str) -> dict[str, str]:
+    """让爬虫指向替身所需的环境变量（须在 import src.* 之前设置）"""
+    return {
+        "IMES_SERVICE_URL": f"{base_url}/imes-service",
+        "NWMS_SERVICE_URL": f"{base_url}/nwms",
+        "SSRS_REPORT_SERVER": f"{base_url}/ReportServer",
+        "HZERO_OAUTH_URL": f"{base_url}/oauth",
+    }
+
+
+def add_stub_arguments(parser) -> None:
+    parser.add_argument("--scale", type=float, default=1.0, help="合成数据规模倍数（1 ≈ 生产一次全量）")
+    parser.add_argument("--seed", type=int, default=1, help="合成数据与错误注入的随机种子")
+    parser.add_argument("--from-raw", default=None, help="改用该目录下的 latest 快照回放（如 data/raw）")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每次响应的基础延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="延迟随机抖动幅度（±毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="按比例返回错误状态码（0~1）")
+    parser.add_argument("--error-status", type=int, default=503, help="注入错误的状态码（如 503 / 429）")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="签发 Token 的有效期（秒）")
+    parser.add_argument("--max-page-size", type=int, default=0,
+                        help="分页接口单页上限，超出的 size 静默截断（0=不限，用于验证页大小自适应）")
+
+
+def build_from_args(args) -> tuple[StubDataset, dict]:
+    if args.from_raw:
+        dataset = StubDataset.from_raw(Path(args.from_raw), seed=args.seed)
+    else:
+        dataset = StubDataset.synthetic(args.scale, seed=args.seed)
+    knobs = {
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "token_ttl": args.token_ttl,
+        "seed": args.seed,
+        "max_page_size": args.max_page_size,
+    }
+    return dataset, knobs
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="IMES / NWMS / SSRS / OAuth 本地替身（离线压测）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    dataset, knobs = build_from_args(args)
+    server = StubServer((args.host, args.port), dataset, **knobs)
+    print(f"[Stub] 数据集: {dataset.summary()}")
+    print(f"[Stub] 监听 {server.base_url}（延迟 {args.latency_ms}±{args.jitter_ms}ms，错误率 {args.error_rate}）")
+    for k, v in stub_env(server.base_url).items():
+        print(f"  export {k}={v}")
+    print(f"  SSRS 报表: {server.base_url}/ReportServer?{quote('/imesreport/线边仓库存报表')}&rs:Format=CSV")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()